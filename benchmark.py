@@ -0,0 +1,246 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import datastructures as ds
+import dimer as dm
+import hairpin as hp
+import linguisticcomplexity as lc
+import primer as pr
+import scanner
+import seqtools as st
+
+# GC content in percent and fraction of bases in tandem repeats of each synthetic sequence profile
+seqProfiles = {
+    "balanced": (50, 0.0),
+    "gcRich": (70, 0.0),
+    "atRich": (30, 0.0),
+    "repetitive": (50, 0.5),
+}
+defaultLengths = [20, 100, 1000, 10000, 100000]
+
+def generateSeq(length, seed=0, gcContent=50, repeatFraction=0.0):
+    '''
+    Generates a random DNA sequence. The sequence is built from segments of 10 to 40 bases, each either random bases or a
+    tandem repeat of a unit of 2 to 6 random bases.
+
+    length: The length of the sequence (int)
+    seed: The seed for the random number generator (int)
+    gcContent: The expected GC content of the random bases in percent (float)
+    repeatFraction: The expected fraction of bases in tandem repeats (float)
+    Returns: A DNA sequence (str)
+    '''
+    rng = random.Random(seed)
+    weights = [100 - gcContent, gcContent, gcContent, 100 - gcContent]
+
+    def randomBases(n):
+        return "".join(rng.choices("ACGT", weights=weights, k=n))
+
+    segments = []
+    numBases = 0
+    while (numBases < length):
+        segmentLen = rng.randint(10, 40)
+        if (rng.random() < repeatFraction):
+            unit = randomBases(rng.randint(2, 6))
+            segment = (unit * (segmentLen // len(unit) + 1))[:segmentLen]
+        else:
+            segment = randomBases(segmentLen)
+        segments.append(segment)
+        numBases += segmentLen
+    return "".join(segments)[:length]
+
+def measureTime(func):
+    '''
+    Returns: The number of seconds it takes to call func (float)
+    '''
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def measureCallTime(func, repeats=5, minSeconds=0.02):
+    '''
+    Measures the time of one call of a fast function by calling it in a loop long enough to time reliably
+
+    func: The function to measure (function)
+    repeats: The number of loops to time (int)
+    minSeconds: The minimum duration of a loop (float)
+    Returns: The lowest number of seconds per call over the loops (float)
+    '''
+    # Double the number of calls per loop until a loop takes long enough
+    numCalls = 1
+    while (True):
+        seconds = measureTime(lambda: [func() for _ in range(numCalls)])
+        if (seconds >= minSeconds):
+            break
+        numCalls *= 2
+    best = seconds / numCalls
+    for _ in range(repeats - 1):
+        best = min(best, measureTime(lambda: [func() for _ in range(numCalls)]) / numCalls)
+    return best
+
+def measureMemory(func):
+    '''
+    Returns: The number of bytes still allocated by the object that func returns (int)
+    '''
+    tracemalloc.start()
+    try:
+        result = func()
+        memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return memory
+
+def buildTrie(trieClass, seq):
+    trie = trieClass()
+    trie.addSuffixes(seq)
+    return trie
+
+def compareTries(length=1000, seed=0):
+    '''
+    Compares the memory use and construction throughput of SuffixTrie and CompactSuffixTrie on a random sequence
+
+    length: The length of the sequence (int)
+    seed: The seed for the random number generator (int)
+    Returns: A dictionary mapping each trie class name to its nodes, bytes and seconds (dict)
+    '''
+    seq = generateSeq(length, seed)
+    results = {}
+    for trieClass in (ds.SuffixTrie, ds.CompactSuffixTrie):
+        results[trieClass.__name__] = {
+            "nodes": buildTrie(trieClass, seq).getEdges() + 1,
+            "bytes": measureMemory(lambda: buildTrie(trieClass, seq)),
+            "seconds": measureTime(lambda: buildTrie(trieClass, seq)),
+        }
+    return results
+
+def calcPossHairpinGibbs(seq):
+    # Builds every hairpin and calls calcTotalGibbs directly so that the cached totalGibbs is not what gets measured
+    return [hairpin.calcTotalGibbs() for hairpin in hp.createPossHairpins(seq)]
+
+def createFullDimer(seq):
+    # Aligns the sequence with a second random sequence of the same length over their whole length
+    return dm.createDimerAtOffset(seq, generateSeq(len(seq), seed=len(seq)), 0)
+
+# Each benchmark maps to a function preparing its input from a sequence, the function measured on that input and the longest
+# sequence it is run on. createPossHairpins builds O(n) hairpins costing O(n) each, so it stops well short of 100 kb.
+benchmarks = {
+    "primer": (lambda seq: seq, lambda seq: pr.Primer(seq, 0, len(seq) - 1), None),
+    "meltTemp": (lambda seq: seq, pr.Primer.calcMeltTemp, None),
+    "gcContent": (lambda seq: seq, pr.Primer.calcGCContent, None),
+    "hairpins": (lambda seq: seq, calcPossHairpinGibbs, 1000),
+    "linComp": (lambda seq: seq, lc.calcLinComp, None),
+    "scoreDimer": (createFullDimer, dm.calcScoreDimer, None),
+    "compSeq": (lambda seq: seq, st.getCompSeq, None),
+    "windowHairpins": (lambda seq: seq, lambda seq: scanner.scanHairpinGibbs(seq, 25), None),
+}
+
+def runSuite(names=None, profiles=None, lengths=None, seed=0, repeats=5, log=None):
+    '''
+    Runs the benchmarks on synthetic sequences of every profile and length
+
+    names: The benchmarks to run, or None for all of them (list of str)
+    profiles: The sequence profiles to use, or None for all of them (list of str)
+    lengths: The sequence lengths to use, or None for defaultLengths (list of int)
+    seed: The seed for the sequence generator (int)
+    repeats: The number of timing loops per measurement (int)
+    log: A text file object to report progress to, or None (file)
+    Returns: A dictionary mapping "name/profile/length" to the seconds per call (dict)
+    '''
+    results = {}
+    for name in names or benchmarks:
+        prepare, func, maxLength = benchmarks[name]
+        for profile in profiles or seqProfiles:
+            gcContent, repeatFraction = seqProfiles[profile]
+            for length in lengths or defaultLengths:
+                if (maxLength is not None and length > maxLength):
+                    continue
+                arg = prepare(generateSeq(length, seed, gcContent, repeatFraction))
+                key = f"{name}/{profile}/{length}"
+                results[key] = measureCallTime(lambda: func(arg), repeats)
+                if (log is not None):
+                    print(f"{key}: {results[key] * 1e6:.1f} us", file=log)
+    return results
+
+def saveBaseline(results, path):
+    '''
+    Writes benchmark results to a JSON file along with the machine they were measured on
+
+    results: The results from runSuite (dict)
+    path: The path of the JSON file (str)
+    '''
+    baseline = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+    with open(path, "w") as handle:
+        json.dump(baseline, handle, indent=2, sort_keys=True)
+
+def loadBaseline(path):
+    '''
+    Returns: The results stored in a JSON file written by saveBaseline (dict)
+    '''
+    with open(path) as handle:
+        return json.load(handle)["results"]
+
+def compareResults(baseline, results, threshold=10.0):
+    '''
+    Compares benchmark results against a baseline. Benchmarks missing from either are skipped.
+
+    baseline: The baseline results (dict)
+    results: The new results (dict)
+    threshold: The percentage by which a benchmark has to slow down to count as a regression (float)
+    Returns: A list of (key, baseline seconds, new seconds, percent change, whether it regressed) tuples (list)
+    '''
+    comparison = []
+    for key in results:
+        if (key in baseline):
+            change = (results[key] / baseline[key] - 1) * 100
+            comparison.append((key, baseline[key], results[key], change, change > threshold))
+    return comparison
+
+def printTries():
+    results = compareTries()
+    for name, result in results.items():
+        print(f"{name}: {result['nodes']} nodes, {result['bytes'] / 2 ** 20:.1f} MiB, {result['seconds']:.2f} s")
+    old = results["SuffixTrie"]
+    new = results["CompactSuffixTrie"]
+    print(f"Memory reduction: {old['bytes'] / new['bytes']:.1f}x, speedup: {old['seconds'] / new['seconds']:.1f}x")
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of the primer designer on synthetic sequences")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("tries", help="compare the suffix trie implementations (the default)")
+    for command, helpText in (("run", "run the suite and optionally save the results as a baseline"),
+                              ("compare", "run the suite and fail if it is slower than a baseline")):
+        subparser = subparsers.add_parser(command, help=helpText)
+        if (command == "compare"):
+            subparser.add_argument("baseline", help="JSON baseline written by the run command")
+            subparser.add_argument("--threshold", type=float, default=10.0,
+                                   help="percentage slowdown that counts as a regression")
+        subparser.add_argument("-o", "--output", help="JSON file to save the results to")
+        subparser.add_argument("--benchmarks", nargs="+", choices=list(benchmarks), help="benchmarks to run")
+        subparser.add_argument("--profiles", nargs="+", choices=list(seqProfiles), help="sequence profiles to use")
+        subparser.add_argument("--lengths", nargs="+", type=int, help="sequence lengths to use")
+        subparser.add_argument("--seed", type=int, default=0, help="seed for the sequence generator")
+        subparser.add_argument("--repeats", type=int, default=5, help="number of timing loops per measurement")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if (args.command is None or args.command == "tries"):
+        printTries()
+        return
+    results = runSuite(args.benchmarks, args.profiles, args.lengths, args.seed, args.repeats, sys.stderr)
+    if (args.output is not None):
+        saveBaseline(results, args.output)
+    if (args.command == "compare"):
+        comparison = compareResults(loadBaseline(args.baseline), results, args.threshold)
+        regressions = [row for row in comparison if row[4]]
+        for key, old, new, change, isRegression in comparison:
+            print(f"{key:<32}{old * 1e6:>12.1f} us{new * 1e6:>12.1f} us{change:>+9.1f}%{'  REGRESSION' if isRegression else ''}")
+        if (regressions):
+            sys.exit(f"{len(regressions)} benchmarks regressed by more than {args.threshold}%")
+
+if __name__ == "__main__":
+    main()
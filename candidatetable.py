@@ -0,0 +1,382 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import struct
+import sys
+import numpy as np
+import linguisticcomplexity as lc
+import scanner
+import seqtools as st
+
+# File layout: a header of magic, version, index offset and index length, then each column as a raw array aligned to 8 bytes,
+# then the templates packed four bases to a byte by seqtools.packCodes, then a JSON index of the columns and records.
+magic = b"PDCT"
+formatVersion = 1
+headerFormat = "<4sIQQ"
+headerSize = struct.calcsize(headerFormat)
+# Columns of a table and their types. record indexes the record names, and hairpinGibbs and linComp are NaN when not calculated.
+columnTypes = {"record": np.int32, "start": np.int64, "end": np.int64, "length": np.int16, "meltTemp": np.float64,
+               "gcContent": np.float64, "gcInClamp": np.int8, "hairpinGibbs": np.float64, "linComp": np.float64}
+exportColumns = ["record", "start", "end", "length", "seq", "meltTemp", "gcContent", "gcInClamp", "hairpinGibbs", "linComp"]
+
+def writeTableFile(path, columnBlocks, records, templateBlocks):
+    '''
+    Writes a candidate table file from blocks of bytes, so neither the columns nor the templates need to be in memory at once
+
+    path: The path of the file to write (str)
+    columnBlocks: A function returning the blocks of bytes of a column given its name (function)
+    records: The name, length and offset into the packed templates of each record (list of dict)
+    templateBlocks: The blocks of bytes of the packed templates (iterable of bytes)
+    Returns: The number of rows written (int)
+    '''
+    columns = []
+    with open(path, "wb") as handle:
+        handle.write(struct.pack(headerFormat, magic, formatVersion, 0, 0))
+        for name, dtype in columnTypes.items():
+            handle.write(b"\0" * (-handle.tell() % 8))
+            offset = handle.tell()
+            for block in columnBlocks(name):
+                handle.write(block)
+            columns.append({"name": name, "dtype": np.dtype(dtype).str, "offset": offset,
+                            "numRows": (handle.tell() - offset) // np.dtype(dtype).itemsize})
+        numRows = columns[0]["numRows"]
+        if (any(column["numRows"] != numRows for column in columns)):
+            raise ValueError("Every column must have the same number of rows")
+        templateOffset = handle.tell()
+        for block in templateBlocks:
+            handle.write(block)
+        index = json.dumps({"numRows": numRows, "columns": columns, "records": records, "templateOffset": templateOffset,
+                            "templateLen": handle.tell() - templateOffset}).encode("utf-8")
+        indexOffset = handle.tell()
+        handle.write(index)
+        handle.seek(0)
+        handle.write(struct.pack(headerFormat, magic, formatVersion, indexOffset, len(index)))
+    return numRows
+
+class CandidateTable:
+    '''
+    Describes candidate windows as one NumPy array per metric instead of one object per candidate. Sequences are not stored per
+    candidate; they are read from the 2-bit packed templates by start and end when needed. A table opened from a file is
+    memory-mapped, so its columns are views of the file and nothing is read until it is used.
+
+    columns: The array of each column of columnTypes, all of equal length (dict mapping str to np.ndarray)
+    records: The name, length and offset into template of each record, indexed by the record column (list of dict)
+    template: A NumPy uint8 array of the packed bases of every record, each starting on a byte
+    '''
+    def __init__(self, columns, records, template):
+        self.columns = columns
+        self.records = records
+        self.template = template
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Opens a table written by CandidateTableWriter or save without copying it into memory
+
+        path: The path of the file (str)
+        Returns: The table (CandidateTable)
+        '''
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        fileMagic, version, indexOffset, indexLen = struct.unpack(headerFormat, data[:headerSize].tobytes())
+        if (fileMagic != magic):
+            raise ValueError(f"{path} is not a candidate table file")
+        if (version != formatVersion):
+            raise ValueError(f"Unsupported candidate table file version {version}")
+        index = json.loads(data[indexOffset:indexOffset + indexLen].tobytes())
+        columns = {}
+        for column in index["columns"]:
+            dtype = np.dtype(column["dtype"])
+            columns[column["name"]] = data[column["offset"]:column["offset"] + column["numRows"] * dtype.itemsize].view(dtype)
+        template = data[index["templateOffset"]:index["templateOffset"] + index["templateLen"]]
+        return cls(columns, index["records"], template)
+
+    def __len__(self):
+        return len(self.columns["start"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def getRecordNames(self):
+        return [record["name"] for record in self.records]
+
+    def getSeq(self, i):
+        '''
+        Returns: The bases of candidate i (str)
+        '''
+        record = self.records[int(self.columns["record"][i])]
+        start = int(self.columns["start"][i])
+        end = int(self.columns["end"][i])
+        packed = self.template[record["templateOffset"] + start // 4:record["templateOffset"] + end // 4 + 1]
+        codes = st.unpackCodes(packed, end // 4 * 4 + 4 - start // 4 * 4)[start % 4:start % 4 + end - start + 1]
+        return codes.tobytes().translate(st.decodeTable).decode("ascii")
+
+    def select(self, mask):
+        '''
+        Selects some of the candidates of the table, sharing its templates
+
+        mask: A boolean or index array of the candidates to keep (np.ndarray)
+        Returns: The selected candidates (CandidateTable)
+        '''
+        return CandidateTable({name: column[mask] for name, column in self.columns.items()}, self.records, self.template)
+
+    def filterRange(self, name, minValue=None, maxValue=None):
+        '''
+        Keeps the candidates whose value of a column is within a range. NaN values never pass a bound.
+
+        name: The name of the column (str)
+        minValue: The lowest value to keep, or None for no lower bound (float)
+        maxValue: The highest value to keep, or None for no upper bound (float)
+        Returns: The candidates in range, in the same order (CandidateTable)
+        '''
+        column = self.columns[name]
+        mask = np.ones(len(column), dtype=bool)
+        if (minValue is not None):
+            mask &= column >= minValue
+        if (maxValue is not None):
+            mask &= column <= maxValue
+        return self.select(mask)
+
+    def sortBy(self, names, descending=False):
+        '''
+        Sorts the candidates by one or more columns with a stable sort, so candidates with equal keys keep their order
+
+        names: The name of the column to sort by, or a list of names where earlier columns take precedence (str or list of str)
+        descending: Whether to sort from highest to lowest (bool)
+        Returns: The sorted candidates (CandidateTable)
+        '''
+        if (isinstance(names, str)):
+            names = [names]
+        keys = [-self.columns[name] if descending else self.columns[name] for name in reversed(names)]
+        return self.select(np.lexsort(keys))
+
+    def iterRows(self, blockSize=65536):
+        '''
+        Generates the candidates as rows of exportColumns, converting one block of rows at a time
+
+        blockSize: The number of rows converted at a time (int)
+        Returns: A generator of rows (generator of tuple)
+        '''
+        names = self.getRecordNames()
+        for blockStart in range(0, len(self), blockSize):
+            block = {name: column[blockStart:blockStart + blockSize].tolist() for name, column in self.columns.items()}
+            for i in range(len(block["start"])):
+                yield (names[block["record"][i]], block["start"][i], block["end"][i], block["length"][i],
+                       self.getSeq(blockStart + i), block["meltTemp"][i], block["gcContent"][i], block["gcInClamp"][i],
+                       block["hairpinGibbs"][i], block["linComp"][i])
+
+    def writeTSV(self, handle, blockSize=65536):
+        '''
+        Streams the candidates to a tab-separated file, with empty fields for metrics that were not calculated
+
+        handle: A text file object to write to
+        blockSize: The number of rows converted at a time (int)
+        Returns: The number of candidates written (int)
+        '''
+        handle.write("\t".join(exportColumns) + "\n")
+        numRows = 0
+        for row in self.iterRows(blockSize):
+            handle.write("\t".join(("" if math.isnan(value) else f"{value:.2f}") if isinstance(value, float) else str(value)
+                                   for value in row) + "\n")
+            numRows += 1
+        return numRows
+
+    def writeJSONL(self, handle, blockSize=65536):
+        '''
+        Streams the candidates as one JSON object per line, with null for metrics that were not calculated
+
+        handle: A text file object to write to
+        blockSize: The number of rows converted at a time (int)
+        Returns: The number of candidates written (int)
+        '''
+        numRows = 0
+        for row in self.iterRows(blockSize):
+            handle.write(json.dumps({name: None if isinstance(value, float) and math.isnan(value) else value
+                                     for name, value in zip(exportColumns, row)}) + "\n")
+            numRows += 1
+        return numRows
+
+    def save(self, path, blockSize=1 << 20):
+        '''
+        Writes the table to a file that open can memory-map, only keeping the records its candidates use
+
+        path: The path of the file to write (str)
+        blockSize: The number of rows written at a time (int)
+        Returns: The number of candidates written (int)
+        '''
+        used = np.unique(self.columns["record"]).tolist()
+        newIndexes = np.zeros(len(self.records), dtype=np.int32)
+        newIndexes[used] = np.arange(len(used))
+        records = []
+        templateOffset = 0
+        for i in used:
+            record = self.records[i]
+            numBytes = (record["length"] + 3) // 4
+            records.append({"name": record["name"], "length": record["length"], "templateOffset": templateOffset})
+            templateOffset += numBytes
+
+        def columnBlocks(name):
+            column = self.columns[name]
+            for blockStart in range(0, len(column), blockSize):
+                block = column[blockStart:blockStart + blockSize]
+                if (name == "record"):
+                    block = newIndexes[block]
+                yield np.ascontiguousarray(block, dtype=columnTypes[name]).tobytes()
+
+        templateBlocks = (self.template[self.records[i]["templateOffset"]:
+                                        self.records[i]["templateOffset"] + (self.records[i]["length"] + 3) // 4].tobytes()
+                          for i in used)
+        return writeTableFile(path, columnBlocks, records, templateBlocks)
+
+class CandidateTableWriter:
+    '''
+    Streams candidates from the scans of template chunks into a candidate table file. Each column and the packed templates are
+    spilled to their own part file as chunks arrive, and close joins them, so memory use does not grow with the number of
+    candidates.
+
+    path: The path of the table file to write (str)
+    calcStructure: Whether to calculate the hairpinGibbs and linComp columns, which costs a sliding hairpin scan of each chunk
+    and a substring count per candidate (bool)
+    '''
+    def __init__(self, path, calcStructure=False):
+        self.path = path
+        self.calcStructure = calcStructure
+        self.partDir = path + ".parts"
+        os.makedirs(self.partDir, exist_ok=True)
+        self.columnFiles = {name: open(os.path.join(self.partDir, f"{name}.bin"), "wb") for name in columnTypes}
+        self.templateFile = open(os.path.join(self.partDir, "template.bin"), "wb")
+        self.records = []
+        self.recordIndexes = {}
+        self.templateLen = 0
+        # Bases of the current record left over after packing whole bytes
+        self.leftover = np.zeros(0, dtype=np.uint8)
+        self.numRows = 0
+
+    def addTemplate(self, chunk):
+        '''
+        Appends the bases a chunk owns to the packed templates. Must be called for every chunk of a record in order, including
+        chunks too short to have candidates.
+
+        chunk: A chunk of a FASTA or 2-bit packed file (FastaChunk)
+        '''
+        if (chunk.start == 0):
+            self.recordIndexes[chunk.name] = len(self.records)
+            self.records.append({"name": chunk.name, "length": 0, "templateOffset": self.templateLen})
+        seq = chunk.seq if chunk.isLast else chunk.seq[:chunk.numOwned]
+        codes = np.frombuffer(seq.encode("ascii").translate(st.encodeTable), dtype=np.uint8).copy()
+        # Candidates never contain bases other than A, C, G and T, so those are stored as A
+        codes[codes > 3] = 0
+        codes = np.concatenate([self.leftover, codes])
+        numWhole = len(codes) if chunk.isLast else len(codes) // 4 * 4
+        packed = st.packCodes(codes[:numWhole])
+        self.templateFile.write(packed)
+        self.templateLen += len(packed)
+        self.leftover = codes[numWhole:]
+        self.records[-1]["length"] = chunk.start + len(seq)
+
+    def iterTemplateChunks(self, chunks):
+        '''
+        Passes chunks through while adding each to the templates, for wrapping the chunks given to a scan
+
+        chunks: The chunks of a file (iterable of FastaChunk)
+        Returns: The same chunks (generator of FastaChunk)
+        '''
+        for chunk in chunks:
+            self.addTemplate(chunk)
+            yield chunk
+
+    def addScan(self, chunk, scan):
+        '''
+        Appends the candidates of a chunk. The chunk must already have been added with addTemplate.
+
+        chunk: The chunk that was scanned (FastaChunk)
+        scan: The metrics of the candidates of the chunk, with locations on the chunk (WindowScan)
+        '''
+        numRows = len(scan)
+        values = {"record": np.full(numRows, self.recordIndexes[chunk.name]), "start": chunk.start + scan.start,
+                  "end": chunk.start + scan.end, "length": scan.length, "meltTemp": scan.meltTemp,
+                  "gcContent": scan.gcContent, "gcInClamp": scan.gcInClamp,
+                  "hairpinGibbs": np.full(numRows, np.nan), "linComp": np.full(numRows, np.nan)}
+        if (self.calcStructure and numRows > 0):
+            # Hairpins of every window come from one sliding scan of the chunk per length
+            for length in np.unique(scan.length).tolist():
+                isLength = scan.length == length
+                values["hairpinGibbs"][isLength] = scanner.scanHairpinGibbs(chunk.seq, length)[scan.start[isLength]]
+            for i, (start, end) in enumerate(zip(scan.start.tolist(), scan.end.tolist())):
+                values["linComp"][i] = lc.calcLinComp(chunk.seq[start:end + 1])
+        for name, dtype in columnTypes.items():
+            self.columnFiles[name].write(np.ascontiguousarray(values[name], dtype=dtype).tobytes())
+        self.numRows += numRows
+
+    def close(self):
+        '''
+        Joins the part files into the table file and removes them
+
+        Returns: The number of candidates written (int)
+        '''
+        try:
+            for handle in list(self.columnFiles.values()) + [self.templateFile]:
+                handle.close()
+
+            def readBlocks(fileName):
+                with open(os.path.join(self.partDir, fileName), "rb") as handle:
+                    while (True):
+                        block = handle.read(1 << 24)
+                        if (not block):
+                            break
+                        yield block
+
+            return writeTableFile(self.path, lambda name: readBlocks(f"{name}.bin"), self.records, readBlocks("template.bin"))
+        finally:
+            shutil.rmtree(self.partDir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if (excType is None):
+            self.close()
+        else:
+            for handle in list(self.columnFiles.values()) + [self.templateFile]:
+                handle.close()
+            shutil.rmtree(self.partDir, ignore_errors=True)
+
+def parseRange(text):
+    '''
+    Helper function for main. Parses a filter of the form column:min:max where either bound may be empty.
+
+    text: The filter (str)
+    Returns: The column name and its bounds (tuple)
+    '''
+    parts = text.split(":")
+    if (len(parts) != 3 or parts[0] not in columnTypes):
+        raise argparse.ArgumentTypeError(f"Expected column:min:max with a column of {', '.join(columnTypes)}: {text}")
+    return parts[0], float(parts[1]) if parts[1] else None, float(parts[2]) if parts[2] else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Filters, sorts and exports a candidate table written by main.py --table")
+    parser.add_argument("table", help="candidate table file")
+    parser.add_argument("-o", "--output", default="-", help="file to export to, or - for standard output")
+    parser.add_argument("--format", choices=["tsv", "jsonl"], default="tsv", help="export format")
+    parser.add_argument("--filter", type=parseRange, action="append", default=[],
+                        help="keep candidates with column between min and max, as column:min:max; may be repeated")
+    parser.add_argument("--sort", action="append", default=[], choices=list(columnTypes),
+                        help="column to sort by; may be repeated, earlier columns first")
+    parser.add_argument("--descending", action="store_true", help="sort from highest to lowest")
+    args = parser.parse_args(argv)
+    table = CandidateTable.open(args.table)
+    for name, minValue, maxValue in args.filter:
+        table = table.filterRange(name, minValue, maxValue)
+    if (args.sort):
+        table = table.sortBy(args.sort, args.descending)
+    outHandle = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        numRows = table.writeTSV(outHandle) if args.format == "tsv" else table.writeJSONL(outHandle)
+    finally:
+        if (outHandle is not sys.stdout):
+            outHandle.close()
+    print(f"Exported {numRows} candidates", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
+from array import array
 from dataclasses import dataclass
+from seqtools import baseToCode, codeToBase
+import profiling as prof
 
 @dataclass
 class Hairpin:
@@ -65,6 +68,7 @@ class SuffixTrie:
         self.edges = 0
 
     def addWord(self, word, position):
+        numEdges = self.edges
         curNode = self.root
         # Loop through all the letters of the word
         for j in range(len(word)):
@@ -75,7 +79,10 @@ class SuffixTrie:
             curNode = curNode.getNextNode(word[j])
         # Set the position of the last node indicating where the word can be found
         curNode.setPosition(position)
+        if (prof.activeProfiler is not None):
+            prof.count("trieNodes", self.edges - numEdges)
     
+    @prof.timed("trieConstruction")
     def addSuffixes(self, word):
         #Add each suffix to the trie
         for i in range(len(word)):
@@ -99,3 +106,102 @@ class SuffixTrie:
 
 
     
+
+
+# Children of a newly created CompactSuffixTrie node
+emptyChildren = array("i", [-1] * 4)
+
+class CompactSuffixTrie:
+    '''
+    A suffix trie over DNA bases with the same interface as SuffixTrie. Nodes are integer indexes rather than objects: the
+    children of node i are stored in children[4 * i:4 * i + 4] indexed by the 2-bit code of the base, and its position is
+    stored in positions[i], so each node costs 20 bytes instead of a Python object plus a dict.
+    '''
+    def __init__(self):
+        # Node 0 is the root. -1 marks a missing child or a node without a position.
+        self.children = array("i", [-1] * 4)
+        self.positions = array("i", [-1])
+        self.edges = 0
+
+    def addWord(self, word, position):
+        children = self.children
+        numEdges = self.edges
+        curNode = 0
+        # Encode the whole word first so that a word with an unsupported letter leaves the trie unchanged
+        codes = [baseToCode.get(letter) for letter in word]
+        if (None in codes):
+            raise ValueError(f"CompactSuffixTrie only supports the bases A, C, G and T, got {word[codes.index(None)]!r}")
+        # Loop through all the letters of the word
+        for code in codes:
+            slot = 4 * curNode + code
+            nextNode = children[slot]
+            # Create a child node if the letter does not have one yet
+            if (nextNode == -1):
+                nextNode = len(self.positions)
+                children[slot] = nextNode
+                children.extend(emptyChildren)
+                self.positions.append(-1)
+                self.edges += 1
+            curNode = nextNode
+        # Set the position of the last node indicating where the word can be found
+        self.positions[curNode] = position
+        if (prof.activeProfiler is not None):
+            prof.count("trieNodes", self.edges - numEdges)
+
+    @prof.timed("trieConstruction")
+    def addSuffixes(self, word):
+        #Add each suffix to the trie
+        for i in range(len(word)):
+            self.addWord(word[i:], i)
+
+    def getEdges(self):
+        return self.edges
+
+    def getNumNodes(self):
+        return len(self.positions)
+
+    def getNode(self, word):
+        '''
+        Follows a word from the root of the trie
+
+        word: A DNA sequence (str)
+        Returns: The index of the node the word ends at, or None if the word is not in the trie (int)
+        '''
+        curNode = 0
+        for letter in word:
+            code = baseToCode.get(letter)
+            if (code is None or self.children[4 * curNode + code] == -1):
+                return None
+            curNode = self.children[4 * curNode + code]
+        return curNode
+
+    def getPosition(self, word):
+        '''
+        Gets the position recorded for a word
+
+        word: A DNA sequence (str)
+        Returns: The position where the word was added, or None if no word ends at its node (int)
+        '''
+        node = self.getNode(word)
+        if (node is None or self.positions[node] == -1):
+            return None
+        return self.positions[node]
+
+    def getMemoryUsage(self):
+        '''
+        Returns: The number of bytes used by the node arrays (int)
+        '''
+        return self.children.itemsize * len(self.children) + self.positions.itemsize * len(self.positions)
+
+    # Debugger method to print out paths of the trie
+    def printPathsRoot(self):
+        self.printPaths(0, "")
+
+    # Helper method for printPathsRoot
+    def printPaths(self, node, word):
+        nextNodes = [(codeToBase[code], self.children[4 * node + code]) for code in range(4) if self.children[4 * node + code] != -1]
+        # Base case
+        if len(nextNodes) == 0:
+            print(word)
+        for key, nextNode in nextNodes:
+            self.printPaths(nextNode, word + key)
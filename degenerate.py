@@ -0,0 +1,351 @@
+from functools import cached_property
+import math
+import numpy as np
+import seqtools as st
+import nndata as nn
+import dimer as dm
+import hairpin as hp
+import meltingtemp as mt
+import primer as pr
+
+# 4-bit masks of the bases each IUPAC code stands for, with one bit per base: A=1, C=2, G=4, T=8. Two degenerate bases can pair
+# if the AND of one mask with the complement of the other is not zero.
+baseMasks = {"A": 1, "C": 2, "G": 4, "T": 8, "R": 5, "Y": 10, "S": 6, "W": 9, "K": 12, "M": 3, "B": 14, "D": 13, "H": 11, "V": 7,
+             "N": 15}
+maskToBase = {mask: base for base, mask in baseMasks.items()}
+# Translates IUPAC bases of either case to masks, and anything else to 0
+maskEncodeTable = bytes(baseMasks.get(chr(char).upper(), 0) for char in range(256))
+# Complement of each mask, which swaps the A and T bits and the C and G bits
+compMasks = np.array([((mask & 1) << 3) | ((mask & 8) >> 3) | ((mask & 2) << 1) | ((mask & 4) >> 1) for mask in range(16)],
+                     dtype=np.uint8)
+# Number of bases each mask stands for
+maskSizes = np.array([bin(mask).count("1") for mask in range(16)], dtype=np.int64)
+gcMask = baseMasks["S"]
+atMask = baseMasks["W"]
+# Bit of each 2-bit base code
+codeMasks = np.array([1 << code for code in range(4)], dtype=np.uint8)
+
+# Chain tables over the 16 states 4 * code1 + code2 of a pair of aligned bases, for the dimer and hairpin stem recurrences
+pairStateCodes1 = np.repeat(np.arange(4), 4)
+pairStateCodes2 = np.tile(np.arange(4), 4)
+isMatchState = pairStateCodes1 + pairStateCodes2 == 3
+isGCCode = (np.arange(4) == st.baseToCode["G"]) | (np.arange(4) == st.baseToCode["C"])
+
+def encodeMasks(seq):
+    '''
+    Encodes a degenerate DNA sequence as one 4-bit base mask per byte. Lowercase bases are accepted.
+
+    seq: A DNA sequence of IUPAC bases (str)
+    Returns: A NumPy uint8 array of base masks
+    '''
+    masks = np.frombuffer(str(seq).encode("ascii").translate(maskEncodeTable), dtype=np.uint8)
+    if (len(masks) > 0 and masks.min() == 0):
+        invalid = sorted(set(base for base in str(seq) if base.upper() not in baseMasks))
+        raise ValueError(f"Cannot encode bases other than IUPAC codes: {', '.join(invalid)}")
+    return masks
+
+def decodeMasks(masks):
+    '''
+    Returns: The IUPAC bases of an array of base masks (str)
+    '''
+    return "".join(maskToBase[mask] for mask in masks.tolist())
+
+def getRevCompMasks(masks):
+    return compMasks[masks[::-1]]
+
+def calcNumExpansions(seq):
+    '''
+    Returns: The number of concrete sequences a degenerate sequence stands for (int)
+    '''
+    return math.prod(maskSizes[encodeMasks(seq)].tolist())
+
+def canPair(masks1, masks2):
+    '''
+    Checks which aligned degenerate bases can pair, where masks1[i] is aligned antiparallel with masks2[i]
+
+    masks1: A NumPy uint8 array of base masks
+    masks2: A NumPy uint8 array of base masks of the same length
+    Returns: Whether some base of each mask of masks1 is complementary to some base of the mask of masks2 (np.ndarray)
+    '''
+    return (masks1 & compMasks[masks2]) != 0
+
+def mustPair(masks1, masks2):
+    '''
+    Checks which aligned degenerate bases always pair, which is only when both stand for one base and those are complementary
+
+    masks1: A NumPy uint8 array of base masks
+    masks2: A NumPy uint8 array of base masks of the same length
+    Returns: Whether every base of each mask of masks1 is complementary to every base of the mask of masks2 (np.ndarray)
+    '''
+    return (masks1 == compMasks[masks2]) & (maskSizes[masks1] == 1)
+
+def calcGCCountRange(masks):
+    '''
+    Returns: The lowest and highest number of G and C bases of any expansion of the masks (tuple of int)
+    '''
+    return int(((masks & atMask) == 0).sum()), int(((masks & gcMask) != 0).sum())
+
+def calcGCContentRange(seq):
+    '''
+    Calculates the range of Primer.calcGCContent over every expansion of a degenerate sequence
+
+    seq: A DNA sequence of IUPAC bases (str)
+    Returns: The lowest and highest GC content in percent (tuple of float)
+    '''
+    masks = encodeMasks(seq)
+    low, high = calcGCCountRange(masks)
+    return low / len(masks) * 100, high / len(masks) * 100
+
+def calcGCInClampRange(seq):
+    '''
+    Calculates the range of Primer.calcGCInClamp over every expansion of a degenerate sequence
+
+    seq: A DNA sequence of IUPAC bases (str)
+    Returns: The lowest and highest number of G and C bases in the last five bases (tuple of int)
+    '''
+    return calcGCCountRange(encodeMasks(seq)[-5:])
+
+def calcMeltTempRange(seq):
+    '''
+    Calculates the range of Primer.calcMeltTemp over every expansion of a degenerate sequence. The temperature only depends on
+    the number of G and C bases and rises with it, so the range comes from the expansions with the fewest and the most.
+
+    seq: A DNA sequence of IUPAC bases (str)
+    Returns: The lowest and highest melting temperature (tuple of float)
+    '''
+    low, high = calcGCCountRange(encodeMasks(seq))
+    return tuple(pr.Primer.calcMeltTemp("G" * numGC + "A" * (len(seq) - numGC)) for numGC in (low, high))
+
+def runChain(startCosts, stateCosts, transCosts):
+    '''
+    Minimizes a cost over a chain of positions with a few possible states each, by the min-plus recurrence of the Viterbi
+    algorithm. The cost of a path is the sum of the cost of each state on it and of each transition between adjacent states.
+
+    startCosts: The cost of each state at the first position, inf where a state is not allowed (np.ndarray)
+    stateCosts: The cost of each state at each following position, inf where a state is not allowed (np.ndarray)
+    transCosts: The cost of each transition, either one matrix for every step or one per step (np.ndarray)
+    Returns: The lowest cost of a path ending in each state at the last position, and for each following position the best
+    previous state of each state (tuple of np.ndarray)
+    '''
+    costs = startCosts
+    backPointers = np.zeros(stateCosts.shape, dtype=np.int64)
+    for i in range(len(stateCosts)):
+        steps = costs[:, None] + (transCosts if transCosts.ndim == 2 else transCosts[i])
+        backPointers[i] = steps.argmin(axis=0)
+        costs = steps.min(axis=0) + stateCosts[i]
+    return costs, backPointers
+
+def getAllowedCosts(allowed, costs, sign):
+    # Costs of the allowed states, negated to maximize instead of minimize
+    return np.where(allowed, sign * costs, np.inf)
+
+def calcNNThermoCoeffs(isSymmetric, length, naConc, oligoConc):
+    '''
+    Helper function for calcNNMeltTempRange. Finds the terms of the melting temperature of calcNNMeltTemps that do not depend
+    on the bases.
+
+    Returns: The enthalpy added for symmetry and the entropy added for symmetry, salt and concentration (tuple of float)
+    '''
+    salt = 0.368 * (length - 1) * np.log(naConc)
+    if (isSymmetric):
+        return nn.symAmtH, nn.symAmtS + salt + mt.gasConstant * np.log(oligoConc)
+    return 0.0, salt + mt.gasConstant * np.log(oligoConc / 4)
+
+def findExtremeNNMeltTemp(masks, isSymmetric, sign, naConc, oligoConc):
+    '''
+    Helper function for calcNNMeltTempRange. The melting temperature in Kelvin is the ratio 1000 * H / S of two sums over the
+    chain of bases, so its extremes are found with Dinkelbach's method: the expansion maximizing sign * (S * t - 1000 * H)
+    gives a better ratio t until t is the extreme, and each step is one Viterbi pass.
+
+    masks: The base masks of the sequence (np.ndarray)
+    isSymmetric: Whether to use the terms of self-complementary sequences (bool)
+    sign: 1 for the highest temperature, -1 for the lowest (int)
+    Returns: The extreme melting temperature in degrees Celsius (float)
+    '''
+    allowed = (masks[:, None] & codeMasks[None, :]) != 0
+    initH = np.where(isGCCode, nn.duplexTermgcAmtH, nn.duplexTermatAmtH)
+    initS = np.where(isGCCode, nn.duplexTermgcAmtS, nn.duplexTermatAmtS)
+    # The initiation terms of both ends, at the first and last state
+    endH = np.zeros((len(masks), 4))
+    endS = np.zeros((len(masks), 4))
+    endH[0] += initH
+    endS[0] += initS
+    endH[-1] += initH
+    endS[-1] += initS
+    extraH, extraS = calcNNThermoCoeffs(isSymmetric, len(masks), naConc, oligoConc)
+    meltTemp = None
+    for _ in range(100):
+        t = 0.0 if meltTemp is None else meltTemp
+        # S * t - 1000 * H is the negated numerator minus t times the negated denominator, both of which are positive
+        stateCosts = getAllowedCosts(allowed, endS * t - 1000 * endH, -sign)
+        transCosts = -sign * (nn.duplexPairSTable * t - 1000 * nn.duplexPairHTable)
+        costs, backPointers = runChain(stateCosts[0], stateCosts[1:], transCosts)
+        codes = [int(costs.argmin())]
+        for pointers in backPointers[::-1]:
+            codes.append(int(pointers[codes[-1]]))
+        codes = codes[::-1]
+        H = extraH + sum(endH[i, code] for i, code in enumerate(codes)) + nn.duplexPairHTable[codes[:-1], codes[1:]].sum()
+        S = extraS + sum(endS[i, code] for i, code in enumerate(codes)) + nn.duplexPairSTable[codes[:-1], codes[1:]].sum()
+        newMeltTemp = float(1000 * H / S)
+        if (meltTemp is not None and sign * (newMeltTemp - meltTemp) <= 1e-9):
+            break
+        meltTemp = newMeltTemp
+    return meltTemp - 273.15
+
+def calcNNMeltTempRange(seq, naConc=mt.defaultNaConc, oligoConc=mt.defaultOligoConc):
+    '''
+    Calculates the range of meltingtemp.calcNNMeltTemp over every expansion of a degenerate sequence without expanding it.
+    The range is exact unless some expansion can be self-complementary, in which case it is widened to cover both the
+    symmetric and the non-symmetric terms.
+
+    seq: A DNA sequence of IUPAC bases (str)
+    naConc: The concentration of monovalent cations in mol/L (float)
+    oligoConc: The total oligo concentration in mol/L (float)
+    Returns: The lowest and highest melting temperature in degrees Celsius, NaN for sequences shorter than 2 bases (tuple of float)
+    '''
+    masks = encodeMasks(seq)
+    if (len(masks) < 2):
+        return math.nan, math.nan
+    # An expansion can only be self-complementary if every base can pair with the base at the mirrored position
+    canBeSymmetric = bool(canPair(masks, masks[::-1]).all())
+    regimes = (False, True) if canBeSymmetric else (False,)
+    low = min(findExtremeNNMeltTemp(masks, isSymmetric, -1, naConc, oligoConc) for isSymmetric in regimes)
+    high = max(findExtremeNNMeltTemp(masks, isSymmetric, 1, naConc, oligoConc) for isSymmetric in regimes)
+    return low, high
+
+def getPairStateAllowed(masks1, masks2):
+    '''
+    Helper function for the dimer and hairpin recurrences. Finds which pair states each pair of aligned degenerate bases allows.
+
+    masks1: A NumPy uint8 array of base masks
+    masks2: A NumPy uint8 array of base masks of the same length
+    Returns: Whether each of the 16 states 4 * code1 + code2 is allowed at each position (np.ndarray)
+    '''
+    return (((masks1[:, None] >> pairStateCodes1) & 1) & ((masks2[:, None] >> pairStateCodes2) & 1)).astype(bool)
+
+# Transition costs between aligned pairs of a dimer: stacked matched pairs add the NN contribution of the bases of seq1
+dimerTransG = np.where(isMatchState[:, None] & isMatchState[None, :],
+                       dm.duplexPairCodeToG.reshape(4, 4)[pairStateCodes1[:, None], pairStateCodes1[None, :]], 0.0)
+dimerInitG = np.where(isMatchState, np.where(isGCCode[pairStateCodes1], nn.duplexTermgcAmtG, nn.duplexTermatAmtG), 0.0)
+mismatchG = np.where(isMatchState, 0.0, nn.mismatchPenalty)
+
+def calcDimerGibbsRange(seq1, seq2):
+    '''
+    Calculates the range of the lowest dimer Gibbs free energy of dimer.calcPairedDimerGibbs over every expansion of two
+    degenerate sequences. A degenerate primer is a mixture, so any expansion of seq1 can meet any expansion of seq2 and each
+    aligned pair of bases is chosen independently; at each offset the energy is minimized (or maximized) over the choices by a
+    Viterbi pass over the 16 pair states, where complementarity of the masks is a bitwise AND.
+
+    seq1: A DNA sequence of IUPAC bases (str)
+    seq2: A DNA sequence of IUPAC bases (str)
+    Returns: The lowest Gibbs free energy in kcal/mol of any expansion, which is exact, and an upper bound on the highest: the
+    lowest over offsets of the highest energy at each offset (tuple of float)
+    '''
+    masks1 = encodeMasks(seq1)
+    revMasks2 = encodeMasks(seq2)[::-1]
+    bounds = []
+    for sign in (1, -1):
+        best = np.inf
+        for offset in range(1 - len(revMasks2), len(masks1)):
+            # seq1[p] pairs with reversed seq2[p - offset]
+            lo = max(0, offset)
+            hi = min(len(masks1), len(revMasks2) + offset)
+            allowed = getPairStateAllowed(masks1[lo:hi], revMasks2[lo - offset:hi - offset])
+            if (not canPair(masks1[lo:hi], revMasks2[lo - offset:hi - offset]).any()):
+                # Nothing can pair, so every expansion only has mismatches
+                best = min(best, nn.mismatchPenalty * (hi - lo))
+                continue
+            stateG = np.tile(mismatchG, (hi - lo, 1))
+            stateG[0] += dimerInitG
+            if (hi - lo > 1):
+                stateG[-1] += dimerInitG
+            stateCosts = getAllowedCosts(allowed, stateG, sign)
+            costs = runChain(stateCosts[0], stateCosts[1:], sign * dimerTransG)[0]
+            best = min(best, sign * float(costs.min()))
+        bounds.append(best)
+    return bounds[0], bounds[1]
+
+# Transition costs between rungs of a hairpin stem counting outwards from the loop. Stacked matched rungs add the NN contribution
+# of the stem1 bases, outer base first as in SplitScorer.
+stemTransG = np.where(isMatchState[:, None] & isMatchState[None, :],
+                      np.array(hp.duplexPairCodeToG).reshape(4, 4)[pairStateCodes1[:, None], pairStateCodes1[None, :]], 0.0)
+stemTermG = np.where(isMatchState, np.where(isGCCode[pairStateCodes1], nn.stemTermgcAmtG, nn.stemTermatAmtG), 0.0)
+loopTransG = nn.loopPairGTable
+
+def calcSplitGibbsBound(masks, loopStart, loopEnd, sign):
+    '''
+    Helper function for calcHairpinGibbsRange. Finds the lowest (or highest) hairpin.calcSplitGibbs of one split over every
+    expansion of a degenerate sequence. The loop is a chain of bases from the last base of stem1 to the first base of stem2,
+    so it is solved for each choice of the last base of stem1, and the stem is a chain of rungs of paired bases from the loop
+    outwards whose first rung closes the loop chain.
+
+    masks: The base masks of the sequence (np.ndarray)
+    loopStart: The index of the first base of the loop (int)
+    loopEnd: The index after the last base of the loop (int)
+    sign: 1 for the lowest energy, -1 for the highest (int)
+    Returns: The extreme Gibbs free energy in kcal/mol (float)
+    '''
+    baseAllowed = (masks[:, None] & codeMasks[None, :]) != 0
+    loopCosts = getAllowedCosts(baseAllowed[loopStart:loopEnd + 1], np.zeros(4), sign)
+    # loopG[a, b] is the extreme loop energy when stem1 ends with a and stem2 starts with b
+    loopG = np.full((4, 4), np.inf)
+    for code in np.flatnonzero(baseAllowed[loopStart - 1]).tolist():
+        startCosts = np.full(4, np.inf)
+        startCosts[code] = 0.0
+        loopG[code] = runChain(startCosts, loopCosts, sign * loopTransG)[0]
+    minStemLen = min(loopStart, len(masks) - loopEnd)
+    allowed = getPairStateAllowed(masks[loopStart - minStemLen:loopStart][::-1], masks[loopEnd:loopEnd + minStemLen])
+    stateG = np.tile(mismatchG, (minStemLen, 1))
+    stateG[0] += stemTermG
+    stateCosts = getAllowedCosts(allowed, stateG, sign)
+    startCosts = stateCosts[0] + loopG[pairStateCodes1, pairStateCodes2]
+    costs = runChain(startCosts, stateCosts[1:], sign * stemTransG)[0]
+    return sign * float(costs.min())
+
+def calcHairpinGibbsRange(seq):
+    '''
+    Calculates the range of the lowest hairpin Gibbs free energy of hairpin.bestHairpin over every expansion of a degenerate
+    sequence, scoring each split of hairpin.iterHairpinSplits once with Viterbi passes instead of once per expansion
+
+    seq: A DNA sequence of IUPAC bases (str)
+    Returns: The lowest Gibbs free energy in kcal/mol of any expansion, which is exact, and an upper bound on the highest: the
+    lowest over splits of the highest energy of each split. None for both if no hairpin fits. (tuple of float)
+    '''
+    masks = encodeMasks(seq)
+    splits = list(hp.iterHairpinSplits(seq))
+    if (not splits):
+        return None, None
+    return tuple(min(calcSplitGibbsBound(masks, loopStart, loopEnd, sign) for loopStart, loopEnd in splits) for sign in (1, -1))
+
+class DegeneratePrimer:
+    '''
+    Describes a degenerate primer by the range of each metric of Primer over every concrete sequence it stands for, without
+    enumerating them
+
+    seq: A string representing the DNA sequence of the primer in IUPAC bases
+    start: A integer representing the start location of the primer on the original inputted sequence
+    end: A integer representing the end location of the primer on the original inputted sequence
+
+    meltTempRange, gcContentRange and gcInClampRange are (lowest, highest) tuples. nnMeltTempRange, hairpinGibbsRange and
+    selfDimerGibbsRange are computed the first time they are accessed and then cached.
+    '''
+    def __init__(self, seq, start, end):
+        self.seq = seq.upper()
+        self.start = start
+        self.end = end
+        self.numExpansions = calcNumExpansions(self.seq)
+        self.meltTempRange = calcMeltTempRange(self.seq)
+        self.gcContentRange = calcGCContentRange(self.seq)
+        self.gcInClampRange = calcGCInClampRange(self.seq)
+
+    @cached_property
+    def nnMeltTempRange(self):
+        return calcNNMeltTempRange(self.seq)
+
+    @cached_property
+    def hairpinGibbsRange(self):
+        return calcHairpinGibbsRange(self.seq)
+
+    @cached_property
+    def selfDimerGibbsRange(self):
+        return calcDimerGibbsRange(self.seq, self.seq)
@@ -1,16 +1,24 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import numpy as np
 import seqtools as st
+import nndata as nn
+import profiling as prof
 
 # Dictionary describing the contribution of each possible nearest-neighbor pair in a duplex towards the Gibbs free energy in kcal/mol
 nnDuplexGContributions = {"AA/TT": -1.00, "TA/AT": -0.58, "GA/CT": -1.30, "CA/GT": -1.45, "AT/TA": -0.88, "TT/AA": -1.00,  "GT/CA": -1.44, 
                         "CT/GA": -1.28, "AG/TC": -1.28, "TG/AC": -1.45, "GG/CC": -1.84, "CG/GC": -2.17, "AC/TG": -1.44,  "TC/AG": -1.30,
                         "GC/CG": -2.24,  "CC/GG": -1.84}
 
+# nnDuplexGContributions indexed by 4 * code1 + code2 of the top strand
+duplexPairCodeToG = nn.compilePairTable(nnDuplexGContributions).ravel()
+
 class Dimer:
     '''
     Describes a dimer DNA structure
 
-    seq1: A string representing a DNA sequence
-    seq2: A string representing another DNA sequence
+    seq1: A string or EncodedSeq representing a DNA sequence
+    seq2: A string or EncodedSeq representing another DNA sequence
     overlapStart1: An integer representing the index on seq1 of where the overlap starts
     overlapEnd1: An integer reporesenting the index on seq1 of where the overlap ends
     overlapStart2: An integer representing the index on seq2 of where the overlap starts
@@ -27,6 +35,18 @@ class Dimer:
     def getOverlapLen(self):
         return self.overlapEnd1 - self.overlapStart1 + 1
 
+def getPairedCodes(dimer):
+    '''
+    Helper function for scoring a dimer. The strands are antiparallel, so seq1[overlapStart1 + i] pairs with
+    seq2[overlapEnd2 - i].
+
+    dimer: A DNA dimer (Dimer)
+    Returns: The base codes of the overlap of seq1 and of the bases they pair with on seq2, in the same order (tuple of bytes)
+    '''
+    codes1 = st.toCodeBytes(dimer.seq1[dimer.overlapStart1:dimer.overlapEnd1 + 1])
+    codes2 = st.toCodeBytes(st.getRevSeq(dimer.seq2[dimer.overlapStart2:dimer.overlapEnd2 + 1]))
+    return codes1, codes2
+
 def calcScoreDimer(dimer):
     '''
     Checks a Dimer object for basic viability
@@ -34,24 +54,218 @@ def calcScoreDimer(dimer):
     dimer: A DNA dimer (Dimer)
     Returns: A score representing the number of matches minus the number of mismatches in the overlap region (int)
     '''
+    prof.count("dimerAlignments")
     score = 0
-    overlapLen = dimer.getOverlapLen()
-    # Get the start indexes of the overlap for both strands
-    seq1Pos= dimer.overlapStart1
-    seq2Pos = dimer.overlapStart2
     # Check the number of base pair matches and mismatches
-    for i in range(overlapLen):
-        if (st.getCompBase(dimer.seq1[seq1Pos]) == dimer.seq2[seq2Pos]):
+    for code1, code2 in zip(*getPairedCodes(dimer)):
+        if (code1 + code2 == 3):
             score += 1
         else:
             score -= 1
     return score
 
 def calcDimerGibbs(dimer):
+    '''
+    Calculates the Gibbs free energy in kcal/mol of a dimer using the nearest neighbor (NN) method. Adjacent matched pairs add
+    their NN contribution, each mismatched pair adds a penalty and each matched pair at an end of the overlap adds the duplex
+    initiation term for its identity.
+
+    dimer: A DNA dimer (Dimer)
+    Returns: The Gibbs free energy of the dimer (float)
+    '''
     G = 0
-    overlapLen = dimer.getOverlapLen()
-    # Get the start indexes of the overlap for both strands
-    seq1Pos= dimer.overlapStart1
-    seq2Pos = dimer.overlapStart2
-    for i in range(overlapLen):
-        if
\ No newline at end of file
+    numLookups = 0
+    codes1, codes2 = getPairedCodes(dimer)
+    isMatch = [code1 + code2 == 3 for code1, code2 in zip(codes1, codes2)]
+    for i in range(len(isMatch)):
+        if (not isMatch[i]):
+            G += nn.mismatchPenalty
+        elif (i + 1 < len(isMatch) and isMatch[i + 1]):
+            numLookups += 1
+            G += nnDuplexGContributions[st.codeToBase[codes1[i]] + st.codeToBase[codes1[i + 1]] + "/" +
+                                        st.codeToBase[codes2[i]] + st.codeToBase[codes2[i + 1]]]
+    # Initiation terms for the pairs at both ends of the overlap
+    for i in {0, len(isMatch) - 1}:
+        if (isMatch[i]):
+            G += nn.duplexTermgcAmtG if codes1[i] == st.baseToCode["G"] or codes1[i] == st.baseToCode["C"] else nn.duplexTermatAmtG
+    if (prof.activeProfiler is not None):
+        prof.count("dimerAlignments")
+        prof.count("nnLookups", numLookups)
+    return G
+
+@dataclass
+class DimerMatrix:
+    '''
+    Describes the worst dimer of every pair of primers in a pool. Entry [i, j] describes primer i (seq1) with primer j (seq2),
+    so the diagonal holds self-dimers. An offset of k means that seq1[p] pairs with seq2[len(seq2) - 1 - p + k], see
+    createDimerAtOffset.
+
+    gibbs: A float array of the lowest Gibbs free energy over every offset, as calculated by calcDimerGibbs
+    gibbsOffset: An integer array of the offset with the lowest Gibbs free energy
+    score: An integer array of the highest score over every offset, as calculated by calcScoreDimer
+    scoreOffset: An integer array of the offset with the highest score
+    '''
+    gibbs: np.ndarray
+    gibbsOffset: np.ndarray
+    score: np.ndarray
+    scoreOffset: np.ndarray
+
+def createDimerAtOffset(seq1, seq2, offset):
+    '''
+    Creates the Dimer of two sequences aligned antiparallel at an offset, where seq1[p] pairs with seq2[len(seq2) - 1 - p + offset]
+
+    seq1: A DNA sequence (str or EncodedSeq)
+    seq2: Another DNA sequence (str or EncodedSeq)
+    offset: An integer between 1 - len(seq2) and len(seq1) - 1 (int)
+    Returns: The dimer covering the whole overlap of the two sequences (Dimer)
+    '''
+    overlapStart1 = max(0, offset)
+    overlapEnd1 = min(len(seq1), len(seq2) + offset) - 1
+    if (overlapEnd1 < overlapStart1):
+        raise ValueError(f"Offset {offset} does not overlap the sequences")
+    return Dimer(seq1, seq2, overlapStart1, overlapEnd1, len(seq2) - 1 - overlapEnd1 + offset, len(seq2) - 1 - overlapStart1 + offset)
+
+def encodePool(seqs):
+    '''
+    Helper function for calcDimerMatrix. Encodes a pool of primers as rows of a matrix padded with st.padCode.
+
+    seqs: A list of DNA sequences (list of str or EncodedSeq)
+    Returns: The lengths, the padded base codes and the padded base codes of the reversed sequences (tuple of np.ndarray)
+    '''
+    lengths, codes = st.encodeBatch(seqs)
+    revCodes = st.encodeBatch([st.toEncodedSeq(seq).getRev() for seq in seqs])[1]
+    return lengths, codes, revCodes
+
+def calcDimerBlock(lengths, codes, revCodes, rowStart, rowEnd):
+    '''
+    Helper function for calcDimerMatrix. Scores primers rowStart to rowEnd (exclusive) against every primer at every offset.
+    For each offset, the matches of all pairs come from one matrix product of one-hot encoded bases, and the NN stacks from one
+    matrix product of one-hot encoded pairs of adjacent bases weighted by their contributions.
+
+    lengths, codes, revCodes: The encoded pool from encodePool
+    rowStart: The first primer to use as seq1 (int)
+    rowEnd: The primer after the last primer to use as seq1 (int)
+    Returns: The rows of the gibbs, gibbsOffset, score and scoreOffset matrices (tuple of np.ndarray)
+    '''
+    numSeqs, maxLen = codes.shape
+    rowCodes = codes[rowStart:rowEnd].astype(np.int64)
+    allRevCodes = revCodes.astype(np.int64)
+    rowLens = lengths[rowStart:rowEnd, None]
+    colLens = lengths[None, :]
+    # One-hot bases of seq1, and one-hot complements of the bases of reversed seq2, so that their product counts matches
+    baseCodes = np.arange(4)
+    rowBases = (rowCodes[:, :, None] == baseCodes).astype(np.float64)
+    colCompBases = ((3 - allRevCodes)[:, :, None] == baseCodes).astype(np.float64)
+    # Pairs of adjacent bases of seq1 weighted by their NN contribution, and complemented pairs of reversed seq2
+    pairCodes = np.arange(16)
+    rowPairs = np.where((rowCodes[:, :-1] < st.padCode) & (rowCodes[:, 1:] < st.padCode), 4 * rowCodes[:, :-1] + rowCodes[:, 1:], -1)
+    rowPairG = (rowPairs[:, :, None] == pairCodes) * duplexPairCodeToG
+    compPairs = np.where((allRevCodes[:, :-1] < st.padCode) & (allRevCodes[:, 1:] < st.padCode),
+                         4 * (3 - allRevCodes[:, :-1]) + (3 - allRevCodes[:, 1:]), -1)
+    colCompPairs = (compPairs[:, :, None] == pairCodes).astype(np.float64)
+    isGC = (rowCodes == st.baseToCode["G"]) | (rowCodes == st.baseToCode["C"])
+    initG = np.where(isGC, nn.duplexTermgcAmtG, nn.duplexTermatAmtG)
+    rows = np.arange(len(rowCodes))[:, None]
+    cols = np.arange(numSeqs)[None, :]
+    bestG = np.full((len(rowCodes), numSeqs), np.inf)
+    bestGOffset = np.zeros(bestG.shape, dtype=np.int64)
+    bestScore = np.full(bestG.shape, np.iinfo(np.int64).min)
+    bestScoreOffset = np.zeros(bestG.shape, dtype=np.int64)
+    for offset in range(1 - maxLen, maxLen):
+        # seq1[p] pairs with reversed seq2[p - offset]
+        lo = max(0, offset)
+        hi = min(maxLen, maxLen + offset)
+        overlapLen = np.minimum(rowLens, colLens + offset) - lo
+        if (not (overlapLen > 0).any()):
+            continue
+        matches = rowBases[:, lo:hi].reshape(len(rowCodes), -1) @ colCompBases[:, lo - offset:hi - offset].reshape(numSeqs, -1).T
+        stackG = rowPairG[:, lo:hi - 1].reshape(len(rowCodes), -1) @ colCompPairs[:, lo - offset:hi - offset - 1].reshape(numSeqs, -1).T
+        G = nn.mismatchPenalty * (overlapLen - matches) + stackG
+        # Initiation terms for the matched pairs at both ends of the overlap
+        isStartMatch = rowCodes[:, lo, None] + allRevCodes[None, :, lo - offset] == 3
+        G += np.where(isStartMatch, initG[:, lo, None], 0)
+        end = np.clip(np.minimum(rowLens, colLens + offset) - 1, 0, maxLen - 1)
+        endCodes = rowCodes[rows, end]
+        isEndMatch = (overlapLen > 1) & (endCodes + allRevCodes[cols, np.clip(end - offset, 0, maxLen - 1)] == 3)
+        G += np.where(isEndMatch, initG[rows, end], 0)
+        G[overlapLen <= 0] = np.inf
+        score = np.where(overlapLen > 0, 2 * np.rint(matches).astype(np.int64) - overlapLen, bestScore)
+        isBetterG = G < bestG
+        bestG[isBetterG] = G[isBetterG]
+        bestGOffset[isBetterG] = offset
+        isBetterScore = score > bestScore
+        bestScore[isBetterScore] = score[isBetterScore]
+        bestScoreOffset[isBetterScore] = offset
+    return bestG, bestGOffset, bestScore, bestScoreOffset
+
+@prof.timed("calcDimerMatrix")
+def calcDimerMatrix(seqs, workers=None, blockSize=256):
+    '''
+    Finds the worst dimer of every pair of primers in a pool, over every alignment offset
+
+    seqs: A list of DNA sequences (list of str or EncodedSeq)
+    workers: The number of processes to spread blocks of rows across, or None to run in this process (int)
+    blockSize: The number of primers per block of rows (int)
+    Returns: The worst Gibbs free energy and score of every pair (DimerMatrix)
+    '''
+    lengths, codes, revCodes = encodePool(seqs)
+    # Every pair is scored at every offset between the two longest primers
+    prof.count("dimerAlignments", len(seqs) ** 2 * max(2 * codes.shape[1] - 1, 0))
+    blocks = [(start, min(start + blockSize, len(seqs))) for start in range(0, len(seqs), blockSize)]
+    if (workers is None):
+        results = [calcDimerBlock(lengths, codes, revCodes, start, end) for start, end in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(calcDimerBlock, lengths, codes, revCodes, start, end) for start, end in blocks]
+            results = [future.result() for future in futures]
+    if (not results):
+        empty = np.zeros((0, 0))
+        return DimerMatrix(empty, empty.astype(np.int64), empty.astype(np.int64), empty.astype(np.int64))
+    return DimerMatrix(*(np.concatenate(columns) for columns in zip(*results)))
+
+@prof.timed("calcPairedDimerGibbs")
+def calcPairedDimerGibbs(seqs1, seqs2):
+    '''
+    Finds the worst dimer of each primer in seqs1 with the primer at the same index in seqs2 over every alignment offset. With
+    seqs2 equal to seqs1 this scores self-dimers, without the N x N work of calcDimerMatrix.
+
+    seqs1: A list of DNA sequences (list of str or EncodedSeq)
+    seqs2: A list of DNA sequences of the same length as seqs1 (list of str or EncodedSeq)
+    Returns: The lowest Gibbs free energy as calculated by calcDimerGibbs and its offset, see createDimerAtOffset
+    (tuple of np.ndarray)
+    '''
+    if (len(seqs1) != len(seqs2)):
+        raise ValueError("seqs1 and seqs2 must have the same length")
+    lengths1, codes1 = st.encodeBatch(seqs1)
+    lengths2, revCodes2 = st.encodeBatch([st.toEncodedSeq(seq).getRev() for seq in seqs2])
+    maxLen = max(codes1.shape[1], revCodes2.shape[1])
+    codes1 = np.pad(codes1.astype(np.int64), ((0, 0), (0, maxLen - codes1.shape[1])), constant_values=st.padCode)
+    revCodes2 = np.pad(revCodes2.astype(np.int64), ((0, 0), (0, maxLen - revCodes2.shape[1])), constant_values=st.padCode)
+    prof.count("dimerAlignments", len(seqs1) * max(2 * maxLen - 1, 0))
+    # Pairs of adjacent bases of seq1, with padding pairs indexing an extra entry of zero
+    pairs1 = np.where((codes1[:, :-1] < st.padCode) & (codes1[:, 1:] < st.padCode), 4 * codes1[:, :-1] + codes1[:, 1:], 16)
+    pairG1 = np.append(duplexPairCodeToG, 0)[pairs1]
+    isGC = (codes1 == st.baseToCode["G"]) | (codes1 == st.baseToCode["C"])
+    initG = np.where(isGC, nn.duplexTermgcAmtG, nn.duplexTermatAmtG)
+    rows = np.arange(len(codes1))
+    bestG = np.full(len(codes1), np.inf)
+    bestOffset = np.zeros(len(codes1), dtype=np.int64)
+    for offset in range(1 - maxLen, maxLen):
+        # seq1[p] pairs with reversed seq2[p - offset]
+        lo = max(0, offset)
+        hi = min(maxLen, maxLen + offset)
+        overlapLen = np.minimum(lengths1, lengths2 + offset) - lo
+        if (not (overlapLen > 0).any()):
+            continue
+        isMatch = codes1[:, lo:hi] + revCodes2[:, lo - offset:hi - offset] == 3
+        G = nn.mismatchPenalty * (overlapLen - isMatch.sum(axis=1))
+        G += (pairG1[:, lo:hi - 1] * (isMatch[:, :-1] & isMatch[:, 1:])).sum(axis=1)
+        # Initiation terms for the matched pairs at both ends of the overlap
+        G += np.where(isMatch[:, 0], initG[:, lo], 0)
+        end = np.clip(np.minimum(lengths1, lengths2 + offset) - 1, lo, hi - 1)
+        G += np.where((overlapLen > 1) & isMatch[rows, end - lo], initG[rows, end], 0)
+        G[overlapLen <= 0] = np.inf
+        isBetter = G < bestG
+        bestG[isBetter] = G[isBetter]
+        bestOffset[isBetter] = offset
+    return bestG, bestOffset
@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+import gzip
+import sys
+
+@dataclass
+class FastaChunk:
+    '''
+    Describes a piece of a FASTA record. Consecutive chunks of a record overlap so that every window of up to overlap + 1
+    bases lies entirely within the chunk that owns its start.
+
+    name: A string representing the name of the record, the first word of its header
+    start: An integer representing the location of the first base of the chunk on the record
+    seq: A string representing the uppercase DNA bases of the chunk
+    numOwned: An integer representing the number of bases from the start of the chunk that windows belonging to this chunk
+    start at. The remaining bases are shared with the next chunk.
+    isLast: A boolean telling whether this is the last chunk of the record
+    '''
+    name: str
+    start: int
+    seq: str
+    numOwned: int
+    isLast: bool
+
+def openFasta(path):
+    '''
+    Opens a FASTA file for reading text, decompressing it if it is gzipped
+
+    path: The path of the file, or "-" for standard input (str)
+    Returns: A text file object
+    '''
+    if (path == "-"):
+        return sys.stdin
+    with open(path, "rb") as handle:
+        isGzip = handle.read(2) == b"\x1f\x8b"
+    if (isGzip):
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+def iterFastaChunks(handle, chunkSize=1000000, overlap=0):
+    '''
+    Streams the records of a FASTA file as overlapping chunks of at most chunkSize + overlap bases, so memory use does not
+    depend on the size of the file or of its records
+
+    handle: A text file object of a FASTA file
+    chunkSize: The number of bases each chunk owns (int)
+    overlap: The number of bases each chunk shares with the next chunk of the record (int)
+    Returns: A generator of chunks in file order (generator of FastaChunk)
+    '''
+    if (chunkSize < 1 or overlap < 0):
+        raise ValueError("chunkSize must be positive and overlap must not be negative")
+    name = None
+    lines = []
+    numBases = 0
+    start = 0
+    for line in handle:
+        if (line.startswith(">")):
+            if (name is not None):
+                yield FastaChunk(name, start, "".join(lines), numBases, True)
+            header = line[1:].split()
+            name = header[0] if header else ""
+            lines = []
+            numBases = 0
+            start = 0
+            continue
+        if (name is None):
+            if (line.strip()):
+                raise ValueError("FASTA sequence found before the first header")
+            continue
+        line = line.strip().upper()
+        lines.append(line)
+        numBases += len(line)
+        # Emit full chunks and keep the bases they share with the next chunk
+        while (numBases >= chunkSize + overlap):
+            buffered = "".join(lines)
+            yield FastaChunk(name, start, buffered[:chunkSize + overlap], chunkSize, False)
+            lines = [buffered[chunkSize:]]
+            numBases -= chunkSize
+            start += chunkSize
+    if (name is not None):
+        yield FastaChunk(name, start, "".join(lines), numBases, True)
@@ -0,0 +1,252 @@
+import time
+import numpy as np
+import dimer as dm
+import hairpin as hp
+import kmerindex as ki
+import linguisticcomplexity as lc
+import profiling as prof
+import scanner
+import seqtools as st
+
+class FilterStage:
+    '''
+    Describes one check of a FilterPipeline, applied to a batch of candidate windows at once
+
+    name: The name of the stage, used in the statistics (str)
+    cost: The rank of the stage's cost per candidate, where cheaper stages run first (int)
+    func: The function called as func(seq, scan) that returns a boolean array of the windows that pass (function)
+    '''
+    def __init__(self, name, cost, func):
+        self.name = name
+        self.cost = cost
+        self.func = func
+        self.numTested = 0
+        self.numPassed = 0
+        self.seconds = 0.0
+
+    def apply(self, seq, scan):
+        '''
+        Runs the check on a batch of windows and records how many pass
+
+        seq: The DNA sequence that was scanned (str or bytes-like)
+        scan: The metrics of the windows to check (WindowScan)
+        Returns: A boolean array where index i tells whether window i passes (np.ndarray)
+        '''
+        start = time.perf_counter()
+        with prof.stage(self.name):
+            mask = np.asarray(self.func(seq, scan), dtype=bool)
+        self.seconds += time.perf_counter() - start
+        self.numTested += len(scan)
+        self.numPassed += int(mask.sum())
+        return mask
+
+    def getStats(self):
+        '''
+        Returns: The number of windows tested, passed and rejected and the seconds spent (dict)
+        '''
+        return {
+            "name": self.name,
+            "tested": self.numTested,
+            "passed": self.numPassed,
+            "rejected": self.numTested - self.numPassed,
+            "seconds": self.seconds,
+        }
+
+class FilterPipeline:
+    '''
+    Runs filter stages in order of cost. Each stage only sees the windows that passed every earlier stage, so a window drops
+    out at the first stage it fails and the expensive stages only run on what is left.
+
+    stages: The stages of the pipeline, in any order (list of FilterStage)
+    '''
+    def __init__(self, stages):
+        # sorted() is stable, so stages of equal cost keep the order they were given in
+        self.stages = sorted(stages, key=lambda stage: stage.cost)
+
+    def run(self, seq, scan):
+        '''
+        Filters the windows of a scan
+
+        seq: The DNA sequence that was scanned (str or bytes-like)
+        scan: The metrics of the windows to filter (WindowScan)
+        Returns: The metrics of the windows that pass every stage (WindowScan)
+        '''
+        for stage in self.stages:
+            if (len(scan) == 0):
+                break
+            scan = scanner.selectWindows(scan, stage.apply(seq, scan))
+        return scan
+
+    def getStats(self):
+        '''
+        Returns: The statistics of each stage in the order they run (list of dict)
+        '''
+        return [stage.getStats() for stage in self.stages]
+
+def mergeStats(statsList):
+    '''
+    Adds up the statistics of pipelines with the same stages, for example one per chunk
+
+    statsList: The statistics from FilterPipeline.getStats (iterable of list of dict)
+    Returns: The combined statistics of each stage (list of dict)
+    '''
+    merged = []
+    for stats in statsList:
+        if (not merged):
+            merged = [dict(stage) for stage in stats]
+            continue
+        for total, stage in zip(merged, stats):
+            for key in ("tested", "passed", "rejected", "seconds"):
+                total[key] += stage[key]
+    return merged
+
+def formatStats(stats):
+    '''
+    Formats the statistics of a pipeline as a table
+
+    stats: The statistics from FilterPipeline.getStats or mergeStats (list of dict)
+    Returns: One line per stage (str)
+    '''
+    lines = [f"{'stage':<12}{'tested':>12}{'passed':>12}{'rejected':>12}{'seconds':>10}"]
+    for stage in stats:
+        lines.append(f"{stage['name']:<12}{stage['tested']:>12}{stage['passed']:>12}{stage['rejected']:>12}"
+                     f"{stage['seconds']:>10.3f}")
+    return "\n".join(lines)
+
+def createRangeStage(name, cost, column, minValue, maxValue):
+    '''
+    Creates a stage that keeps the windows with a WindowScan column between minValue and maxValue inclusive
+
+    name: The name of the stage (str)
+    cost: The rank of the stage's cost (int)
+    column: The name of the WindowScan field to check (str)
+    minValue: The minimum value, or None for no minimum (float)
+    maxValue: The maximum value, or None for no maximum (float)
+    Returns: The stage (FilterStage)
+    '''
+    def inRange(seq, scan):
+        values = getattr(scan, column)
+        mask = np.ones(len(values), dtype=bool)
+        if (minValue is not None):
+            mask &= values >= minValue
+        if (maxValue is not None):
+            mask &= values <= maxValue
+        return mask
+    return FilterStage(name, cost, inRange)
+
+def createAmbiguousStage():
+    '''
+    Creates a stage that drops the windows containing a base other than A, C, G or T
+
+    Returns: The stage (FilterStage)
+    '''
+    return FilterStage("ambiguous", 0, lambda seq, scan: ~scanner.findAmbiguousWindows(seq, scan))
+
+def createLinCompStage(minLinComp):
+    '''
+    Creates a stage that drops the windows with a linguistic complexity below minLinComp
+
+    minLinComp: The minimum linguistic complexity (float)
+    Returns: The stage (FilterStage)
+    '''
+    def checkLinComp(seq, scan):
+        return [lc.calcLinComp(window) >= minLinComp for window in scanner.getWindowSeqs(seq, scan)]
+    return FilterStage("linComp", 5, checkLinComp)
+
+def createHairpinStage(minGibbs):
+    '''
+    Creates a stage that drops the windows that can form a hairpin with a Gibbs free energy below minGibbs
+
+    minGibbs: The minimum hairpin Gibbs free energy in kcal/mol (float)
+    Returns: The stage (FilterStage)
+    '''
+    def checkHairpin(seq, scan):
+        mask = []
+        for window in scanner.getWindowSeqs(seq, scan):
+            # bestHairpin stops as soon as it knows whether the lowest energy is below minGibbs
+            hairpin = hp.bestHairpin(window, threshold=minGibbs)
+            mask.append(hairpin is None or hairpin.totalGibbs >= minGibbs)
+        return mask
+    return FilterStage("hairpin", 6, checkHairpin)
+
+def createSelfDimerStage(minGibbs):
+    '''
+    Creates a stage that drops the windows that can form a self-dimer with a Gibbs free energy below minGibbs
+
+    minGibbs: The minimum self-dimer Gibbs free energy in kcal/mol (float)
+    Returns: The stage (FilterStage)
+    '''
+    def checkSelfDimer(seq, scan):
+        windows = scanner.getWindowSeqs(seq, scan)
+        return dm.calcPairedDimerGibbs(windows, windows)[0] >= minGibbs
+    return FilterStage("selfDimer", 7, checkSelfDimer)
+
+def createSpecificityStage(indexDir, maxHits):
+    '''
+    Creates a stage that drops the windows whose 3' end occurs more than maxHits times in a genome, on either strand
+
+    indexDir: The directory of a k-mer index built by kmerindex.buildKmerIndex (str)
+    maxHits: The maximum number of occurrences of the last k bases (int)
+    Returns: The stage (FilterStage)
+    '''
+    def checkSpecificity(seq, scan):
+        index = ki.openKmerIndex(indexDir)
+        if ((scan.length < index.k).any()):
+            raise ValueError(f"Windows must have at least {index.k} bases to check against the k-mer index")
+        # Pack every k-mer of the template once and pick out the one ending at each window's 3' end
+        codes = np.frombuffer(scanner.encodeSeq(seq).tobytes().translate(st.encodeTable), dtype=np.uint8)
+        values = ki.calcKmerValues(codes, index.k)[0]
+        return index.countValueHits(values[scan.end - index.k + 1]) <= maxHits
+    return FilterStage("specificity", 4, checkSpecificity)
+
+def createStructureRiskStage(hotMask):
+    '''
+    Creates a stage that drops the windows overlapping a hot base of the template's structure risk track, which
+    structurerisk.ChunkRiskTracks builds once for the whole record. Each window is an O(1) lookup.
+
+    hotMask: A boolean array of whether each base of the sequence being filtered is hot
+    Returns: The stage (FilterStage)
+    '''
+    hotCounts = np.zeros(len(hotMask) + 1, dtype=np.int64)
+    np.cumsum(hotMask, out=hotCounts[1:])
+
+    def checkStructureRisk(seq, scan):
+        return hotCounts[scan.end + 1] - hotCounts[scan.start] == 0
+    return FilterStage("structureRisk", 4, checkStructureRisk)
+
+def createPipeline(minClamp=None, maxClamp=None, minGC=None, maxGC=None, minTm=None, maxTm=None, minLinComp=None,
+                   minHairpinGibbs=None, minSelfDimerGibbs=None, kmerIndexDir=None, maxEndHits=None, structureHotMask=None):
+    '''
+    Creates the standard pipeline: ambiguous bases, GC clamp, GC content, melting temperature, 3' end specificity, template
+    structure risk, linguistic complexity, hairpin and self-dimer. Stages without a threshold are left out.
+
+    minClamp, maxClamp: The range of G's and C's in the GC clamp (int)
+    minGC, maxGC: The range of GC content in percent (float)
+    minTm, maxTm: The range of melting temperature (float)
+    minLinComp: The minimum linguistic complexity (float)
+    minHairpinGibbs: The minimum hairpin Gibbs free energy in kcal/mol (float)
+    minSelfDimerGibbs: The minimum self-dimer Gibbs free energy in kcal/mol (float)
+    kmerIndexDir: The directory of a k-mer index of the background genome (str)
+    maxEndHits: The maximum number of occurrences of a window's 3' end in the background genome (int)
+    structureHotMask: A boolean array of whether each base of the sequence is covered by a stable inverted repeat of its
+    record (np.ndarray)
+    Returns: The pipeline (FilterPipeline)
+    '''
+    stages = [createAmbiguousStage()]
+    if (minClamp is not None or maxClamp is not None):
+        stages.append(createRangeStage("gcClamp", 1, "gcInClamp", minClamp, maxClamp))
+    if (minGC is not None or maxGC is not None):
+        stages.append(createRangeStage("gcContent", 2, "gcContent", minGC, maxGC))
+    if (minTm is not None or maxTm is not None):
+        stages.append(createRangeStage("meltTemp", 3, "meltTemp", minTm, maxTm))
+    if (kmerIndexDir is not None and maxEndHits is not None):
+        stages.append(createSpecificityStage(kmerIndexDir, maxEndHits))
+    if (structureHotMask is not None):
+        stages.append(createStructureRiskStage(structureHotMask))
+    if (minLinComp is not None):
+        stages.append(createLinCompStage(minLinComp))
+    if (minHairpinGibbs is not None):
+        stages.append(createHairpinStage(minHairpinGibbs))
+    if (minSelfDimerGibbs is not None):
+        stages.append(createSelfDimerStage(minSelfDimerGibbs))
+    return FilterPipeline(stages)
@@ -1,5 +1,13 @@
+from functools import cached_property
+from itertools import accumulate
 import seqtools as st
 import nndata as nn
+import profiling as prof
+
+# NN contributions of a pair of adjacent bases indexed by 4 * code1 + code2, as lists since they are indexed from Python
+loopPairCodeToG = nn.loopPairGTable.ravel().tolist()
+duplexPairCodeToG = nn.duplexPairGTable.ravel().tolist()
+
 
 class Hairpin:
     """
@@ -8,15 +16,29 @@ class Hairpin:
     stem1: A string representing the DNA bases from the 5' end of a hairpin up to the start of the loop (exclusive)
     loop: A string representing the DNA bases of the loop of a hairpin
     stem2: A string representing the DNA bases from the end of the loop (exclusive) to the 3' end of a hairpin
+
+    revStem1, minStemLen, score and totalGibbs are computed the first time they are accessed and then cached.
     """
     def __init__(self, stem1, loop, stem2):
         self.stem1 = stem1
         self.loop = loop
         self.stem2 = stem2
-        self.revStem1 = stem1[::-1]
-        self.minStemLen = self.getMinStemLen()
-        self.score = self.calcScore()
-        self.totalGibbs = self.calcTotalGibbs()
+
+    @cached_property
+    def revStem1(self):
+        return st.getRevSeq(self.stem1)
+
+    @cached_property
+    def minStemLen(self):
+        return self.getMinStemLen()
+
+    @cached_property
+    def score(self):
+        return self.calcScore()
+
+    @cached_property
+    def totalGibbs(self):
+        return self.calcTotalGibbs()
 
     def getMinStemLen(self):
         if (len(self.stem1) < len(self.stem2)):
@@ -70,6 +92,8 @@ class Hairpin:
         # Iterate through NN pairs
         for i in range(len(combinedSeq) - 1):
             G += nn.loopPairToG[combinedSeq[i:i+2]]
+        if (prof.activeProfiler is not None):
+            prof.count("nnLookups", len(combinedSeq) - 1)
         return G
     
     def calcMismatchGibbs(self):
@@ -81,10 +105,8 @@ class Hairpin:
         '''
         G = 0
         for i in range(self.minStemLen):
-            # Reverse the order of one stem in order to align it with the other
-            revStem1 = st.getRevSeq(self.stem1)
             # Add a penalty for each mismatch
-            if (st.getCompBase(revStem1[i]) != self.stem2[i]):
+            if (st.getCompBase(self.revStem1[i]) != self.stem2[i]):
                 G += nn.mismatchPenalty
         return G
     
@@ -97,8 +119,11 @@ class Hairpin:
         '''
         G = 0
         # Iterate through the valid NN pairs
-        for nnPair in self.getStemPairs():
+        nnPairs = self.getStemPairs()
+        for nnPair in nnPairs:
             G += nn.duplexPairToG[nnPair]
+        if (prof.activeProfiler is not None):
+            prof.count("nnLookups", len(nnPairs))
         # End correction based on the pair at the end of the stem and at the beginning of the loop
         # Checks that the base pair is matched correctly first
         if (st.getCompBase(self.revStem1[0]) == self.stem2[0]):
@@ -122,37 +147,235 @@ class Hairpin:
     def __str__(self):
         return f"Stem1: {self.stem1}\nLoop: {self.loop}\nStem2: {self.stem2}"
 
-def createPossHairpins(seq):
+def isGCCode(code):
+    return code == st.baseToCode["G"] or code == st.baseToCode["C"]
+
+def iterHairpinSplits(seq):
     '''
-    Finds possible hairpins that can form from a given sequence. A minimum stem length of two was chosen as well as a loop size 
-    between 4 and 5 bases based on real world data. These hairpins are then found using a basic sliding window algorithm.
+    Generates the splits of a sequence into stem1, loop and stem2 that createPossHairpins considers. A minimum stem length of two
+    was chosen as well as a loop size between 4 and 5 bases based on real world data. The splits are found using a basic sliding
+    window algorithm.
 
     seq: A DNA sequence (str)
-    Returns: A list of Hairpin objects (list)
+    Returns: A generator of (loopStart, loopEnd) tuples where the loop is seq[loopStart:loopEnd] (generator)
     '''
     minStemLength = 2
     minLoopSize = 4
-    possHairpins = []
     # No hairpins possible if sequence is smaller than 8 bp
     if (len(seq) < 8):
-        return possHairpins
-    # Create initial hairpin
-    stem1 = seq[0:minStemLength]
-    loop = seq[minStemLength: minStemLength + minLoopSize]
-    stem2 = seq[minStemLength + minLoopSize:]
-    possHairpins.append(Hairpin(stem1, loop, stem2))
-    while (len(stem2) > minStemLength or len(loop) > minLoopSize):
-        if (len(loop) == minLoopSize):
-            # Add a base to the loop
-            loop += stem2[0]
-            # Take off the first base of stem2
-            stem2 = stem2[1:]
+        return
+    # Create initial split
+    loopStart = minStemLength
+    loopEnd = minStemLength + minLoopSize
+    yield loopStart, loopEnd
+    while (len(seq) - loopEnd > minStemLength or loopEnd - loopStart > minLoopSize):
+        if (loopEnd - loopStart == minLoopSize):
+            # Add a base to the loop by taking off the first base of stem2
+            loopEnd += 1
         else:
-            # Add a base to stem1
-            stem1 += loop[0]
-            # Take off the first base of loop
-            loop = loop[1:]
-        # Add hairpin to list
-        possHairpins.append(Hairpin(stem1, loop, stem2))
-    return possHairpins
+            # Add a base to stem1 by taking off the first base of the loop
+            loopStart += 1
+        yield loopStart, loopEnd
+
+@prof.timed("createPossHairpins")
+def createPossHairpins(seq):
+    '''
+    Finds possible hairpins that can form from a given sequence, using the splits from iterHairpinSplits
+
+    seq: A DNA sequence (str or EncodedSeq)
+    Returns: A list of Hairpin objects (list)
+    '''
+    seq = str(seq)
+    hairpins = [Hairpin(seq[:loopStart], seq[loopStart:loopEnd], seq[loopEnd:]) for loopStart, loopEnd in iterHairpinSplits(seq)]
+    if (prof.activeProfiler is not None):
+        prof.count("hairpinsMaterialized", len(hairpins))
+    return hairpins
+
+def calcSplitGibbs(seq, loopStart, loopEnd):
+    '''
+    Calculates the same value as Hairpin.calcTotalGibbs for a split of a sequence without building a Hairpin
+
+    seq: A DNA sequence (str or EncodedSeq)
+    loopStart: The index of the first base of the loop (int)
+    loopEnd: The index after the last base of the loop (int)
+    Returns: The Gibbs free energy in kcal/mol of the hairpin (float)
+    '''
+    return SplitScorer(seq).calcGibbs(loopStart, loopEnd)
+
+class SplitScorer:
+    '''
+    Scores splits of one sequence into stem1, loop and stem2 without slicing out the stems or building Hairpin objects. The NN
+    contribution of each pair of adjacent bases is looked up once per sequence instead of once per split.
 
+    seq: A DNA sequence (str or EncodedSeq)
+    '''
+    def __init__(self, seq):
+        self.seq = seq
+        self.codes = st.toCodeBytes(seq)
+        self.compCodes = self.codes.translate(st.compCodeTable)
+        codes = self.codes
+        # Contributions of the pair of bases starting at x when it is in a loop, and when it is stacked in stem1. A stacked
+        # pair's duplex key only depends on the bases of stem1.
+        self.loopPairG = [loopPairCodeToG[4 * codes[x] + codes[x + 1]] for x in range(len(codes) - 1)]
+        self.stemPairG = [duplexPairCodeToG[4 * codes[x + 1] + codes[x]] for x in range(len(codes) - 1)]
+        # Prefix sums of the above, used to bound the energy of a split without scoring it
+        self.loopPrefixG = [0.0] + list(accumulate(self.loopPairG))
+        self.stemPrefixG = [0.0] + list(accumulate(self.stemPairG))
+        if (prof.activeProfiler is not None):
+            prof.count("nnLookups", 2 * len(self.loopPairG))
+
+    def calcGibbs(self, loopStart, loopEnd):
+        '''
+        Calculates the same value as Hairpin.calcTotalGibbs, adding the contributions in the same order
+
+        loopStart: The index of the first base of the loop (int)
+        loopEnd: The index after the last base of the loop (int)
+        Returns: The Gibbs free energy in kcal/mol of the hairpin (float)
+        '''
+        codes = self.codes
+        minStemLen = min(loopStart, len(codes) - loopEnd)
+        # isMatch[i] tells whether the i-th base pair counting outwards from the loop is complementary
+        isMatch = [compCode == code for compCode, code in zip(reversed(self.compCodes[loopStart - minStemLen:loopStart]), codes[loopEnd:loopEnd + minStemLen])]
+        stemG = 0
+        stemPairG = self.stemPairG
+        for i in range(minStemLen - 1):
+            if (isMatch[i] and isMatch[i + 1]):
+                stemG += stemPairG[loopStart - 2 - i]
+        if (isMatch[0]):
+            stemG += nn.stemTermgcAmtG if isGCCode(codes[loopStart - 1]) else nn.stemTermatAmtG
+        loopG = 0
+        for pairG in self.loopPairG[loopStart - 1:loopEnd]:
+            loopG += pairG
+        mismatchG = 0
+        for match in isMatch:
+            if (not match):
+                mismatchG += nn.mismatchPenalty
+        return stemG + loopG + mismatchG
+
+    def calcBound(self, loopStart, loopEnd):
+        '''
+        Calculates a lower bound on calcGibbs in O(1) from the exact loop and closing pair energies and the energy the rest of
+        the stem would have if every pair were stacked
+
+        loopStart: The index of the first base of the loop (int)
+        loopEnd: The index after the last base of the loop (int)
+        Returns: A lower bound on the Gibbs free energy in kcal/mol of the hairpin (float)
+        '''
+        codes = self.codes
+        minStemLen = min(loopStart, len(codes) - loopEnd)
+        bound = self.loopPrefixG[loopEnd] - self.loopPrefixG[loopStart - 1]
+        if (self.compCodes[loopStart - 1] != codes[loopEnd]):
+            bound += nn.mismatchPenalty
+        elif (isGCCode(codes[loopStart - 1])):
+            bound += nn.stemTermgcAmtG
+        else:
+            bound += nn.stemTermatAmtG
+        return bound + self.stemPrefixG[loopStart - 1] - self.stemPrefixG[loopStart - minStemLen]
+
+@prof.timed("bestHairpin")
+def bestHairpin(seq, threshold=None):
+    '''
+    Finds the hairpin with the lowest Gibbs free energy among the splits of createPossHairpins without building every Hairpin.
+    Splits are scored in order of their SplitScorer.calcBound, stopping once the bound shows that no remaining split can beat
+    the current best or go below threshold.
+
+    seq: A DNA sequence (str or EncodedSeq)
+    threshold: A Gibbs free energy in kcal/mol below which a hairpin is a problem, or None to always find the lowest (float)
+    Returns: The hairpin with the lowest Gibbs free energy, or None if no hairpin fits. If the lowest energy is not below
+    threshold, a hairpin at or above threshold is returned instead of the lowest one. (Hairpin)
+    '''
+    scorer = SplitScorer(seq)
+    bounds = sorted((scorer.calcBound(loopStart, loopEnd), order, loopStart, loopEnd)
+                    for order, (loopStart, loopEnd) in enumerate(iterHairpinSplits(seq)))
+    best = None
+    bestG = None
+    numScored = 0
+    for bound, order, loopStart, loopEnd in bounds:
+        # Allow for rounding in the prefix sums so that ties are still scored
+        bound -= 1e-9
+        if (bestG is not None and (bound > bestG[0] or (threshold is not None and bound >= threshold))):
+            break
+        G = scorer.calcGibbs(loopStart, loopEnd)
+        numScored += 1
+        # Keep the earliest split on ties, like min() over createPossHairpins
+        if (bestG is None or (G, order) < bestG):
+            bestG = (G, order)
+            best = (loopStart, loopEnd)
+    if (prof.activeProfiler is not None):
+        prof.count("hairpinSplitsScored", numScored)
+    if (best is None):
+        return None
+    prof.count("hairpinsMaterialized")
+    loopStart, loopEnd = best
+    return Hairpin(str(seq[:loopStart]), str(seq[loopStart:loopEnd]), str(seq[loopEnd:]))
+
+@prof.timed("findMinGibbsHairpin")
+def findMinGibbsHairpin(seq, minStemLength=2, minLoopSize=4, maxLoopSize=None):
+    '''
+    Finds the hairpin with the minimum Gibbs free energy over every loop placement and stem length using dynamic programming.
+    The pairs of a stem all lie on one anti-diagonal (their indexes have the same sum), so prefix sums along each anti-diagonal
+    give the stem energy of any loop placement and stem length in O(1), for O(L^2) time in total. Only the winning hairpin is
+    built, with both stems trimmed to the paired bases.
+
+    seq: A DNA sequence (str or EncodedSeq)
+    minStemLength: The minimum number of base pairs in the stem (int)
+    minLoopSize: The minimum number of bases in the loop (int)
+    maxLoopSize: The maximum number of bases in the loop, or None for no limit (int)
+    Returns: The hairpin with the lowest total Gibbs free energy, or None if no hairpin fits (Hairpin)
+    '''
+    codes = st.toCodeBytes(seq)
+    seqLen = len(codes)
+    if (maxLoopSize is None):
+        maxLoopSize = seqLen
+    # loopG[x] is the sum of the loop NN contributions of the pairs starting before x
+    loopG = [0.0] * seqLen
+    for x in range(seqLen - 1):
+        loopG[x + 1] = loopG[x] + loopPairCodeToG[4 * codes[x] + codes[x + 1]]
+    isComp = lambda p, q: codes[p] + codes[q] == 3
+    best = None
+    bestG = None
+    # Stems pair seq[p] with seq[q] where p + q is the same for every pair of a stem
+    for diagonal in range(2 * minStemLength + minLoopSize - 1, 2 * seqLen - 2 * minStemLength - minLoopSize):
+        # The outermost pair of any stem on this diagonal, limited by the 5' and 3' ends of the sequence
+        lowP = max(0, diagonal - seqLen + 1)
+        highP = (diagonal - minLoopSize - 1) // 2
+        if (highP - lowP + 1 < minStemLength):
+            continue
+        # pairG[p - lowP] is the energy pair (p, q) adds to a stem when it is not the pair closing the loop
+        pairG = []
+        for p in range(lowP, highP + 1):
+            q = diagonal - p
+            if (not isComp(p, q)):
+                pairG.append(nn.mismatchPenalty)
+            elif (isComp(p + 1, q - 1)):
+                pairG.append(duplexPairCodeToG[4 * codes[p + 1] + codes[p]])
+            else:
+                pairG.append(0.0)
+        # suffixG[k] is the energy of the pairs from lowP + k to highP, and minSuffix[k] the lowest of suffixG[0..k]
+        suffixG = [0.0] * (len(pairG) + 1)
+        for k in range(len(pairG) - 1, -1, -1):
+            suffixG[k] = suffixG[k + 1] + pairG[k]
+        minSuffix = [0] * len(suffixG)
+        for k in range(1, len(suffixG)):
+            minSuffix[k] = k if suffixG[k] < suffixG[minSuffix[k - 1]] else minSuffix[k - 1]
+        # Try each closing pair (p, q), where the loop is seq[p + 1:q]
+        for p in range(lowP + minStemLength - 1, highP + 1):
+            q = diagonal - p
+            if (q - p - 1 > maxLoopSize):
+                continue
+            G = loopG[q] - loopG[p]
+            if (isComp(p, q)):
+                G += nn.stemTermgcAmtG if isGCCode(codes[p]) else nn.stemTermatAmtG
+            else:
+                G += nn.mismatchPenalty
+            # Extend the stem outwards to the outermost pair that gives the lowest energy
+            outer = minSuffix[p - lowP - minStemLength + 1]
+            G += suffixG[outer] - suffixG[p - lowP]
+            if (bestG is None or G < bestG):
+                bestG = G
+                best = (lowP + outer, p + 1, q, q + p - lowP - outer + 1)
+    if (best is None):
+        return None
+    prof.count("hairpinsMaterialized")
+    stemStart, loopStart, loopEnd, stemEnd = best
+    return Hairpin(str(seq[stemStart:loopStart]), str(seq[loopStart:loopEnd]), str(seq[loopEnd:stemEnd]))
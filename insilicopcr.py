@@ -0,0 +1,233 @@
+import argparse
+from dataclasses import dataclass
+import sys
+import numpy as np
+import fasta
+import kmerindex as ki
+import seqtools as st
+
+# Number of bases packed into each 64-bit word when counting mismatches
+wordBases = 32
+# The low bit of every 2-bit base slot of a word
+lowBits = np.uint64(0x5555555555555555)
+# Number of set bits in each byte, for NumPy versions without bitwise_count
+byteBitCounts = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+@dataclass
+class Amplicon:
+    '''
+    Describes a product predicted for a primer pair
+
+    pairName: A string representing the name of the primer pair
+    record: A string representing the name of the reference record the product is on
+    start: An integer representing the location of the first base of the product on the record
+    end: An integer representing the location of the last base of the product on the record
+    size: An integer representing the number of bases in the product
+    forwardPrimer: A string naming the primer that binds the reverse strand and extends along the forward strand, "forward" or
+    "reverse"
+    reversePrimer: A string naming the primer that binds the forward strand and extends along the reverse strand
+    forwardMismatches: An integer representing the number of mismatches of forwardPrimer's binding site
+    reverseMismatches: An integer representing the number of mismatches of reversePrimer's binding site
+    '''
+    pairName: str
+    record: str
+    start: int
+    end: int
+    size: int
+    forwardPrimer: str
+    reversePrimer: str
+    forwardMismatches: int
+    reverseMismatches: int
+
+def countBits(values):
+    '''
+    Counts the set bits of each 64-bit word
+
+    values: A NumPy uint64 array
+    Returns: The number of set bits of each word (np.ndarray)
+    '''
+    if (hasattr(np, "bitwise_count")):
+        return np.bitwise_count(values).astype(np.int64)
+    return byteBitCounts[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+def packTarget(seq):
+    '''
+    Helper function for countMismatches. Packs a sequence into words of up to wordBases bases, with the first base of each word
+    in its highest two bits.
+
+    seq: A DNA sequence (str or EncodedSeq)
+    Returns: The packed words and the number of bases in each (list of tuple)
+    '''
+    codes = st.toCodeBytes(seq)
+    words = []
+    for wordStart in range(0, len(codes), wordBases):
+        word = 0
+        for code in codes[wordStart:wordStart + wordBases]:
+            word = (word << 2) | code
+        words.append((word, min(wordBases, len(codes) - wordStart)))
+    return words
+
+class ChunkWords:
+    '''
+    Packs the wordBases bases starting at every location of a reference chunk, so the bases of any site can be compared with a
+    primer a whole word at a time
+
+    codes: A NumPy uint8 array of base codes, where codes above 3 are bases other than A, C, G or T
+    '''
+    def __init__(self, codes):
+        # Pad the end with bases other than A, C, G or T so that every location starts a full word
+        padded = np.concatenate([codes, np.full(wordBases - 1, st.padCode, dtype=np.uint8)])
+        self.words = ki.calcKmerValues(padded, wordBases)[0]
+        # The low bit of a base's slot is set if the base is not A, C, G or T, so it never counts as a match
+        self.otherWords = ki.calcKmerValues(np.minimum(padded >> 2, 1), wordBases)[0]
+
+    def countMismatches(self, starts, target):
+        '''
+        Counts the mismatches between a target sequence and the reference at each start with bit-parallel Hamming distance.
+        The XOR of two packed words has a non-zero slot for every base that differs, and the slots are counted with popcount.
+
+        starts: The locations of the sites on the chunk (np.ndarray)
+        target: The packed target sequence from packTarget (list of tuple)
+        Returns: The number of mismatches at each site (np.ndarray)
+        '''
+        numMismatches = np.zeros(len(starts), dtype=np.int64)
+        for i, (targetWord, numBases) in enumerate(target):
+            # A word shorter than wordBases is the highest bases of the reference word
+            shift = np.uint64(2 * (wordBases - numBases))
+            diff = (self.words[starts + i * wordBases] >> shift) ^ np.uint64(targetWord)
+            slots = ((diff | (diff >> np.uint64(1))) & lowBits) | (self.otherWords[starts + i * wordBases] >> shift)
+            numMismatches += countBits(slots)
+        return numMismatches
+
+def findSites(chunkWords, seedIndex, primer, seedLen, maxMismatches, isReverse, chunkLen):
+    '''
+    Finds the binding sites of a primer on one strand of a chunk. A site must match the last seedLen bases of the primer, its
+    3' end, exactly and have at most maxMismatches mismatches in total.
+
+    chunkWords: The packed words of the chunk (ChunkWords)
+    seedIndex: The sorted seed k-mers of the chunk and their locations (tuple of np.ndarray)
+    primer: The primer sequence, 5' to 3' (str)
+    seedLen: The number of bases at the 3' end that must match exactly (int)
+    maxMismatches: The maximum number of mismatches (int)
+    isReverse: Whether to find sites on the reverse strand, where the chunk holds the primer's reverse complement (bool)
+    chunkLen: The number of bases in the chunk (int)
+    Returns: The start of each site on the chunk and its number of mismatches (tuple of np.ndarray)
+    '''
+    seedValues, seedStarts = seedIndex
+    if (isReverse):
+        # The primer's 3' end pairs with the leftmost bases of its reverse complement on the forward strand
+        target = st.getRevSeq(st.getCompSeq(primer))
+        seed = target[:seedLen]
+        seedOffset = 0
+    else:
+        target = primer
+        seed = target[-seedLen:]
+        seedOffset = len(primer) - seedLen
+    seedValue = np.uint64(ki.encodeKmers([seed], seedLen)[0])
+    low = np.searchsorted(seedValues, seedValue, "left")
+    high = np.searchsorted(seedValues, seedValue, "right")
+    starts = seedStarts[low:high] - seedOffset
+    starts = starts[(starts >= 0) & (starts + len(primer) <= chunkLen)]
+    numMismatches = chunkWords.countMismatches(starts, packTarget(target))
+    isSite = numMismatches <= maxMismatches
+    return starts[isSite], numMismatches[isSite]
+
+def iterAmplicons(pairs, handle, maxProduct=2000, maxMismatches=3, seedLen=10, chunkSize=1000000):
+    '''
+    Predicts the products of primer pairs against a reference streamed chunk by chunk. Each primer is seeded on exact matches
+    of its 3' end, extended with bit-parallel mismatch counting, and every site on the forward strand is paired with every
+    site on the reverse strand that ends within maxProduct bases. Both primers of a pair can act as either the forward or the
+    reverse primer, so products of one primer alone are reported too.
+
+    pairs: The primer pairs as (name, forward primer, reverse primer) tuples, primers 5' to 3' (list of tuple)
+    handle: A text file object of the reference FASTA file
+    maxProduct: The maximum product size (int)
+    maxMismatches: The maximum number of mismatches of a binding site (int)
+    seedLen: The number of bases at each primer's 3' end that must match exactly, at most 31 (int)
+    chunkSize: The number of bases read at a time (int)
+    Returns: A generator of the predicted products in reference order for each chunk (generator of Amplicon)
+    '''
+    for name, forward, reverse in pairs:
+        if (min(len(forward), len(reverse)) < seedLen):
+            raise ValueError(f"The primers of {name} are shorter than the seed length {seedLen}")
+    # Chunks share maxProduct - 1 bases, so every product lies within the chunk that owns its start
+    for chunk in fasta.iterFastaChunks(handle, chunkSize, maxProduct - 1):
+        codes = np.frombuffer(chunk.seq.encode("ascii").translate(st.encodeTable), dtype=np.uint8)
+        chunkWords = ChunkWords(codes)
+        seedValues, isValid = ki.calcKmerValues(codes, seedLen)
+        seedStarts = np.flatnonzero(isValid)
+        order = np.argsort(seedValues[seedStarts], kind="stable")
+        seedIndex = (seedValues[seedStarts][order], seedStarts[order])
+        amplicons = []
+        for name, forward, reverse in pairs:
+            primers = (("forward", forward), ("reverse", reverse))
+            plusSites = [(label, primer) + findSites(chunkWords, seedIndex, primer, seedLen, maxMismatches, False, len(codes))
+                         for label, primer in primers]
+            minusSites = [(label, primer) + findSites(chunkWords, seedIndex, primer, seedLen, maxMismatches, True, len(codes))
+                          for label, primer in primers]
+            for plusLabel, plusPrimer, plusStarts, plusMismatches in plusSites:
+                for minusLabel, minusPrimer, minusStarts, minusMismatches in minusSites:
+                    minusEnds = minusStarts + len(minusPrimer) - 1
+                    order = np.argsort(minusEnds, kind="stable")
+                    minusEnds = minusEnds[order]
+                    minusMismatches = minusMismatches[order]
+                    for start, mismatches in zip(plusStarts.tolist(), plusMismatches.tolist()):
+                        if (start >= chunk.numOwned):
+                            continue
+                        # The product must cover both primers and be at most maxProduct bases
+                        low = np.searchsorted(minusEnds, start + max(len(plusPrimer), len(minusPrimer)) - 1, "left")
+                        high = np.searchsorted(minusEnds, start + maxProduct - 1, "right")
+                        for end, otherMismatches in zip(minusEnds[low:high].tolist(), minusMismatches[low:high].tolist()):
+                            amplicons.append(Amplicon(name, chunk.name, chunk.start + start, chunk.start + end, end - start + 1,
+                                                      plusLabel, minusLabel, mismatches, otherMismatches))
+        amplicons.sort(key=lambda amplicon: (amplicon.start, amplicon.end))
+        yield from amplicons
+
+def readPrimerPairs(path):
+    '''
+    Reads primer pairs from a tab-separated file with a name, a forward primer and a reverse primer on each line
+
+    path: The path of the file (str)
+    Returns: The primer pairs as (name, forward primer, reverse primer) tuples (list of tuple)
+    '''
+    pairs = []
+    with open(path) as handle:
+        for line in handle:
+            fields = line.split()
+            if (not fields or fields[0].startswith("#")):
+                continue
+            if (len(fields) != 3):
+                raise ValueError(f"Expected a name, a forward primer and a reverse primer: {line.strip()}")
+            pairs.append((fields[0], fields[1].upper(), fields[2].upper()))
+    return pairs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predicts the products of primer pairs against a reference (in-silico PCR)")
+    parser.add_argument("reference", help="reference FASTA file, optionally gzipped, or - for standard input")
+    parser.add_argument("primers", help="tab-separated file of name, forward primer and reverse primer")
+    parser.add_argument("-o", "--output", default="-", help="TSV file to write the products to, or - for standard output")
+    parser.add_argument("--max-product", type=int, default=2000, help="maximum product size")
+    parser.add_argument("--max-mismatches", type=int, default=3, help="maximum mismatches of a binding site")
+    parser.add_argument("--seed-len", type=int, default=10, help="number of bases at the 3' end that must match exactly")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="number of bases read at a time")
+    args = parser.parse_args(argv)
+    if (not 1 <= args.seed_len <= 31):
+        sys.exit("--seed-len must be between 1 and 31")
+    pairs = readPrimerPairs(args.primers)
+    inHandle = fasta.openFasta(args.reference)
+    outHandle = sys.stdout if args.output == "-" else open(args.output, "w")
+    numAmplicons = 0
+    try:
+        outHandle.write("pair\trecord\tstart\tend\tsize\tforwardPrimer\treversePrimer\tforwardMismatches\treverseMismatches\n")
+        for amplicon in iterAmplicons(pairs, inHandle, args.max_product, args.max_mismatches, args.seed_len, args.chunk_size):
+            outHandle.write("\t".join(str(value) for value in vars(amplicon).values()) + "\n")
+            numAmplicons += 1
+    finally:
+        if (inHandle is not sys.stdin):
+            inHandle.close()
+        if (outHandle is not sys.stdout):
+            outHandle.close()
+    print(f"Predicted {numAmplicons} products", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import argparse
+from dataclasses import dataclass
+from functools import lru_cache
+import json
+import os
+import shutil
+import sys
+import numpy as np
+import fasta
+import seqtools as st
+
+# Number of leading bases used to split k-mers into buckets while building, so only one bucket is sorted in memory at a time
+bucketBases = 4
+indexVersion = 1
+
+@dataclass
+class KmerHits:
+    '''
+    Describes the hits of a batch of k-mer queries. The hits of query i are at index offsets[i] to offsets[i + 1] of positions
+    and isReverse.
+
+    counts: An integer array of the number of hits of each query
+    offsets: An integer array of where the hits of each query start, with one extra entry for the end
+    positions: An integer array of the genome position of the first base of each hit on the forward strand
+    isReverse: A boolean array telling whether each hit is of the reverse complement of the query
+    '''
+    counts: np.ndarray
+    offsets: np.ndarray
+    positions: np.ndarray
+    isReverse: np.ndarray
+
+    def getHits(self, i):
+        '''
+        Returns: The positions of the hits of query i and whether each is on the reverse strand (tuple of np.ndarray)
+        '''
+        return self.positions[self.offsets[i]:self.offsets[i + 1]], self.isReverse[self.offsets[i]:self.offsets[i + 1]]
+
+def calcKmerValues(codes, k):
+    '''
+    Packs every k-mer of a sequence into an integer, with the first base in the highest two bits
+
+    codes: A NumPy uint8 array of base codes, where codes above 3 are bases other than A, C, G or T
+    k: The k-mer length, at most 32 (int)
+    Returns: The value of the k-mer starting at each location and whether it only contains A, C, G and T (tuple of np.ndarray)
+    '''
+    numKmers = max(len(codes) - k + 1, 0)
+    values = np.zeros(numKmers, dtype=np.uint64)
+    for j in range(k):
+        values = (values << np.uint64(2)) | (codes[j:j + numKmers] & 3).astype(np.uint64)
+    isOther = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes > 3, out=isOther[1:])
+    return values, isOther[k:k + numKmers] == isOther[:numKmers]
+
+def encodeKmers(seqs, k):
+    '''
+    Packs the last k bases of each sequence, the end a primer extends from, into an integer as in calcKmerValues
+
+    seqs: A list of DNA sequences of at least k bases (list of str or EncodedSeq)
+    k: The k-mer length (int)
+    Returns: The value of the last k-mer of each sequence (np.ndarray)
+    '''
+    values = []
+    for seq in seqs:
+        if (len(seq) < k):
+            raise ValueError(f"Sequences must have at least {k} bases")
+        value = 0
+        for code in st.toCodeBytes(seq[len(seq) - k:]):
+            value = (value << 2) | code
+        values.append(value)
+    return np.array(values, dtype=np.uint64)
+
+def calcRevCompValues(values, k):
+    '''
+    Calculates the packed reverse complement of packed k-mers
+
+    values: The packed k-mers (np.ndarray)
+    k: The k-mer length (int)
+    Returns: The packed reverse complements (np.ndarray)
+    '''
+    revComp = np.zeros(len(values), dtype=np.uint64)
+    for j in range(k):
+        code = (values >> np.uint64(2 * j)) & np.uint64(3)
+        revComp = (revComp << np.uint64(2)) | (np.uint64(3) - code)
+    return revComp
+
+def buildKmerIndex(fastaPath, indexDir, k=12, chunkSize=1000000):
+    '''
+    Builds an on-disk index of every k-mer of a genome. The genome is streamed and its k-mers are split into buckets on disk by
+    their first bases, then each bucket is sorted in memory and appended to the index, so memory use is bounded by the size of
+    a bucket rather than of the genome. K-mers containing a base other than A, C, G or T are left out.
+
+    fastaPath: The path of the genome FASTA file, optionally gzipped (str)
+    indexDir: The directory to write the index to (str)
+    k: The k-mer length, at most 31 (int)
+    chunkSize: The number of bases read at a time (int)
+    Returns: The number of k-mers indexed (int)
+    '''
+    if (k < bucketBases or k > 31):
+        raise ValueError(f"k must be between {bucketBases} and 31")
+    os.makedirs(indexDir, exist_ok=True)
+    bucketDir = os.path.join(indexDir, "buckets")
+    os.makedirs(bucketDir, exist_ok=True)
+    numBuckets = 4 ** bucketBases
+    bucketShift = np.uint64(2 * (k - bucketBases))
+    records = []
+    genomeLength = 0
+    try:
+        # Each bucket file holds (k-mer, position) pairs in genome order
+        bucketFiles = [open(os.path.join(bucketDir, f"{bucket}.bin"), "wb") for bucket in range(numBuckets)]
+        try:
+            handle = fasta.openFasta(fastaPath)
+            try:
+                for chunk in fasta.iterFastaChunks(handle, chunkSize, k - 1):
+                    if (chunk.start == 0):
+                        genomeLength += records[-1]["length"] if records else 0
+                        records.append({"name": chunk.name, "offset": genomeLength, "length": 0})
+                    records[-1]["length"] = chunk.start + len(chunk.seq)
+                    codes = np.frombuffer(chunk.seq.encode("ascii").translate(st.encodeTable), dtype=np.uint8)
+                    values, isValid = calcKmerValues(codes, k)
+                    isValid[chunk.numOwned:] = False
+                    starts = np.flatnonzero(isValid)
+                    pairs = np.empty((len(starts), 2), dtype=np.uint64)
+                    pairs[:, 0] = values[starts]
+                    pairs[:, 1] = starts + records[-1]["offset"] + chunk.start
+                    buckets = pairs[:, 0] >> bucketShift
+                    order = np.argsort(buckets, kind="stable")
+                    bounds = np.searchsorted(buckets[order], np.arange(numBuckets + 1))
+                    for bucket in range(numBuckets):
+                        if (bounds[bucket] < bounds[bucket + 1]):
+                            bucketFiles[bucket].write(pairs[order[bounds[bucket]:bounds[bucket + 1]]].tobytes())
+            finally:
+                if (handle is not sys.stdin):
+                    handle.close()
+        finally:
+            for bucketFile in bucketFiles:
+                bucketFile.close()
+        bucketSizes = [os.path.getsize(os.path.join(bucketDir, f"{bucket}.bin")) // 16 for bucket in range(numBuckets)]
+        numKmers = sum(bucketSizes)
+        kmers = np.lib.format.open_memmap(os.path.join(indexDir, "kmers.npy"), "w+", np.uint64, (numKmers,))
+        positions = np.lib.format.open_memmap(os.path.join(indexDir, "positions.npy"), "w+", np.uint64, (numKmers,))
+        start = 0
+        for bucket in range(numBuckets):
+            pairs = np.fromfile(os.path.join(bucketDir, f"{bucket}.bin"), dtype=np.uint64).reshape(-1, 2)
+            # A stable sort keeps the positions of equal k-mers in genome order
+            order = np.argsort(pairs[:, 0], kind="stable")
+            kmers[start:start + len(pairs)] = pairs[order, 0]
+            positions[start:start + len(pairs)] = pairs[order, 1]
+            start += len(pairs)
+        kmers.flush()
+        positions.flush()
+        del kmers, positions
+    finally:
+        shutil.rmtree(bucketDir, ignore_errors=True)
+    with open(os.path.join(indexDir, "index.json"), "w") as handle:
+        json.dump({"version": indexVersion, "k": k, "numKmers": numKmers, "records": records}, handle, indent=2)
+    return numKmers
+
+class KmerIndex:
+    '''
+    A k-mer index built by buildKmerIndex. The sorted k-mers and their positions are memory-mapped, so opening the index
+    reads almost nothing and each query only touches the pages its binary search visits.
+
+    indexDir: The directory the index was written to (str)
+    '''
+    def __init__(self, indexDir):
+        with open(os.path.join(indexDir, "index.json")) as handle:
+            info = json.load(handle)
+        if (info["version"] != indexVersion):
+            raise ValueError(f"Unsupported k-mer index version {info['version']}")
+        self.k = info["k"]
+        self.records = info["records"]
+        self.recordOffsets = np.array([record["offset"] for record in self.records], dtype=np.int64)
+        self.kmers = np.load(os.path.join(indexDir, "kmers.npy"), mmap_mode="r")
+        self.positions = np.load(os.path.join(indexDir, "positions.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def findRanges(self, values):
+        '''
+        Binary searches packed k-mers
+
+        values: The packed k-mers (np.ndarray)
+        Returns: The start and end (exclusive) of the run of each k-mer in the index (tuple of np.ndarray)
+        '''
+        return np.searchsorted(self.kmers, values, "left"), np.searchsorted(self.kmers, values, "right")
+
+    def countHits(self, seqs, bothStrands=True):
+        '''
+        Counts how often the last k bases of each sequence occur in the genome
+
+        seqs: A list of DNA sequences of at least k bases, such as primer candidates (list of str or EncodedSeq)
+        bothStrands: Whether to also count occurrences on the reverse strand (bool)
+        Returns: The number of hits of each sequence (np.ndarray)
+        '''
+        return self.countValueHits(encodeKmers(seqs, self.k), bothStrands)
+
+    def countValueHits(self, values, bothStrands=True):
+        '''
+        Counts how often packed k-mers occur in the genome, as in countHits
+
+        values: The packed k-mers, see calcKmerValues (np.ndarray)
+        bothStrands: Whether to also count occurrences on the reverse strand (bool)
+        Returns: The number of hits of each k-mer (np.ndarray)
+        '''
+        low, high = self.findRanges(values)
+        counts = high - low
+        if (bothStrands):
+            revValues = calcRevCompValues(values, self.k)
+            revLow, revHigh = self.findRanges(revValues)
+            # A k-mer that is its own reverse complement would otherwise be counted twice
+            counts += np.where(revValues != values, revHigh - revLow, 0)
+        return counts
+
+    def query(self, seqs, bothStrands=True):
+        '''
+        Finds where the last k bases of each sequence occur in the genome
+
+        seqs: A list of DNA sequences of at least k bases, such as primer candidates (list of str or EncodedSeq)
+        bothStrands: Whether to also find occurrences on the reverse strand (bool)
+        Returns: The hits of each sequence (KmerHits)
+        '''
+        values = encodeKmers(seqs, self.k)
+        ranges = [self.findRanges(values) + (np.zeros(len(values), dtype=bool),)]
+        if (bothStrands):
+            revValues = calcRevCompValues(values, self.k)
+            revLow, revHigh = self.findRanges(revValues)
+            revHigh = np.where(revValues != values, revHigh, revLow)
+            ranges.append((revLow, revHigh, np.ones(len(values), dtype=bool)))
+        counts = sum(high - low for low, high, isReverse in ranges)
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        positions = []
+        isReverse = []
+        for i in range(len(values)):
+            for low, high, strand in ranges:
+                positions.append(self.positions[low[i]:high[i]])
+                isReverse.append(np.full(high[i] - low[i], strand[i]))
+        return KmerHits(counts, offsets, np.concatenate(positions or [np.zeros(0, dtype=np.uint64)]).astype(np.int64),
+                        np.concatenate(isReverse or [np.zeros(0, dtype=bool)]))
+
+    def getLocations(self, positions):
+        '''
+        Converts genome positions to locations on records
+
+        positions: The genome positions (np.ndarray)
+        Returns: The name of the record of each position and the position on the record (tuple of list and np.ndarray)
+        '''
+        positions = np.asarray(positions, dtype=np.int64)
+        recordIndexes = np.searchsorted(self.recordOffsets, positions, "right") - 1
+        return [self.records[i]["name"] for i in recordIndexes.tolist()], positions - self.recordOffsets[recordIndexes]
+
+@lru_cache(maxsize=None)
+def openKmerIndex(indexDir):
+    '''
+    Opens a k-mer index once per process
+
+    indexDir: The directory the index was written to (str)
+    Returns: The index (KmerIndex)
+    '''
+    return KmerIndex(indexDir)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds an on-disk k-mer index of a genome for 3' end specificity checks")
+    parser.add_argument("fasta", help="genome FASTA file, optionally gzipped, or - for standard input")
+    parser.add_argument("index", help="directory to write the index to")
+    parser.add_argument("-k", type=int, default=12, help="k-mer length")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="number of bases read at a time")
+    args = parser.parse_args(argv)
+    numKmers = buildKmerIndex(args.fasta, args.index, args.k, args.chunk_size)
+    print(f"Indexed {numKmers} {args.k}-mers", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
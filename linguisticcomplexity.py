@@ -1,3 +1,6 @@
+from functools import lru_cache
+import seqtools as st
+
 class Node:
     '''
     A generic trie node
@@ -63,6 +66,84 @@ class SuffixTrie:
         for key in node.getNextNodes().keys():
             self.printPaths(node.getNextNode(key), word + key)
 
+class SuffixAutomaton:
+    '''
+    A suffix automaton (directed acyclic word graph) of a word. Every distinct substring of the word corresponds to exactly
+    one path from the initial state, so the automaton stores all of them in O(n) states instead of O(n^2) trie nodes.
+    '''
+    def __init__(self, word=""):
+        # Parallel lists indexed by state: length of the longest string in the state, suffix link and transitions
+        self.lengths = [0]
+        self.links = [-1]
+        self.nextStates = [{}]
+        self.last = 0
+        self.distinctSubstrings = 0
+        for letter in word:
+            self.addLetter(letter)
+
+    def addLetter(self, letter):
+        '''
+        Extends the automaton by one letter on the right in amortized O(1) time
+
+        letter: The letter to append (str)
+        '''
+        lengths = self.lengths
+        links = self.links
+        nextStates = self.nextStates
+        cur = len(lengths)
+        lengths.append(lengths[self.last] + 1)
+        links.append(0)
+        nextStates.append({})
+        state = self.last
+        # Add transitions to the new state from every suffix state that lacks one for the letter
+        while (state != -1 and letter not in nextStates[state]):
+            nextStates[state][letter] = cur
+            state = links[state]
+        if (state != -1):
+            nextState = nextStates[state][letter]
+            if (lengths[state] + 1 == lengths[nextState]):
+                links[cur] = nextState
+            else:
+                # Split nextState by cloning it so that the clone holds the shorter strings
+                clone = len(lengths)
+                lengths.append(lengths[state] + 1)
+                links.append(links[nextState])
+                nextStates.append(dict(nextStates[nextState]))
+                while (state != -1 and nextStates[state].get(letter) == nextState):
+                    nextStates[state][letter] = clone
+                    state = links[state]
+                links[nextState] = clone
+                links[cur] = clone
+        self.last = cur
+        # Every new state contributes the strings between its suffix link's length and its own length
+        self.distinctSubstrings += lengths[cur] - lengths[links[cur]]
+
+    def getDistinctSubstrings(self):
+        return self.distinctSubstrings
+
+def getLetters(seq):
+    '''
+    Helper function so that the complexity functions accept encoded sequences. Letters only need to be comparable, so an
+    EncodedSeq is used as its base codes and a string is used as is.
+
+    seq: A DNA sequence (str or EncodedSeq)
+    Returns: A sequence of letters (str or bytes)
+    '''
+    if (isinstance(seq, st.EncodedSeq)):
+        return seq.toBytes()
+    return seq
+
+def countDistinctSubstrings(seq):
+    '''
+    Counts the number of distinct non-empty substrings of a sequence in O(n) time. Gives the same value as the number of
+    edges of a SuffixTrie built from the sequence's suffixes.
+
+    seq: A DNA sequence (string or EncodedSeq)
+    Returns: The number of distinct substrings (int)
+    '''
+    return SuffixAutomaton(getLetters(seq)).getDistinctSubstrings()
+
+@lru_cache(maxsize=None)
 def calcMaxVocab(alphaSize, wordLen):
     '''
     Helper function for calculating linguistic complexity
@@ -71,27 +152,104 @@ def calcMaxVocab(alphaSize, wordLen):
     wordLen: The length of the word (int)
     Returns: The maximum vocabulary of words of length 1 to m that can be formed by taking substrings of a word of wordLen (int)
     ''' 
-    maxVocab = 0
-    # Calculate the maximum vocabulary of words of length i
-    for i in range(1, wordLen + 1):
-        # Represents the max number of unique words of length i with regards to the alphabet. 
-        val1 = alphaSize ** i
-        # Represents the max number of unique words of length i that can be obtained by taking substrings of a word of wordLen. 
-        # Invalid when wordLen > alphaSize
-        val2 = wordLen - i + 1
-        # Choose the minimum of the two values
-        maxVocab += min(val1, val2)
-    return maxVocab
+    # For short word lengths i the alphabet limits the vocabulary (alphaSize ** i), for longer ones the number of substrings of
+    # length i does (wordLen - i + 1). Find the last length limited by the alphabet, which takes O(log(wordLen)) steps.
+    numAlphaLimited = 0
+    while (numAlphaLimited < wordLen and alphaSize ** (numAlphaLimited + 1) < wordLen - numAlphaLimited):
+        numAlphaLimited += 1
+    # Sum of the geometric series alphaSize ** 1 + ... + alphaSize ** numAlphaLimited
+    if (alphaSize == 1):
+        alphaLimitedVocab = numAlphaLimited
+    else:
+        alphaLimitedVocab = (alphaSize ** (numAlphaLimited + 1) - alphaSize) // (alphaSize - 1)
+    # Sum of the arithmetic series (wordLen - numAlphaLimited) + ... + 1
+    numRemaining = wordLen - numAlphaLimited
+    return alphaLimitedVocab + numRemaining * (numRemaining + 1) // 2
 
 def calcLinComp(seq):
     '''
     Calculates the linguistic complexity (LC) of a sequence where LC is defined as the ratio of the number of substrings of any
     length in the given sequence to the maximum possible number of substrings obtainable from a sequence of the given sequence's length. 
     
-    seq: A DNA sequence (string)
+    seq: A DNA sequence (string or EncodedSeq)
     '''
-    trie = SuffixTrie()
-    trie.addSuffixes(seq)
-    uniqueSubWords = trie.getEdges()
+    uniqueSubWords = countDistinctSubstrings(seq)
     maxVocab = calcMaxVocab(4, len(seq))
-    return uniqueSubWords / maxVocab
\ No newline at end of file
+    return uniqueSubWords / maxVocab
+
+def calcLinCompProfile(seq, width, maxWordLen=12):
+    '''
+    Calculates the linguistic complexity of every window of a given width along a sequence. The counts of the distinct words of
+    length 1 to maxWordLen are updated incrementally as the window slides by one base. Once every word of length maxWordLen in
+    a window is unique all longer words are unique too, so only windows containing a repeat of at least maxWordLen bases
+    are recounted from scratch.
+
+    seq: A DNA sequence (string or EncodedSeq)
+    width: The window width (int)
+    maxWordLen: The longest word length that is tracked incrementally (int)
+    Returns: A list where index i is the LC of seq[i:i + width] (list)
+    '''
+    seq = getLetters(seq)
+    if (width < 1):
+        raise ValueError("width must be at least 1")
+    if (width > len(seq)):
+        return []
+    maxVocab = calcMaxVocab(4, width)
+    maxWordLen = min(maxWordLen, width)
+    # Number of substrings longer than maxWordLen in a window where all of them are unique
+    numLongWords = (width - maxWordLen) * (width - maxWordLen + 1) // 2
+    wordCounts = {}
+    distinctWords = [0] * (maxWordLen + 1)
+
+    def addWord(word):
+        count = wordCounts.get(word, 0)
+        if (count == 0):
+            distinctWords[len(word)] += 1
+        wordCounts[word] = count + 1
+
+    def removeWord(word):
+        count = wordCounts[word] - 1
+        if (count == 0):
+            distinctWords[len(word)] -= 1
+            del wordCounts[word]
+        else:
+            wordCounts[word] = count
+
+    # Fill the first window
+    for i in range(width):
+        for wordLen in range(1, min(maxWordLen, width - i) + 1):
+            addWord(seq[i:i + wordLen])
+    profile = []
+    for start in range(len(seq) - width + 1):
+        if (start > 0):
+            # Drop the words starting at the base leaving the window and add the words ending at the base entering it
+            end = start + width - 1
+            for wordLen in range(1, maxWordLen + 1):
+                removeWord(seq[start - 1:start - 1 + wordLen])
+                addWord(seq[end - wordLen + 1:end + 1])
+        if (distinctWords[maxWordLen] == width - maxWordLen + 1):
+            uniqueSubWords = sum(distinctWords) + numLongWords
+        else:
+            uniqueSubWords = countDistinctSubstrings(seq[start:start + width])
+        profile.append(uniqueSubWords / maxVocab)
+    return profile
+
+def findLowComplexityRegions(seq, width, threshold):
+    '''
+    Finds the regions of a sequence covered by a window whose linguistic complexity is below a threshold
+
+    seq: A DNA sequence (string or EncodedSeq)
+    width: The window width (int)
+    threshold: The minimum linguistic complexity of a window (float)
+    Returns: A list of merged (start, end) regions where end is exclusive (list)
+    '''
+    regions = []
+    for start, linComp in enumerate(calcLinCompProfile(seq, width)):
+        if (linComp >= threshold):
+            continue
+        # Extend the previous region if the windows overlap, otherwise start a new one
+        if (regions and regions[-1][1] >= start):
+            regions[-1] = (regions[-1][0], start + width)
+        else:
+            regions.append((start, start + width))
+    return regions
@@ -0,0 +1,208 @@
+import argparse
+import sys
+import candidatetable
+import fasta
+import filters
+import parallel
+import profiling as prof
+import ranking
+import scanner
+import structurerisk as sr
+import twobit
+
+outputColumns = ["record", "start", "end", "length", "seq", "meltTemp", "gcContent", "gcInClamp"]
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="Streams a FASTA file and writes every primer candidate that passes the filters")
+    parser.add_argument("fasta", help="FASTA file to design primers for, optionally gzipped, a 2-bit packed file from "
+                        "twobit.py, or - for standard input")
+    parser.add_argument("-o", "--output", default="-", help="TSV file to write the candidates to, or - for standard output")
+    parser.add_argument("--min-len", type=int, default=18, help="minimum primer length")
+    parser.add_argument("--max-len", type=int, default=25, help="maximum primer length")
+    parser.add_argument("--min-tm", type=float, default=52.0, help="minimum melting temperature")
+    parser.add_argument("--max-tm", type=float, default=65.0, help="maximum melting temperature")
+    parser.add_argument("--min-gc", type=float, default=40.0, help="minimum GC content in percent")
+    parser.add_argument("--max-gc", type=float, default=60.0, help="maximum GC content in percent")
+    parser.add_argument("--min-clamp", type=int, default=1, help="minimum number of G's and C's in the last five bases")
+    parser.add_argument("--max-clamp", type=int, default=3, help="maximum number of G's and C's in the last five bases")
+    parser.add_argument("--min-lin-comp", type=float, help="minimum linguistic complexity, unchecked by default")
+    parser.add_argument("--min-hairpin-gibbs", type=float,
+                        help="minimum hairpin Gibbs free energy in kcal/mol, unchecked by default")
+    parser.add_argument("--min-self-dimer-gibbs", type=float,
+                        help="minimum self-dimer Gibbs free energy in kcal/mol, unchecked by default")
+    parser.add_argument("--kmer-index", help="k-mer index of a background genome built by kmerindex.py")
+    parser.add_argument("--max-end-hits", type=int, default=1,
+                        help="maximum occurrences of a candidate's 3' end in the --kmer-index genome")
+    parser.add_argument("--max-structure-gibbs", type=float,
+                        help="drop candidates overlapping an inverted repeat of the template at or below this Gibbs free "
+                        "energy in kcal/mol, unchecked by default")
+    parser.add_argument("--top-k", type=int,
+                        help="only write the k candidates with the lowest composite penalty per region, ranked")
+    parser.add_argument("--region-size", type=int, help="bases per --top-k region, the whole record by default")
+    parser.add_argument("--optimal-tm", type=float, default=60.0, help="melting temperature preferred by --top-k")
+    parser.add_argument("--optimal-gc", type=float, default=50.0, help="GC content in percent preferred by --top-k")
+    parser.add_argument("--table", help="write the candidates to a columnar candidate table file instead of TSV")
+    parser.add_argument("--table-structure", action="store_true",
+                        help="also calculate the hairpin Gibbs free energy and linguistic complexity columns of --table")
+    parser.add_argument("--stats", action="store_true", help="print how many candidates each filter stage rejected")
+    parser.add_argument("--profile", help="JSON file to write stage timings and work counters to")
+    parser.add_argument("--trace", help="Chrome trace-event file to write stage timings to")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="number of bases scanned at a time")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes to scan chunks with")
+    return parser.parse_args(argv)
+
+def filterChunk(seq, numOwned, args, structureHotMask=None):
+    '''
+    Scans a chunk for windows that pass the filters, running the cheap filters before the expensive ones
+
+    seq: The bases of the chunk (str or bytes-like)
+    numOwned: The number of bases from the start of the chunk that windows belonging to the chunk start at (int)
+    args: The parsed command-line arguments (argparse.Namespace)
+    structureHotMask: Whether each base of the chunk is hot in its record's structure risk track, or None (np.ndarray)
+    Returns: The metrics of the windows that pass, the statistics of each filter stage and the profiling results, or None if
+    profiling is off (tuple)
+    '''
+    # Profile each chunk separately so that chunks scanned in worker processes report back too
+    profiler = prof.Profiler() if args.profile or args.trace else None
+    if (profiler is not None):
+        profiler.start()
+    try:
+        with prof.stage("scanWindows"):
+            scan = scanner.scanWindows(seq, args.min_len, args.max_len)
+            # Only keep the windows starting in the bases this chunk owns, the rest belong to the next chunk
+            scan = scanner.selectWindows(scan, scan.start < numOwned)
+        pipeline = filters.createPipeline(args.min_clamp, args.max_clamp, args.min_gc, args.max_gc, args.min_tm, args.max_tm,
+                                          args.min_lin_comp, args.min_hairpin_gibbs, args.min_self_dimer_gibbs,
+                                          args.kmer_index, args.max_end_hits, structureHotMask)
+        scan = pipeline.run(seq, scan)
+    finally:
+        if (profiler is not None):
+            profiler.stop()
+    return scan, pipeline.getStats(), None if profiler is None else profiler.getResults()
+
+def iterScans(chunks, args, stats=None, profiler=None):
+    '''
+    Scans each chunk for windows that pass the filters, across args.workers processes if there is more than one
+
+    chunks: The chunks of a FASTA file (generator of FastaChunk)
+    args: The parsed command-line arguments (argparse.Namespace)
+    stats: A list that the filter statistics of each chunk are appended to, or None (list)
+    profiler: The profiler that the profiling results of each chunk are merged into, or None (Profiler)
+    Returns: A generator of each chunk with candidates and the metrics of its candidates, in file order for any number of
+    workers (generator of tuple)
+    '''
+    riskTracks = None
+    if (args.max_structure_gibbs is not None):
+        # Inverted repeats can span chunk edges, so each record's risk track is built whole and each chunk gets its slice
+        riskTracks = sr.ChunkRiskTracks(args.max_structure_gibbs)
+        chunks = riskTracks.iterChunks(chunks)
+
+    def getChunkArgs(chunk):
+        return () if riskTracks is None else (riskTracks.getHotMask(chunk),)
+
+    chunks = (chunk for chunk in chunks if len(chunk.seq) >= args.min_len)
+    if (args.workers > 1):
+        results = parallel.mapChunks(filterChunk, chunks, args, args.workers, getChunkArgs=getChunkArgs)
+    else:
+        results = ((chunk, filterChunk(chunk.seq, chunk.numOwned, args, *getChunkArgs(chunk))) for chunk in chunks)
+    for chunk, (scan, chunkStats, chunkProfile) in results:
+        if (stats is not None):
+            stats.append(chunkStats)
+        if (profiler is not None and chunkProfile is not None):
+            profiler.merge(chunkProfile)
+        yield chunk, scan
+
+def iterCandidates(chunks, args, stats=None, profiler=None):
+    '''
+    Scans each chunk for windows that pass the filters, see iterScans
+
+    chunks: The chunks of a FASTA file (generator of FastaChunk)
+    args: The parsed command-line arguments (argparse.Namespace)
+    stats: A list that the filter statistics of each chunk are appended to, or None (list)
+    profiler: The profiler that the profiling results of each chunk are merged into, or None (Profiler)
+    Returns: A generator of output rows, one per candidate, in the same order for any number of workers (generator of tuple)
+    '''
+    for chunk, scan in iterScans(chunks, args, stats, profiler):
+        for i in range(len(scan)):
+            start = int(scan.start[i])
+            end = int(scan.end[i])
+            yield (chunk.name, chunk.start + start, chunk.start + end, int(scan.length[i]), chunk.seq[start:end + 1],
+                   float(scan.meltTemp[i]), float(scan.gcContent[i]), int(scan.gcInClamp[i]))
+
+def writeCandidates(rows, handle, columns=outputColumns):
+    '''
+    Writes candidates as tab-separated lines as they are produced
+
+    rows: The output rows (generator of tuple)
+    handle: A text file object to write to
+    columns: The names of the columns of the rows (list of str)
+    Returns: The number of candidates written (int)
+    '''
+    handle.write("\t".join(columns) + "\n")
+    numRows = 0
+    for row in rows:
+        handle.write("\t".join(f"{value:.2f}" if isinstance(value, float) else str(value) for value in row) + "\n")
+        numRows += 1
+    return numRows
+
+def writeRankedCandidates(ranker, handle):
+    '''
+    Writes the kept candidates of each region as tab-separated lines, best first, with their composite penalty
+
+    ranker: The ranker holding the best candidates of each region (TopKRanker)
+    handle: A text file object to write to
+    Returns: The number of candidates written (int)
+    '''
+    rows = ((region[1],) + row + (penalty,) for region in ranker.getRegions() for row, penalty in ranker.getTop(region))
+    handle.write("region\t")
+    return writeCandidates(rows, handle, outputColumns + ["penalty"])
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if (args.min_len > args.max_len):
+        sys.exit("--min-len must not be greater than --max-len")
+    if (args.workers < 1):
+        sys.exit("--workers must be at least 1")
+    if (args.top_k is not None and args.top_k < 1):
+        sys.exit("--top-k must be at least 1")
+    if (args.region_size is not None and args.region_size < 1):
+        sys.exit("--region-size must be at least 1")
+    if (args.top_k is not None and args.table is not None):
+        sys.exit("--top-k cannot be used with --table")
+    isTwoBit = twobit.isTwoBitFile(args.fasta)
+    inHandle = None if isTwoBit else fasta.openFasta(args.fasta)
+    outHandle = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        # Chunks share max_len - 1 bases so that no window is cut at a chunk edge
+        if (isTwoBit):
+            chunks = twobit.iterTwoBitChunks(args.fasta, args.chunk_size, args.max_len - 1)
+        else:
+            chunks = fasta.iterFastaChunks(inHandle, args.chunk_size, args.max_len - 1)
+        stats = []
+        profiler = prof.Profiler()
+        if (args.table is not None):
+            with candidatetable.CandidateTableWriter(args.table, args.table_structure) as writer:
+                for chunk, scan in iterScans(writer.iterTemplateChunks(chunks), args, stats, profiler):
+                    writer.addScan(chunk, scan)
+            numRows = writer.numRows
+        elif (args.top_k is not None):
+            weights = ranking.ScoreWeights(optimalTm=args.optimal_tm, optimalGC=args.optimal_gc)
+            candidates = iterCandidates(chunks, args, stats, profiler)
+            numRows = writeRankedCandidates(ranking.rankCandidates(candidates, args.top_k, weights, args.region_size), outHandle)
+        else:
+            numRows = writeCandidates(iterCandidates(chunks, args, stats, profiler), outHandle)
+    finally:
+        if (inHandle is not None and inHandle is not sys.stdin):
+            inHandle.close()
+        if (outHandle is not sys.stdout):
+            outHandle.close()
+    print(f"Wrote {numRows} candidates", file=sys.stderr)
+    if (args.stats and stats):
+        print(filters.formatStats(filters.mergeStats(stats)), file=sys.stderr)
+    if (args.profile is not None):
+        profiler.writeJSON(args.profile)
+    if (args.trace is not None):
+        profiler.writeChromeTrace(args.trace)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import numpy as np
+import seqtools as st
+import nndata as nn
+import profiling as prof
+
+# Gas constant in cal/(K*mol)
+gasConstant = 1.9872
+# Default monovalent cation (Na+) and oligo concentrations in mol/L
+defaultNaConc = 0.05
+defaultOligoConc = 250e-9
+
+def calcNNThermo(seqs):
+    '''
+    Calculates the enthalpy and entropy of the duplex each sequence forms with its complement using the nearest neighbor (NN)
+    method in one vectorized pass. Includes the initiation terms for the identity of both terminal pairs and the symmetry
+    correction for self-complementary sequences.
+
+    seqs: A list of DNA sequences (list of str or EncodedSeq)
+    Returns: The length, the enthalpy in kcal/mol, the entropy in cal/(K*mol) and whether each sequence is self-complementary
+    (tuple of np.ndarray)
+    '''
+    lengths, codes = st.encodeBatch(seqs)
+    rows = np.arange(len(codes))
+    # An extra column of padding keeps the indexing below valid when every sequence is empty
+    codes = np.pad(codes.astype(np.int64), ((0, 0), (0, 1)), constant_values=st.padCode)
+    # Padding pairs index an extra entry of zero at the end of the flattened tables
+    isPair = (codes[:, :-1] != st.padCode) & (codes[:, 1:] != st.padCode)
+    pairs = np.where(isPair, 4 * codes[:, :-1] + codes[:, 1:], 16)
+    if (prof.activeProfiler is not None):
+        prof.count("nnLookups", 2 * int(isPair.sum()))
+    H = np.append(nn.duplexPairHTable.ravel(), 0)[pairs].sum(axis=1)
+    S = np.append(nn.duplexPairSTable.ravel(), 0)[pairs].sum(axis=1)
+    # Initiation terms for both terminal pairs
+    for ends in (codes[:, 0], codes[rows, np.maximum(lengths - 1, 0)]):
+        isGC = (ends == st.baseToCode["G"]) | (ends == st.baseToCode["C"])
+        H += np.where(isGC, nn.duplexTermgcAmtH, nn.duplexTermatAmtH)
+        S += np.where(isGC, nn.duplexTermgcAmtS, nn.duplexTermatAmtS)
+    # A sequence is self-complementary if it equals its reverse complement
+    revIndexes = lengths[:, None] - 1 - np.arange(codes.shape[1])
+    revCompCodes = np.where(revIndexes >= 0, 3 - codes[rows[:, None], np.maximum(revIndexes, 0)], st.padCode)
+    isSymmetric = (codes == revCompCodes).all(axis=1)
+    H += np.where(isSymmetric, nn.symAmtH, 0)
+    S += np.where(isSymmetric, nn.symAmtS, 0)
+    return lengths, H, S, isSymmetric
+
+def calcNNMeltTemps(seqs, naConc=defaultNaConc, oligoConc=defaultOligoConc):
+    '''
+    Calculates the SantaLucia (1998) nearest neighbor melting temperature of many sequences in one vectorized call. The entropy
+    is corrected for salt with 0.368 * (N - 1) * ln([Na+]). Non self-complementary sequences use a quarter of the total
+    oligo concentration, as for two strands at equal concentration.
+
+    seqs: A list of DNA sequences (list of str or EncodedSeq)
+    naConc: The concentration of monovalent cations in mol/L (float)
+    oligoConc: The total oligo concentration in mol/L (float)
+    Returns: The melting temperature in degrees Celsius of each sequence, NaN for sequences shorter than 2 bases (np.ndarray)
+    '''
+    lengths, H, S, isSymmetric = calcNNThermo(seqs)
+    S = S + 0.368 * (lengths - 1) * np.log(naConc)
+    effectiveConc = np.where(isSymmetric, oligoConc, oligoConc / 4)
+    meltTemp = 1000 * H / (S + gasConstant * np.log(effectiveConc)) - 273.15
+    return np.where(lengths >= 2, meltTemp, np.nan)
+
+def calcNNMeltTemp(seq, naConc=defaultNaConc, oligoConc=defaultOligoConc):
+    '''
+    Calculates the SantaLucia nearest neighbor melting temperature of one sequence, see calcNNMeltTemps
+
+    seq: A DNA sequence (str or EncodedSeq)
+    naConc: The concentration of monovalent cations in mol/L (float)
+    oligoConc: The total oligo concentration in mol/L (float)
+    Returns: The melting temperature in degrees Celsius (float)
+    '''
+    return float(calcNNMeltTemps([seq], naConc, oligoConc)[0])
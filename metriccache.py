@@ -0,0 +1,253 @@
+from collections import OrderedDict
+import pickle
+import sqlite3
+import time
+import hairpin as hp
+import linguisticcomplexity as lc
+import meltingtemp as mt
+import nndata as nn
+import primer as pr
+
+# Version used for metrics that do not depend on the parameters in nndata
+noParamVersion = ""
+
+# SQL expression of the approximate size of a row of the SQLite store, matching calcEntrySize
+diskEntrySize = "LENGTH(metric) + LENGTH(version) + LENGTH(seq) + LENGTH(value)"
+
+class MetricCache:
+    '''
+    Caches per-sequence metrics keyed by metric name, parameter-set version and canonical sequence. Entries live in an
+    in-process LRU and, if a path is given, in an SQLite store that survives between runs, each bounded by a byte budget.
+    The size of an entry is approximated by the length of its key strings plus its pickled value, so long sequences and
+    large values count for more than short ones. Entries calculated with other nndata parameters are never returned, since
+    the parameter-set version is part of the key.
+
+    maxBytes: The approximate number of bytes of entries kept in memory (int)
+    path: The path of the SQLite store, or None to only cache in memory (str)
+    maxDiskBytes: The approximate number of bytes of entries kept in the SQLite store, or None for no limit (int)
+    '''
+    def __init__(self, maxBytes=64 << 20, path=None, maxDiskBytes=None):
+        self.maxBytes = maxBytes
+        self.maxDiskBytes = maxDiskBytes
+        # Maps each key to its value and its size in bytes
+        self.entries = OrderedDict()
+        self.numBytes = 0
+        self.paramVersion = nn.calcParamVersion()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.diskEvictions = 0
+        self.pendingWrites = 0
+        self.db = None
+        if (path is not None):
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS metrics (metric TEXT, version TEXT, seq TEXT, value BLOB, "
+                            "lastUsed INTEGER, PRIMARY KEY (metric, version, seq))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS metricsLastUsed ON metrics (lastUsed)")
+            self.numDiskEntries, self.numDiskBytes = self.db.execute(f"SELECT COUNT(*), COALESCE(SUM({diskEntrySize}), 0) "
+                                                                     "FROM metrics").fetchone()
+
+    def refreshParamVersion(self):
+        '''
+        Recalculates the parameter-set version after nndata has been changed in this process, so that entries calculated with
+        the old parameters stop being returned
+        '''
+        self.paramVersion = nn.calcParamVersion()
+
+    def get(self, metric, seq, usesParams=True):
+        '''
+        Looks up a metric of a sequence, first in memory and then on disk
+
+        metric: The name of the metric (str)
+        seq: A DNA sequence (str or EncodedSeq)
+        usesParams: Whether the metric depends on the parameters in nndata (bool)
+        Returns: Whether the metric was found and its value (tuple)
+        '''
+        key = (metric, self.paramVersion if usesParams else noParamVersion, getCanonicalSeq(seq))
+        if (key in self.entries):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, self.entries[key][0]
+        if (self.db is not None):
+            row = self.db.execute("SELECT value FROM metrics WHERE metric = ? AND version = ? AND seq = ?", key).fetchone()
+            if (row is not None):
+                self.db.execute("UPDATE metrics SET lastUsed = ? WHERE metric = ? AND version = ? AND seq = ?",
+                                (time.time_ns(),) + key)
+                self.diskHits += 1
+                value = pickle.loads(row[0])
+                self.addEntry(key, value, calcEntrySize(key, row[0]))
+                return True, value
+        self.misses += 1
+        return False, None
+
+    def put(self, metric, seq, value, usesParams=True):
+        '''
+        Stores a metric of a sequence in memory and, if there is an SQLite store, on disk
+
+        metric: The name of the metric (str)
+        seq: A DNA sequence (str or EncodedSeq)
+        value: The value of the metric, which must be picklable
+        usesParams: Whether the metric depends on the parameters in nndata (bool)
+        '''
+        key = (metric, self.paramVersion if usesParams else noParamVersion, getCanonicalSeq(seq))
+        data = pickle.dumps(value)
+        size = calcEntrySize(key, data)
+        self.addEntry(key, value, size)
+        if (self.db is not None):
+            row = (data, time.time_ns())
+            oldRow = self.db.execute(f"SELECT {diskEntrySize} FROM metrics WHERE metric = ? AND version = ? AND seq = ?",
+                                     key).fetchone()
+            if (oldRow is None):
+                self.db.execute("INSERT INTO metrics VALUES (?, ?, ?, ?, ?)", key + row)
+                self.numDiskEntries += 1
+                self.numDiskBytes += size
+            else:
+                self.db.execute("UPDATE metrics SET value = ?, lastUsed = ? WHERE metric = ? AND version = ? AND seq = ?", row + key)
+                self.numDiskBytes += size - oldRow[0]
+            self.pendingWrites += 1
+            if (self.maxDiskBytes is not None and self.numDiskBytes > self.maxDiskBytes):
+                self.evictDiskEntries()
+            if (self.pendingWrites >= 1000):
+                self.flush()
+
+    def getOrCompute(self, metric, seq, func, usesParams=True):
+        '''
+        Looks up a metric of a sequence, calculating it from the canonical sequence and storing it on a miss
+
+        metric: The name of the metric (str)
+        seq: A DNA sequence (str or EncodedSeq)
+        func: The function calculating the metric from the sequence (function)
+        usesParams: Whether the metric depends on the parameters in nndata (bool)
+        Returns: The value of the metric
+        '''
+        seq = getCanonicalSeq(seq)
+        found, value = self.get(metric, seq, usesParams)
+        if (not found):
+            value = func(seq)
+            self.put(metric, seq, value, usesParams)
+        return value
+
+    def addEntry(self, key, value, size):
+        # Evict the least recently used entries once the cache is over its byte budget
+        if (key in self.entries):
+            self.numBytes -= self.entries[key][1]
+        self.entries[key] = (value, size)
+        self.entries.move_to_end(key)
+        self.numBytes += size
+        while (self.numBytes > self.maxBytes and self.entries):
+            self.numBytes -= self.entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def evictDiskEntries(self):
+        # Delete the least recently used rows until the store is back within maxDiskBytes
+        numExtraBytes = self.numDiskBytes - self.maxDiskBytes
+        rowIds = []
+        for rowId, size in self.db.execute(f"SELECT rowid, {diskEntrySize} FROM metrics ORDER BY lastUsed"):
+            if (numExtraBytes <= 0):
+                break
+            rowIds.append((rowId,))
+            numExtraBytes -= size
+            self.numDiskBytes -= size
+        self.db.executemany("DELETE FROM metrics WHERE rowid = ?", rowIds)
+        self.diskEvictions += len(rowIds)
+        self.numDiskEntries -= len(rowIds)
+
+    def purgeStale(self):
+        '''
+        Deletes the entries on disk that were calculated with other nndata parameters
+
+        Returns: The number of entries deleted (int)
+        '''
+        if (self.db is None):
+            return 0
+        staleBytes = self.db.execute(f"SELECT COALESCE(SUM({diskEntrySize}), 0) FROM metrics WHERE version != ? AND version != ?",
+                                     (self.paramVersion, noParamVersion)).fetchone()[0]
+        cursor = self.db.execute("DELETE FROM metrics WHERE version != ? AND version != ?", (self.paramVersion, noParamVersion))
+        self.numDiskEntries -= cursor.rowcount
+        self.numDiskBytes -= staleBytes
+        self.flush()
+        return cursor.rowcount
+
+    def getStats(self):
+        '''
+        Returns: The hit, miss and eviction counts and the number and approximate bytes of entries in memory and on disk (dict)
+        '''
+        return {
+            "hits": self.hits,
+            "diskHits": self.diskHits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "diskEvictions": self.diskEvictions,
+            "entries": len(self.entries),
+            "bytes": self.numBytes,
+            "diskEntries": self.numDiskEntries if self.db is not None else 0,
+            "diskBytes": self.numDiskBytes if self.db is not None else 0,
+        }
+
+    def flush(self):
+        if (self.db is not None):
+            self.db.commit()
+            self.pendingWrites = 0
+
+    def close(self):
+        if (self.db is not None):
+            self.flush()
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+def calcEntrySize(key, data):
+    '''
+    Helper function for MetricCache. Approximates the number of bytes an entry takes.
+
+    key: The metric name, parameter-set version and canonical sequence (tuple of str)
+    data: The pickled value (bytes)
+    Returns: The length of the key strings plus the length of the pickled value (int)
+    '''
+    return sum(len(part) for part in key) + len(data)
+
+def getCanonicalSeq(seq):
+    '''
+    Helper function for MetricCache. Converts a sequence to the uppercase string used in cache keys.
+
+    seq: A DNA sequence (str or EncodedSeq)
+    Returns: The canonical sequence (str)
+    '''
+    return str(seq).upper()
+
+# Cache used by the functions below unless another cache is given
+defaultCache = MetricCache()
+
+def getMeltTemp(seq, cache=None):
+    return (cache or defaultCache).getOrCompute("meltTemp", seq, pr.Primer.calcMeltTemp, usesParams=False)
+
+def getGCContent(seq, cache=None):
+    return (cache or defaultCache).getOrCompute("gcContent", seq, pr.Primer.calcGCContent, usesParams=False)
+
+def getGCInClamp(seq, cache=None):
+    return (cache or defaultCache).getOrCompute("gcInClamp", seq, pr.Primer.calcGCInClamp, usesParams=False)
+
+def getLinComp(seq, cache=None):
+    return (cache or defaultCache).getOrCompute("linComp", seq, lc.calcLinComp, usesParams=False)
+
+def getNNMeltTemp(seq, cache=None):
+    return (cache or defaultCache).getOrCompute("nnMeltTemp", seq, mt.calcNNMeltTemp)
+
+def getHairpinGibbs(seq, cache=None):
+    '''
+    Gets the lowest Gibbs free energy of the hairpins from createPossHairpins, or None if the sequence is too short for one
+
+    seq: A DNA sequence (str or EncodedSeq)
+    cache: The cache to use instead of defaultCache (MetricCache)
+    Returns: The Gibbs free energy in kcal/mol (float)
+    '''
+    def calcHairpinGibbs(seq):
+        hairpin = hp.bestHairpin(seq)
+        return None if hairpin is None else hairpin.totalGibbs
+    return (cache or defaultCache).getOrCompute("hairpinGibbs", seq, calcHairpinGibbs)
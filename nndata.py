@@ -1,4 +1,7 @@
 #Nearest neighbor data
+import hashlib
+import numpy as np
+from seqtools import codeToBase, getCompBase
 
 # Dictionary describing the contribution of each possible nearest-neighbor pair in a loop towards the Gibbs free energy in kcal/mol
 loopPairToG = {"AA": 1.4, "TA": 1.2, "GA": 0.1, "CA": 0.4, "AT": 1.5, "TT": 1.0, "GT": 0.9, "CT": 0.2, "AG": 2.4, "TG": 1.7, 
@@ -9,15 +12,77 @@ duplexPairToG = {"AA/TT": -1.00, "TA/AT": -0.58, "GA/CT": -1.30, "CA/GT": -1.45,
                         "CT/GA": -1.28, "AG/TC": -1.28, "TG/AC": -1.45, "GG/CC": -1.84, "CG/GC": -2.17, "AC/TG": -1.44,  "TC/AG": -1.30,
                         "GC/CG": -2.24,  "CC/GG": -1.84}
 
+# Dictionaries describing the enthalpy (kcal/mol) and entropy (cal/(K*mol)) of each possible nearest-neighbor pair in a duplex
+duplexPairToH = {"AA/TT": -7.9, "TA/AT": -7.2, "GA/CT": -8.2, "CA/GT": -8.5, "AT/TA": -7.2, "TT/AA": -7.9, "GT/CA": -8.4,
+                        "CT/GA": -7.8, "AG/TC": -7.8, "TG/AC": -8.5, "GG/CC": -8.0, "CG/GC": -10.6, "AC/TG": -8.4, "TC/AG": -8.2,
+                        "GC/CG": -9.8, "CC/GG": -8.0}
+duplexPairToS = {"AA/TT": -22.2, "TA/AT": -21.3, "GA/CT": -22.2, "CA/GT": -22.7, "AT/TA": -20.4, "TT/AA": -22.2, "GT/CA": -22.4,
+                        "CT/GA": -21.0, "AG/TC": -21.0, "TG/AC": -22.7, "GG/CC": -19.9, "CG/GC": -27.2, "AC/TG": -22.4, "TC/AG": -22.2,
+                        "GC/CG": -24.4, "CC/GG": -19.9}
+
 
 # End correction for a hairpin stem for Gibbs free energy in kcal/mol
 stemTermgcAmtG = -2.182
 stemTermatAmtG = -1.653
 
+# Dictionary describing the initiation Gibbs free energy in kcal/mol of a hairpin loop by its number of bases (SantaLucia and
+# Hicks 2004). Lengths in between are interpolated, and longer loops add hairpinLoopExtrapolationG * ln(n / 30).
+hairpinLoopToG = {3: 3.5, 4: 3.5, 5: 3.3, 6: 4.0, 7: 4.2, 8: 4.3, 9: 4.5, 10: 4.6, 12: 5.0, 14: 5.1, 16: 5.3, 18: 5.5, 20: 5.7,
+                  25: 6.1, 30: 6.3}
+hairpinLoopExtrapolationG = 2.44 * 1.9872e-3 * 310.15
+
 #Initiation paramters for duplex for Gibbs free energy in kcal/mol
 duplexTermgcAmtG = 0.98
 duplexTermatAmtG = 1.03
 symAmtG = 0.43
 
+#Initiation paramters for duplex for enthalpy in kcal/mol and entropy in cal/(K*mol)
+duplexTermgcAmtH = 0.1
+duplexTermatAmtH = 2.3
+symAmtH = 0.0
+duplexTermgcAmtS = -2.8
+duplexTermatAmtS = 4.1
+symAmtS = -1.4
+
 # Mismatch penalty for Gibbs free energy in kcal/mol
-mismatchPenalty = 0.438
\ No newline at end of file
+mismatchPenalty = 0.438
+
+def compilePairTable(pairToValue):
+    '''
+    Compiles a nearest-neighbor dictionary into an array indexed by the 2-bit codes of the pair of bases
+
+    pairToValue: A dictionary keyed by pairs like "AC" or, for duplexes, by the top strand and its complement like "AC/TG" (dict)
+    Returns: A 4x4 array where [code1, code2] is the value of the pair (np.ndarray)
+    '''
+    table = np.zeros((4, 4))
+    for code1, base1 in enumerate(codeToBase):
+        for code2, base2 in enumerate(codeToBase):
+            key = base1 + base2
+            if (key not in pairToValue):
+                key += "/" + getCompBase(base1) + getCompBase(base2)
+            table[code1, code2] = pairToValue[key]
+    return table
+
+# Compiled nearest-neighbor tables indexed by [code1, code2] of the pair of bases (of the top strand for duplexes)
+loopPairGTable = compilePairTable(loopPairToG)
+duplexPairGTable = compilePairTable(duplexPairToG)
+duplexPairHTable = compilePairTable(duplexPairToH)
+duplexPairSTable = compilePairTable(duplexPairToS)
+
+def calcParamVersion():
+    '''
+    Calculates a fingerprint of every parameter in this module, so that results calculated with different parameters can be
+    told apart
+
+    Returns: A hex digest that changes whenever any parameter changes (str)
+    '''
+    digest = hashlib.sha256()
+    for name, value in sorted(globals().items()):
+        if (name.startswith("_") or not isinstance(value, (dict, float, int, np.ndarray))):
+            continue
+        if (isinstance(value, np.ndarray)):
+            value = value.tolist()
+        elif (isinstance(value, dict)):
+            value = sorted(value.items())
+        digest.update(f"{name}={value!r};".encode())
+    return digest.hexdigest()[:16]
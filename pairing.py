@@ -0,0 +1,149 @@
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+import heapq
+import numpy as np
+
+@dataclass
+class PrimerPairs:
+    '''
+    Describes pairs of forward and reverse primer candidates. All fields are NumPy arrays of equal length where index i
+    describes one pair.
+
+    forward: An integer array of the index of the forward candidate of each pair
+    reverse: An integer array of the index of the reverse candidate of each pair
+    productSize: An integer array of the size of the product of each pair
+    tmDiff: A float array of the absolute difference between the melting temperatures of each pair
+    '''
+    forward: np.ndarray
+    reverse: np.ndarray
+    productSize: np.ndarray
+    tmDiff: np.ndarray
+
+    def __len__(self):
+        return len(self.forward)
+
+def getCandidateArrays(candidates):
+    '''
+    Helper function for the pairing functions. Gets the start, end and melting temperature of every candidate.
+
+    candidates: The candidates, either a scan or a list of objects with start, end and meltTemp (WindowScan or list of Primer)
+    Returns: The start, end and melting temperature arrays (tuple of np.ndarray)
+    '''
+    if (isinstance(getattr(candidates, "start", None), np.ndarray)):
+        return candidates.start, candidates.end, candidates.meltTemp
+    start = np.array([candidate.start for candidate in candidates], dtype=np.int64)
+    end = np.array([candidate.end for candidate in candidates], dtype=np.int64)
+    meltTemp = np.array([candidate.meltTemp for candidate in candidates], dtype=np.float64)
+    return start, end, meltTemp
+
+def iterPairs(forward, reverse, minProduct, maxProduct, maxTmDiff):
+    '''
+    Finds every pair of a forward and a reverse candidate whose product size is between minProduct and maxProduct and whose
+    melting temperatures differ by at most maxTmDiff. The product of a pair spans from the start of the forward candidate to
+    the end of the reverse candidate, where both are given by their location on the template's forward strand.
+
+    Sweeps the forward candidates in order of start while the reverse candidates whose end is inside the product size range
+    are kept sorted by melting temperature. Each query is a binary search in O(log w), where w is the number of reverse
+    candidates in range at once, but adding or removing a candidate shifts the sorted list in O(w), so the total time is
+    O((F + R) * w + number of pairs). The window is a product size range wide, so w stays small next to R.
+
+    forward: The forward candidates (WindowScan or list of Primer)
+    reverse: The reverse candidates (WindowScan or list of Primer)
+    minProduct: The minimum product size (int)
+    maxProduct: The maximum product size (int)
+    maxTmDiff: The maximum absolute difference between the melting temperatures (float)
+    Returns: A generator of (forward index, reverse index) tuples, grouped by forward candidate in order of start (generator)
+    '''
+    fStart, fEnd, fTm = getCandidateArrays(forward)
+    rStart, rEnd, rTm = getCandidateArrays(reverse)
+    fOrder = np.argsort(fStart, kind="stable").tolist()
+    rOrder = np.argsort(rEnd, kind="stable").tolist()
+    fStart = fStart.tolist()
+    fTm = fTm.tolist()
+    rEnd = rEnd.tolist()
+    rTm = rTm.tolist()
+    # Reverse candidates whose end is in range of the current forward candidate, as sorted (meltTemp, index) tuples
+    active = []
+    numAdded = 0
+    numRemoved = 0
+    for f in fOrder:
+        # The product size is rEnd - fStart + 1, so the range of ends moves right as the forward start does
+        lowEnd = fStart[f] + minProduct - 1
+        highEnd = fStart[f] + maxProduct - 1
+        while (numAdded < len(rOrder) and rEnd[rOrder[numAdded]] <= highEnd):
+            r = rOrder[numAdded]
+            insort(active, (rTm[r], r))
+            numAdded += 1
+        while (numRemoved < numAdded and rEnd[rOrder[numRemoved]] < lowEnd):
+            r = rOrder[numRemoved]
+            del active[bisect_left(active, (rTm[r], r))]
+            numRemoved += 1
+        low = bisect_left(active, (fTm[f] - maxTmDiff, -1))
+        high = bisect_right(active, (fTm[f] + maxTmDiff, len(rOrder)))
+        for i in range(low, high):
+            yield f, active[i][1]
+
+def findPairs(forward, reverse, minProduct, maxProduct, maxTmDiff):
+    '''
+    Finds every pair of candidates as in iterPairs
+
+    forward: The forward candidates (WindowScan or list of Primer)
+    reverse: The reverse candidates (WindowScan or list of Primer)
+    minProduct: The minimum product size (int)
+    maxProduct: The maximum product size (int)
+    maxTmDiff: The maximum absolute difference between the melting temperatures (float)
+    Returns: The pairs (PrimerPairs)
+    '''
+    pairs = np.array(list(iterPairs(forward, reverse, minProduct, maxProduct, maxTmDiff)), dtype=np.int64).reshape(-1, 2)
+    return createPrimerPairs(forward, reverse, pairs[:, 0], pairs[:, 1])
+
+def findTopPairs(forward, reverse, minProduct, maxProduct, maxTmDiff, k, optimalProduct=None, productWeight=0.0):
+    '''
+    Finds the k best pairs of candidates as in iterPairs while only keeping k pairs in memory. A pair's penalty is its
+    melting temperature difference plus productWeight times the distance of its product size from optimalProduct.
+
+    forward: The forward candidates (WindowScan or list of Primer)
+    reverse: The reverse candidates (WindowScan or list of Primer)
+    minProduct: The minimum product size (int)
+    maxProduct: The maximum product size (int)
+    maxTmDiff: The maximum absolute difference between the melting temperatures (float)
+    k: The number of pairs to keep (int)
+    optimalProduct: The preferred product size, or None to only rank by melting temperature difference (int)
+    productWeight: The penalty per base of distance from optimalProduct (float)
+    Returns: The k pairs with the lowest penalty, from lowest to highest (PrimerPairs)
+    '''
+    if (k < 1):
+        raise ValueError("k must be at least 1")
+    fStart, fEnd, fTm = (values.tolist() for values in getCandidateArrays(forward))
+    rStart, rEnd, rTm = (values.tolist() for values in getCandidateArrays(reverse))
+    # Max-heap of (-penalty, -order, forward index, reverse index) so that the worst kept pair is popped first
+    heap = []
+    for order, (f, r) in enumerate(iterPairs(forward, reverse, minProduct, maxProduct, maxTmDiff)):
+        penalty = abs(fTm[f] - rTm[r])
+        if (optimalProduct is not None):
+            penalty += productWeight * abs(rEnd[r] - fStart[f] + 1 - optimalProduct)
+        item = (-penalty, -order, f, r)
+        if (len(heap) < k):
+            heapq.heappush(heap, item)
+        elif (item > heap[0]):
+            heapq.heapreplace(heap, item)
+    best = sorted(heap, reverse=True)
+    forwardIndex = np.array([item[2] for item in best], dtype=np.int64)
+    reverseIndex = np.array([item[3] for item in best], dtype=np.int64)
+    return createPrimerPairs(forward, reverse, forwardIndex, reverseIndex)
+
+def createPrimerPairs(forward, reverse, forwardIndex, reverseIndex):
+    '''
+    Helper function for findPairs and findTopPairs. Describes pairs given by the indices of their candidates.
+
+    forward: The forward candidates (WindowScan or list of Primer)
+    reverse: The reverse candidates (WindowScan or list of Primer)
+    forwardIndex: An integer array of the index of the forward candidate of each pair
+    reverseIndex: An integer array of the index of the reverse candidate of each pair
+    Returns: The pairs (PrimerPairs)
+    '''
+    fStart, fEnd, fTm = getCandidateArrays(forward)
+    rStart, rEnd, rTm = getCandidateArrays(reverse)
+    productSize = np.asarray(rEnd)[reverseIndex] - np.asarray(fStart)[forwardIndex] + 1
+    tmDiff = np.abs(np.asarray(fTm, dtype=np.float64)[forwardIndex] - np.asarray(rTm, dtype=np.float64)[reverseIndex])
+    return PrimerPairs(forwardIndex, reverseIndex, productSize, tmDiff)
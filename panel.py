@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+import math
+import random
+import numpy as np
+import dimer as dm
+
+@dataclass
+class PanelResult:
+    '''
+    Describes a multiplex panel chosen by optimizePanel
+
+    choices: A list of the index of the candidate pair chosen for each target, counted within the target's candidates
+    score: A float representing the total dimer penalty of the panel in kcal/mol, lower is better
+    greedyScore: A float representing the total dimer penalty of the panel built greedily before annealing
+    numAccepted: An integer representing the number of swaps accepted while annealing
+    '''
+    choices: list
+    score: float
+    greedyScore: float
+    numAccepted: int
+
+def calcPairPenalties(targets, threshold=-6.0, workers=None):
+    '''
+    Builds the penalty table of every pair of candidate primer pairs. Two candidate pairs interact through the worst dimer of
+    any of their four primers with each other, and only dimers with a Gibbs free energy below threshold are penalized, by how
+    far they are below it. A candidate pair's own primers give its self penalty.
+
+    targets: The candidate primer pairs of each target as (forward, reverse) tuples (list of list of tuple)
+    threshold: The Gibbs free energy in kcal/mol below which a dimer is a problem (float)
+    workers: The number of processes to build the dimer matrix with, or None to run in this process (int)
+    Returns: The penalty of each pair of candidates, indexed by the candidates of all targets in order (np.ndarray)
+    '''
+    seqs = [primer for candidates in targets for pair in candidates for primer in pair]
+    gibbs = dm.calcDimerMatrix(seqs, workers).gibbs
+    # A dimer can be scored with either primer as seq1, so use the worse of the two
+    gibbs = np.minimum(gibbs, gibbs.T)
+    numPairs = len(seqs) // 2
+    pairGibbs = gibbs.reshape(numPairs, 2, numPairs, 2).min(axis=(1, 3))
+    return np.maximum(threshold - pairGibbs, 0.0)
+
+def getTargetOffsets(targets):
+    '''
+    Helper function for optimizePanel. Finds where the candidates of each target start in the penalty table.
+
+    targets: The candidates of each target (list of list)
+    Returns: The index of the first candidate of each target, with one extra entry for the end (list of int)
+    '''
+    offsets = [0]
+    for candidates in targets:
+        offsets.append(offsets[-1] + len(candidates))
+    return offsets
+
+def calcPanelScore(penalties, panel):
+    '''
+    Calculates the total penalty of a panel from scratch: every chosen candidate's self penalty plus the penalty of every pair
+    of chosen candidates
+
+    penalties: The penalty table from calcPairPenalties (np.ndarray)
+    panel: The penalty table index of the candidate chosen for each target (np.ndarray)
+    Returns: The total penalty (float)
+    '''
+    block = penalties[np.ix_(panel, panel)]
+    return float(np.trace(block) + np.triu(block, 1).sum())
+
+def buildGreedyPanel(penalties, offsets, order):
+    '''
+    Helper function for optimizePanel. Adds targets one at a time, choosing the candidate with the lowest penalty against the
+    candidates chosen so far.
+
+    penalties: The penalty table from calcPairPenalties (np.ndarray)
+    offsets: The index of the first candidate of each target (list of int)
+    order: The order to add the targets in (list of int)
+    Returns: The penalty table index of the candidate chosen for each target (np.ndarray)
+    '''
+    panel = np.zeros(len(offsets) - 1, dtype=np.int64)
+    chosen = []
+    for target in order:
+        candidates = np.arange(offsets[target], offsets[target + 1])
+        costs = penalties[candidates, candidates] + penalties[np.ix_(candidates, chosen)].sum(axis=1)
+        panel[target] = candidates[np.argmin(costs)]
+        chosen.append(panel[target])
+    return panel
+
+def optimizePanel(penalties, targets, numIterations=200000, startTemp=1.0, endTemp=0.01, seed=0):
+    '''
+    Chooses one candidate pair per target so that the panel has as little dimer penalty as possible. Builds a panel greedily,
+    adding the targets with the fewest candidates first, then improves it with simulated annealing. Each step swaps the
+    candidate of one random target, and the change in score only depends on the swapped candidates' penalties against the
+    rest of the panel, so it costs O(panel size) instead of rescoring every pair.
+
+    penalties: The penalty table from calcPairPenalties (np.ndarray)
+    targets: The candidates of each target, in the order used for the penalty table (list of list)
+    numIterations: The number of swaps to try (int)
+    startTemp: The temperature at the first swap, in kcal/mol (float)
+    endTemp: The temperature at the last swap, in kcal/mol (float)
+    seed: The seed for the random number generator (int)
+    Returns: The best panel found (PanelResult)
+    '''
+    if (any(len(candidates) == 0 for candidates in targets)):
+        raise ValueError("Every target needs at least one candidate pair")
+    rng = random.Random(seed)
+    offsets = getTargetOffsets(targets)
+    order = sorted(range(len(targets)), key=lambda target: len(targets[target]))
+    panel = buildGreedyPanel(penalties, offsets, order)
+    score = calcPanelScore(penalties, panel)
+    greedyScore = score
+    bestPanel = panel.copy()
+    bestScore = score
+    numAccepted = 0
+    # Only targets with a choice to make can be swapped
+    swappable = [target for target in range(len(targets)) if len(targets[target]) > 1]
+    if (swappable and numIterations > 0):
+        cooling = (endTemp / startTemp) ** (1 / max(numIterations - 1, 1))
+        temp = startTemp
+        for _ in range(numIterations):
+            target = rng.choice(swappable)
+            old = panel[target]
+            new = offsets[target] + rng.randrange(offsets[target + 1] - offsets[target] - 1)
+            if (new >= old):
+                new += 1
+            # Penalties of the old and new candidate against every chosen candidate, where the entry for the swapped target
+            # itself is replaced by the self penalty
+            oldRow = penalties[old, panel]
+            newRow = penalties[new, panel]
+            delta = float(newRow.sum() - newRow[target] + penalties[new, new] - oldRow.sum())
+            if (delta <= 0 or rng.random() < math.exp(-delta / temp)):
+                panel[target] = new
+                score += delta
+                numAccepted += 1
+                if (score < bestScore - 1e-12):
+                    bestScore = score
+                    bestPanel = panel.copy()
+            temp *= cooling
+    choices = [int(bestPanel[target]) - offsets[target] for target in range(len(targets))]
+    return PanelResult(choices, calcPanelScore(penalties, bestPanel), greedyScore, numAccepted)
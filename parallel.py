@@ -0,0 +1,71 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+def runOnSharedChunk(func, shmName, length, numOwned, args, chunkArgs=()):
+    '''
+    Helper function for mapChunks, run in a worker process. Attaches to the shared memory holding a chunk's bases and calls
+    func on them without copying.
+
+    func: The function to call as func(seq, numOwned, args, *chunkArgs) where seq is a memoryview of ASCII bases (function)
+    shmName: The name of the shared memory block (str)
+    length: The number of bases in the chunk (int)
+    numOwned: The number of bases the chunk owns (int)
+    args: Extra arguments passed to func
+    chunkArgs: Extra arguments of this chunk passed to func after args (tuple)
+    Returns: The result of func
+    '''
+    shm = shared_memory.SharedMemory(name=shmName)
+    seq = shm.buf[:length]
+    try:
+        return func(seq, numOwned, args, *chunkArgs)
+    finally:
+        seq.release()
+        shm.close()
+
+def mapChunks(func, chunks, args, workers, maxPending=None, getChunkArgs=None):
+    '''
+    Calls func on every chunk across a pool of worker processes. Each chunk's bases are passed through shared memory instead
+    of being pickled, and results come back in the order of the chunks, so the output is identical to a serial run.
+
+    func: A picklable function called as func(seq, numOwned, args, *getChunkArgs(chunk)) where seq is a memoryview of ASCII
+    bases (function)
+    chunks: The chunks to process (iterable of FastaChunk)
+    args: Extra arguments passed to func, which must be picklable
+    workers: The number of worker processes (int)
+    maxPending: The maximum number of chunks in flight, which bounds memory use. Defaults to twice the number of workers. (int)
+    getChunkArgs: A function returning a tuple of extra picklable arguments for a chunk, called as each chunk is submitted,
+    or None (function)
+    Returns: A generator of (chunk, result) tuples in the order of the chunks (generator)
+    '''
+    if (maxPending is None):
+        maxPending = 2 * workers
+    pending = deque()
+
+    def finishOldest():
+        chunk, shm, future = pending.popleft()
+        try:
+            return chunk, future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for chunk in chunks:
+                data = chunk.seq.encode("ascii")
+                shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+                shm.buf[:len(data)] = data
+                chunkArgs = () if getChunkArgs is None else getChunkArgs(chunk)
+                pending.append((chunk, shm, executor.submit(runOnSharedChunk, func, shm.name, len(data), chunk.numOwned, args,
+                                                            chunkArgs)))
+                if (len(pending) >= maxPending):
+                    yield finishOldest()
+            while (pending):
+                yield finishOldest()
+        finally:
+            # Release the shared memory of chunks left in flight if the caller stops early or a worker fails
+            for chunk, shm, future in pending:
+                future.cancel()
+                shm.close()
+                shm.unlink()
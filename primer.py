@@ -14,6 +14,7 @@ class Primer:
         self.gcContent = self.calcGCContent(seq)
         self.gcInClamp = self.calcGCInClamp(seq)
 
+    @staticmethod
     def calcMeltTemp(seq):
         # Count the number of different nucleotides
         numA = 0
@@ -36,6 +37,7 @@ class Primer:
             meltTemp = 64.9 + 41 * (numG + numC - 16.4) / (len(seq))
         return meltTemp
 
+    @staticmethod
     def calcGCContent(seq):
         numG = 0
         numC = 0
@@ -46,6 +48,7 @@ class Primer:
                 numC += 1
         return (numG + numC) / len(seq) * 100
 
+    @staticmethod
     def calcGCInClamp(seq):
         # Count the number of G's and C's in the last five nucleotides
         numGC = 0
@@ -0,0 +1,189 @@
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import wraps
+import json
+import os
+import threading
+import time
+
+# The profiler that counts and stage timers report to, or None when profiling is off. Hot paths check this before doing
+# any work, so profiling costs one global lookup per call when it is off.
+activeProfiler = None
+# Context manager returned by stage when profiling is off
+nullStage = nullcontext()
+
+class StageTimer:
+    '''
+    Helper class for Profiler. Times one run of a named stage as a context manager.
+
+    profiler: The profiler to report to (Profiler)
+    name: The name of the stage (str)
+    '''
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.startNs = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.profiler.addStage(self.name, self.startNs, time.perf_counter_ns() - self.startNs)
+
+class Profiler:
+    '''
+    Collects work counters and stage timings while it is active. Use it as a context manager, or call start and stop, or use
+    the module-level enable and disable as a global switch. Profilers nest: the previous profiler is active again after stop.
+
+    maxEvents: The maximum number of stage runs kept for the trace. Stage totals are always kept. (int)
+    '''
+    def __init__(self, maxEvents=100000):
+        self.maxEvents = maxEvents
+        self.counters = defaultdict(int)
+        self.stageCalls = defaultdict(int)
+        self.stageSeconds = defaultdict(float)
+        # Stage runs as (name, start in ns, duration in ns, process id, thread id) tuples
+        self.events = []
+        self.numDroppedEvents = 0
+        self.previous = None
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def addStage(self, name, startNs, durationNs, pid=None, tid=None):
+        self.stageCalls[name] += 1
+        self.stageSeconds[name] += durationNs / 1e9
+        if (len(self.events) < self.maxEvents):
+            self.events.append((name, startNs, durationNs, os.getpid() if pid is None else pid,
+                                threading.get_ident() if tid is None else tid))
+        else:
+            self.numDroppedEvents += 1
+
+    def start(self):
+        global activeProfiler
+        self.previous = activeProfiler
+        activeProfiler = self
+        return self
+
+    def stop(self):
+        global activeProfiler
+        activeProfiler = self.previous
+        self.previous = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
+
+    def getResults(self):
+        '''
+        Returns: The counters, the number of runs and seconds of each stage and the stage runs kept for the trace (dict)
+        '''
+        return {
+            "counters": dict(self.counters),
+            "stages": {name: {"calls": self.stageCalls[name], "seconds": self.stageSeconds[name]} for name in self.stageCalls},
+            "events": list(self.events),
+            "droppedEvents": self.numDroppedEvents,
+        }
+
+    def merge(self, results):
+        '''
+        Adds the results of another profiler, for example one that ran in a worker process
+
+        results: The results from Profiler.getResults (dict)
+        '''
+        for name, n in results["counters"].items():
+            self.counters[name] += n
+        for name, stage in results["stages"].items():
+            self.stageCalls[name] += stage["calls"]
+            self.stageSeconds[name] += stage["seconds"]
+        numKept = max(0, min(len(results["events"]), self.maxEvents - len(self.events)))
+        self.events.extend(tuple(event) for event in results["events"][:numKept])
+        self.numDroppedEvents += results["droppedEvents"] + len(results["events"]) - numKept
+
+    def writeJSON(self, path):
+        '''
+        Writes the counters and stage totals to a JSON file
+
+        path: The path of the JSON file (str)
+        '''
+        results = self.getResults()
+        del results["events"]
+        with open(path, "w") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+
+    def writeChromeTrace(self, path):
+        '''
+        Writes the stage runs and final counters as a Chrome trace-event file, which chrome://tracing and Perfetto can open
+
+        path: The path of the trace file (str)
+        '''
+        originNs = min((event[1] for event in self.events), default=0)
+        traceEvents = [{"name": name, "ph": "X", "ts": (startNs - originNs) / 1000, "dur": durationNs / 1000, "pid": pid,
+                        "tid": tid} for name, startNs, durationNs, pid, tid in self.events]
+        endUs = max((event["ts"] + event["dur"] for event in traceEvents), default=0)
+        for name, n in sorted(self.counters.items()):
+            traceEvents.append({"name": name, "ph": "C", "ts": endUs, "pid": os.getpid(), "args": {name: n}})
+        with open(path, "w") as handle:
+            json.dump({"traceEvents": traceEvents, "displayTimeUnit": "ms"}, handle)
+
+def enable():
+    '''
+    Turns profiling on globally until disable is called
+
+    Returns: The profiler that collects the results (Profiler)
+    '''
+    return Profiler().start()
+
+def disable():
+    '''
+    Turns off the profiling turned on by enable
+
+    Returns: The profiler that collected the results, or None if profiling was off (Profiler)
+    '''
+    if (activeProfiler is None):
+        return None
+    return activeProfiler.stop()
+
+def count(name, n=1):
+    '''
+    Adds n to a work counter if profiling is on. In hot loops, check activeProfiler first and count once per call instead.
+
+    name: The name of the counter (str)
+    n: The amount to add (int)
+    '''
+    if (activeProfiler is not None):
+        activeProfiler.counters[name] += n
+
+def stage(name):
+    '''
+    Times a named stage if profiling is on
+
+    name: The name of the stage (str)
+    Returns: A context manager timing the stage (StageTimer or nullcontext)
+    '''
+    if (activeProfiler is None):
+        return nullStage
+    return StageTimer(activeProfiler, name)
+
+def timed(name):
+    '''
+    Decorator that times every call of a function as a named stage if profiling is on
+
+    name: The name of the stage (str)
+    Returns: The decorator (function)
+    '''
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if (activeProfiler is None):
+                return func(*args, **kwargs)
+            with StageTimer(activeProfiler, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+import heapq
+import numpy as np
+import hairpin as hp
+import linguisticcomplexity as lc
+
+@dataclass
+class ScoreWeights:
+    '''
+    Describes how the composite penalty of a candidate is built. Each term is a non-negative distance from an ideal value
+    times its weight, so a lower penalty is better and 0 is a perfect candidate.
+
+    optimalTm: A float representing the preferred melting temperature
+    tmWeight: A float representing the penalty per degree away from optimalTm
+    optimalGC: A float representing the preferred GC content in percent
+    gcWeight: A float representing the penalty per percent away from optimalGC
+    optimalClamp: An integer representing the preferred number of G's and C's in the last five bases
+    clampWeight: A float representing the penalty per base away from optimalClamp
+    hairpinThreshold: A float representing the hairpin Gibbs free energy in kcal/mol below which hairpins are penalized
+    hairpinWeight: A float representing the penalty per kcal/mol below hairpinThreshold, 0 to skip the hairpin search
+    linCompWeight: A float representing the penalty per unit of linguistic complexity below 1, 0 to skip counting it
+    '''
+    optimalTm: float = 60.0
+    tmWeight: float = 1.0
+    optimalGC: float = 50.0
+    gcWeight: float = 0.1
+    optimalClamp: int = 2
+    clampWeight: float = 0.5
+    hairpinThreshold: float = 0.0
+    hairpinWeight: float = 1.0
+    linCompWeight: float = 0.0
+
+def calcBasePenalty(meltTemp, gcContent, gcInClamp, weights):
+    '''
+    Calculates the terms of the composite penalty that come from the window scan, which works on single values or on the
+    arrays of a WindowScan. The other terms are never negative, so this is a lower bound on the composite penalty.
+
+    meltTemp: The melting temperature (float or np.ndarray)
+    gcContent: The GC content in percent (float or np.ndarray)
+    gcInClamp: The number of G's and C's in the last five bases (int or np.ndarray)
+    weights: The weights of the terms (ScoreWeights)
+    Returns: The penalty (float or np.ndarray)
+    '''
+    return (weights.tmWeight * np.abs(meltTemp - weights.optimalTm) + weights.gcWeight * np.abs(gcContent - weights.optimalGC) +
+            weights.clampWeight * np.abs(gcInClamp - weights.optimalClamp))
+
+def calcStructurePenalty(seq, weights, maxPenalty=None):
+    '''
+    Calculates the terms of the composite penalty that need the sequence of the candidate: hairpins and linguistic complexity.
+    The hairpin search stops as soon as it shows there is no hairpin below weights.hairpinThreshold, and the complexity is
+    only counted if the hairpin term has not already passed maxPenalty.
+
+    seq: The sequence of the candidate (str or EncodedSeq)
+    weights: The weights of the terms (ScoreWeights)
+    maxPenalty: A penalty above which the exact value does not matter, or None (float)
+    Returns: The penalty (float)
+    '''
+    penalty = 0.0
+    if (weights.hairpinWeight > 0):
+        hairpin = hp.bestHairpin(seq, weights.hairpinThreshold)
+        if (hairpin is not None and hairpin.totalGibbs < weights.hairpinThreshold):
+            penalty += weights.hairpinWeight * (weights.hairpinThreshold - hairpin.totalGibbs)
+    if (weights.linCompWeight > 0 and (maxPenalty is None or penalty <= maxPenalty)):
+        penalty += weights.linCompWeight * max(0.0, 1 - lc.calcLinComp(seq))
+    return penalty
+
+class TopKRanker:
+    '''
+    Keeps the k candidates with the lowest composite penalty of each region as candidates stream past, so memory grows with
+    k times the number of regions rather than with the number of candidates. The structure terms of a candidate are only
+    calculated if its base penalty could still get it into its region's top k.
+
+    k: The number of candidates to keep per region (int)
+    weights: The weights of the composite penalty, or None for the defaults (ScoreWeights)
+    '''
+    def __init__(self, k, weights=None):
+        if (k < 1):
+            raise ValueError("k must be at least 1")
+        self.k = k
+        self.weights = weights if weights is not None else ScoreWeights()
+        # Max-heap of (-penalty, -order, candidate) per region, so that the worst kept candidate is popped first
+        self.heaps = {}
+        self.numAdded = 0
+        self.numScored = 0
+
+    def getWorstPenalty(self, region):
+        '''
+        Returns: The penalty a candidate of the region has to beat to be kept, or None while the region has fewer than k
+        candidates (float)
+        '''
+        heap = self.heaps.get(region)
+        if (heap is None or len(heap) < self.k):
+            return None
+        return -heap[0][0]
+
+    def add(self, region, seq, basePenalty, candidate):
+        '''
+        Offers a candidate to the top k of its region. Candidates are ranked by penalty, and ties go to the earlier candidate.
+
+        region: A key naming the region of the candidate, such as (record, region number) (hashable)
+        seq: The sequence of the candidate (str or EncodedSeq)
+        basePenalty: The penalty of the candidate from calcBasePenalty (float)
+        candidate: The item to keep, such as an output row (any)
+        Returns: Whether the candidate was kept for now (bool)
+        '''
+        order = self.numAdded
+        self.numAdded += 1
+        worst = self.getWorstPenalty(region)
+        if (worst is not None and basePenalty >= worst):
+            return False
+        self.numScored += 1
+        penalty = basePenalty + calcStructurePenalty(seq, self.weights, None if worst is None else worst - basePenalty)
+        item = (-penalty, -order, candidate)
+        heap = self.heaps.setdefault(region, [])
+        if (len(heap) < self.k):
+            heapq.heappush(heap, item)
+        elif (item > heap[0]):
+            heapq.heapreplace(heap, item)
+        else:
+            return False
+        return True
+
+    def getRegions(self):
+        return list(self.heaps)
+
+    def getTop(self, region):
+        '''
+        Returns: The kept candidates of a region and their penalties, from lowest to highest penalty (list of tuple)
+        '''
+        return [(candidate, -negPenalty) for negPenalty, negOrder, candidate in sorted(self.heaps.get(region, []), reverse=True)]
+
+def rankCandidates(candidates, k, weights=None, regionSize=None):
+    '''
+    Ranks candidate rows as produced by main.iterCandidates, keeping the k best per region of each record
+
+    candidates: Rows of record, start, end, length, seq, meltTemp, gcContent and gcInClamp (iterable of tuple)
+    k: The number of candidates to keep per region (int)
+    weights: The weights of the composite penalty, or None for the defaults (ScoreWeights)
+    regionSize: The number of bases of each region a record is split into by candidate start, or None for one region per
+    record (int)
+    Returns: The ranker holding the best candidates of each region (TopKRanker)
+    '''
+    ranker = TopKRanker(k, weights)
+    for row in candidates:
+        record, start, end, length, seq, meltTemp, gcContent, gcInClamp = row
+        region = (record, 0 if regionSize is None else start // regionSize)
+        ranker.add(region, seq, calcBasePenalty(meltTemp, gcContent, gcInClamp, ranker.weights), row)
+    return ranker
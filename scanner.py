@@ -0,0 +1,243 @@
+from dataclasses import dataclass
+import numpy as np
+import hairpin as hp
+import nndata as nn
+import seqtools as st
+
+# Number of bases at the 3' end that make up the GC clamp
+clampLen = 5
+
+@dataclass
+class WindowScan:
+    '''
+    Describes the metrics of every candidate window of a template. All fields are NumPy arrays of equal length where
+    index i describes the window seq[start[i]:end[i] + 1]. Windows are ordered by start, then by length.
+
+    start: An integer array of the start location of each window on the template
+    end: An integer array of the end location (inclusive) of each window on the template
+    length: An integer array of the length of each window
+    meltTemp: A float array of the melting temperature of each window
+    gcContent: A float array of the GC content of each window
+    gcInClamp: An integer array of the number of G's and C's in the GC clamp of each window
+    '''
+    start: np.ndarray
+    end: np.ndarray
+    length: np.ndarray
+    meltTemp: np.ndarray
+    gcContent: np.ndarray
+    gcInClamp: np.ndarray
+
+    def __len__(self):
+        return len(self.start)
+
+def encodeSeq(seq):
+    '''
+    Converts a DNA sequence into an array of ASCII codes without copying per character. ASCII bytes, for example in a
+    shared memory buffer, are used without copying.
+
+    seq: A DNA sequence (str, bytes-like or a region view from twobit)
+    Returns: An array of ASCII codes (np.ndarray)
+    '''
+    if (isinstance(seq, str)):
+        seq = seq.encode("ascii")
+    elif (hasattr(seq, "toAscii")):
+        seq = seq.toAscii()
+    return np.frombuffer(seq, dtype=np.uint8)
+
+def calcPrefixCounts(seq):
+    '''
+    Builds cumulative base counts so that the count of a base in seq[i:j] is counts[j] - counts[i]
+
+    seq: A DNA sequence (str or bytes-like)
+    Returns: The cumulative counts of A, of T and of G plus C (tuple of np.ndarray)
+    '''
+    codes = encodeSeq(seq)
+    prefixes = []
+    for mask in (codes == ord("A"), codes == ord("T"), (codes == ord("G")) | (codes == ord("C"))):
+        counts = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(mask, out=counts[1:])
+        prefixes.append(counts)
+    return tuple(prefixes)
+
+def scanWindows(seq, minLen, maxLen):
+    '''
+    Calculates the melting temperature, GC content and GC clamp of every window of a template with a length between minLen and
+    maxLen. Uses cumulative base counts so that each window costs O(1) and gives the same values as primer.Primer.
+
+    seq: A DNA sequence (str or bytes-like)
+    minLen: The minimum window length (int)
+    maxLen: The maximum window length (int)
+    Returns: The metrics of every window (WindowScan)
+    '''
+    if (minLen < clampLen):
+        raise ValueError(f"minLen must be at least {clampLen} to contain a GC clamp")
+    if (maxLen < minLen):
+        raise ValueError("maxLen must be greater than or equal to minLen")
+    prefA, prefT, prefGC = calcPrefixCounts(seq)
+    # Grid of every (start, length) pair, keeping only the windows that fit inside the template
+    lengths = np.arange(minLen, maxLen + 1, dtype=np.int64)
+    starts = np.arange(len(seq), dtype=np.int64)
+    ends = starts[:, None] + lengths[None, :]
+    valid = ends <= len(seq)
+    start = np.broadcast_to(starts[:, None], valid.shape)[valid]
+    length = np.broadcast_to(lengths[None, :], valid.shape)[valid]
+    stop = ends[valid]
+    numA = prefA[stop] - prefA[start]
+    numT = prefT[stop] - prefT[start]
+    numGC = prefGC[stop] - prefGC[start]
+    # Primer.calcMeltTemp counts every base that is not A, T or G as a C
+    numGOrOther = length - numA - numT
+    # Calculate the melting temperature differently based on the size of the strand
+    meltTemp = np.where(length <= 13, (numA + numT) * 2 + numGOrOther * 4, 64.9 + 41 * (numGOrOther - 16.4) / length)
+    gcContent = numGC / length * 100
+    gcInClamp = prefGC[stop] - prefGC[stop - clampLen]
+    return WindowScan(start, stop - 1, length, meltTemp.astype(np.float64), gcContent, gcInClamp)
+
+def findAmbiguousWindows(seq, scan):
+    '''
+    Finds the windows of a scan that contain a base other than A, C, G or T, such as N
+
+    seq: The DNA sequence that was scanned (str or bytes-like)
+    scan: The metrics of every window (WindowScan)
+    Returns: A boolean array where index i tells whether window i contains such a base (np.ndarray)
+    '''
+    codes = encodeSeq(seq)
+    isOther = (codes != ord("A")) & (codes != ord("C")) & (codes != ord("G")) & (codes != ord("T"))
+    counts = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(isOther, out=counts[1:])
+    return counts[scan.end + 1] - counts[scan.start] > 0
+
+def selectWindows(scan, mask):
+    '''
+    Selects some of the windows of a scan
+
+    scan: The metrics of every window (WindowScan)
+    mask: A boolean or index array of the windows to keep (np.ndarray)
+    Returns: The metrics of the selected windows (WindowScan)
+    '''
+    return WindowScan(scan.start[mask], scan.end[mask], scan.length[mask], scan.meltTemp[mask], scan.gcContent[mask],
+                      scan.gcInClamp[mask])
+
+def getWindowSeqs(seq, scan):
+    '''
+    Extracts the bases of every window of a scan
+
+    seq: The DNA sequence that was scanned (str or bytes-like)
+    scan: The metrics of every window (WindowScan)
+    Returns: The sequence of each window (list of str)
+    '''
+    if (isinstance(seq, str)):
+        return [seq[start:end + 1] for start, end in zip(scan.start.tolist(), scan.end.tolist())]
+    codes = encodeSeq(seq)
+    return [codes[start:end + 1].tobytes().decode("ascii") for start, end in zip(scan.start.tolist(), scan.end.tolist())]
+
+def encodeBaseCodes(seq):
+    '''
+    Converts a DNA sequence into 2-bit base codes, with st.padCode for bases other than A, C, G and T so they never pair
+
+    seq: A DNA sequence (str, bytes-like or a region view from twobit)
+    Returns: A NumPy uint8 array of base codes
+    '''
+    codes = np.frombuffer(encodeSeq(seq).tobytes().translate(st.encodeTable), dtype=np.uint8).copy()
+    codes[codes > 3] = st.padCode
+    return codes
+
+def scanHairpinGibbs(seq, length, blockSize=65536):
+    '''
+    Calculates the Gibbs free energy of the best hairpin of every window of one length, the same value as
+    hairpin.bestHairpin up to rounding. The loops of hairpin.iterHairpinSplits have 4 or 5 bases, so a stem is the run of
+    base pairs around a loop centre on the template, and windows that share that centre share the stem. For each loop size
+    the mismatch count and stacking energy of the first i pairs outwards from every centre are built once, in O(L) passes
+    over the template, and every split of every window then costs O(1), for O(n * L) in total.
+
+    seq: A DNA sequence (str, bytes-like or a region view from twobit)
+    length: The window length (int)
+    blockSize: The number of windows scored at a time, which bounds memory use (int)
+    Returns: A float array where index i is the energy of the window starting at i in kcal/mol, NaN where no hairpin fits or
+    the window contains a base other than A, C, G or T (np.ndarray)
+    '''
+    codes = encodeBaseCodes(seq)
+    numWindows = max(len(codes) - length + 1, 0)
+    bestG = np.full(numWindows, np.inf)
+    # The splits only depend on the window length
+    splits = [(loopStart, loopEnd, min(loopStart, length - loopEnd)) for loopStart, loopEnd in hp.iterHairpinSplits("A" * length)]
+    if (not splits or numWindows == 0):
+        return np.full(numWindows, np.nan)
+    maxPairs = max(numPairs for loopStart, loopEnd, numPairs in splits)
+    isBase = codes < st.padCode
+    safeCodes = np.where(isBase, codes, 0).astype(np.int64)
+    # NN contributions of the pair of bases starting at x in a loop and stacked in stem1, as in hairpin.SplitScorer
+    loopPrefixG = np.zeros(len(codes))
+    np.cumsum(nn.loopPairGTable[safeCodes[:-1], safeCodes[1:]], out=loopPrefixG[1:])
+    stemPairG = np.append(nn.duplexPairGTable[safeCodes[1:], safeCodes[:-1]], 0.0)
+    termG = np.where((codes == st.baseToCode["G"]) | (codes == st.baseToCode["C"]), nn.stemTermgcAmtG, nn.stemTermatAmtG)
+    # Codes padded on both sides so that pairs reaching past the template never match
+    padded = np.concatenate([np.full(maxPairs, st.padCode, dtype=np.int64), codes.astype(np.int64),
+                             np.full(maxPairs + 6, st.padCode, dtype=np.int64)])
+    for blockStart in range(0, numWindows, blockSize):
+        blockEnd = min(blockStart + blockSize, numWindows)
+        # Loop centres c are the last base of stem1, between blockStart and the last base of the last window
+        centres = np.arange(blockStart, blockEnd + length)
+        centres = centres[centres < len(codes)]
+        for loopSize in sorted(set(loopEnd - loopStart for loopStart, loopEnd, numPairs in splits)):
+            # numMismatches[i] and stackG[i] describe the first i pairs outwards from each centre, the pair i pairing base
+            # c - i with base c + loopSize + 1 + i
+            isMatch = [padded[maxPairs + centres - i] + padded[maxPairs + centres + loopSize + 1 + i] == 3 for i in range(maxPairs)]
+            numMismatches = [np.zeros(len(centres), dtype=np.int64)]
+            stackG = [np.zeros(len(centres)), np.zeros(len(centres))]
+            for i in range(maxPairs):
+                numMismatches.append(numMismatches[-1] + ~isMatch[i])
+                if (i >= 1):
+                    stackG.append(stackG[-1] + np.where(isMatch[i - 1] & isMatch[i], stemPairG[np.maximum(centres - i, 0)], 0.0))
+            closingG = np.where(isMatch[0], termG[centres], 0.0)
+            loopG = loopPrefixG[np.minimum(centres + loopSize + 1, len(codes) - 1)] - loopPrefixG[centres]
+            for loopStart, loopEnd, numPairs in splits:
+                if (loopEnd - loopStart != loopSize):
+                    continue
+                # The centre of the split of window w is w + loopStart - 1
+                index = np.arange(blockStart, blockEnd) + loopStart - 1 - blockStart
+                G = (stackG[numPairs][index] + closingG[index]) + loopG[index] + nn.mismatchPenalty * numMismatches[numPairs][index]
+                np.minimum(bestG[blockStart:blockEnd], G, out=bestG[blockStart:blockEnd])
+    # Windows with a base other than A, C, G or T have no defined energy
+    otherCounts = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(~isBase, out=otherCounts[1:])
+    hasOther = otherCounts[length:length + numWindows] > otherCounts[:numWindows]
+    bestG[hasOther] = np.nan
+    return bestG
+
+def scanSelfCompScores(seq, length, blockSize=65536):
+    '''
+    Calculates the self-complementarity score of every window of one length: the highest dimer.calcScoreDimer of the window
+    with itself over every offset, as on the diagonal of dimer.calcDimerMatrix. Every offset pairs the bases of a window
+    whose locations on the template have the same sum, nested around a centre, so counting the complementary pairs within each
+    distance of every centre once lets every offset of every window be scored in O(1), for O(n * L) in total.
+
+    seq: A DNA sequence (str, bytes-like or a region view from twobit)
+    length: The window length (int)
+    blockSize: The number of windows scored at a time, which bounds memory use (int)
+    Returns: An integer array where index i is the score of the window starting at i, where bases other than A, C, G and T
+    never pair (np.ndarray)
+    '''
+    codes = encodeBaseCodes(seq).astype(np.int64)
+    numWindows = max(len(codes) - length + 1, 0)
+    bestScore = np.full(numWindows, np.iinfo(np.int64).min)
+    padded = np.concatenate([codes, np.full(length, st.padCode, dtype=np.int64)])
+    for blockStart in range(0, numWindows, blockSize):
+        blockEnd = min(blockStart + blockSize, numWindows)
+        lefts = np.arange(blockStart, blockEnd + length)
+        # numPairs[g][p] is the number of complementary pairs (p + j, p + g - j) for j >= 0 with a gap g - 2j of at least 0,
+        # the pairs nested inside (p, p + g)
+        numPairs = []
+        for gap in range(length):
+            isPair = (padded[lefts] + padded[np.minimum(lefts + gap, len(padded) - 1)] == 3).astype(np.int64)
+            if (gap >= 2):
+                isPair[:-1] += numPairs[gap - 2][1:]
+            numPairs.append(isPair)
+        windows = np.arange(blockEnd - blockStart)
+        for j in range(2 * length - 1):
+            # Offsets pair location p with location 2w + j - p, and the outermost pair inside the window has gap maxGap
+            maxGap = min(j, 2 * length - 2 - j)
+            # Both orientations of each pair count as a match, and the overlap has maxGap + 1 bases
+            score = 4 * numPairs[maxGap][windows + (j - maxGap) // 2] - (maxGap + 1)
+            np.maximum(bestScore[blockStart:blockEnd], score, out=bestScore[blockStart:blockEnd])
+    return bestScore
@@ -1,31 +1,183 @@
-def getCompBase(base):
-    if (base == "A"):
-        return "T"
-    elif (base == "T"):
-        return "A"
-    elif (base == "G"):
-        return "C"
+import numpy as np
+
+# 2-bit codes for each DNA base. The complement of a base's code is 3 minus the code.
+baseToCode = {"A": 0, "C": 1, "G": 2, "T": 3}
+codeToBase = "ACGT"
+encodeTable = bytes.maketrans(b"ACGTacgt", bytes([0, 1, 2, 3, 0, 1, 2, 3]))
+decodeTable = bytes.maketrans(bytes([0, 1, 2, 3]), b"ACGT")
+compCodeTable = bytes.maketrans(bytes([0, 1, 2, 3]), bytes([3, 2, 1, 0]))
+# Code used to pad sequences of a batch up to the longest one. It is never complementary to a base.
+padCode = 4
+# Complement of each IUPAC base, where an ambiguity code is complemented to the code of the complements of its bases
+compBases = {"A": "T", "T": "A", "G": "C", "C": "G", "R": "Y", "Y": "R", "S": "S", "W": "W", "K": "M", "M": "K", "B": "V",
+             "V": "B", "D": "H", "H": "D", "N": "N"}
+
+class CompTable(dict):
+    '''
+    str.translate table for complementing a sequence. Like getCompBase, it raises a ValueError for characters that are not IUPAC
+    bases instead of guessing.
+    '''
+    def __missing__(self, key):
+        raise ValueError(f"Cannot complement {chr(key)!r}, which is not an IUPAC base")
+
+compTable = CompTable({ord(base): comp for base, comp in compBases.items()})
+compTable.update({ord(base.lower()): comp.lower() for base, comp in compBases.items()})
+
+class EncodedSeq:
+    '''
+    Describes a DNA sequence stored as one 2-bit base code per byte (A=0, C=1, G=2, T=3) in a NumPy uint8 array. Slicing,
+    reversing and complementing return views that share the array instead of copying it. The codes attribute supports the
+    buffer protocol, so memoryview(encSeq.codes) exposes the codes without copying.
+
+    codes: A NumPy uint8 array of base codes, possibly a sliced or reversed view of another sequence's array
+    isComp: A boolean telling whether the sequence is the complement of codes
+    '''
+    def __init__(self, codes, isComp=False):
+        self.codes = codes
+        self.isComp = isComp
+
+    @classmethod
+    def fromStr(cls, seq):
+        '''
+        Encodes a DNA sequence. Lowercase bases are accepted.
+
+        seq: A DNA sequence (str)
+        Returns: The encoded sequence (EncodedSeq)
+        '''
+        codes = np.frombuffer(seq.encode("ascii").translate(encodeTable), dtype=np.uint8)
+        if (len(codes) > 0 and codes.max() > 3):
+            invalid = sorted(set(base for base in seq if base.upper() not in baseToCode))
+            raise ValueError(f"Cannot encode bases other than A, C, G and T: {', '.join(invalid)}")
+        return cls(codes)
+
+    def getCodes(self):
+        '''
+        Returns: The base codes of the sequence, copied only if the complement has to be applied (np.ndarray)
+        '''
+        if (self.isComp):
+            return 3 - self.codes
+        return self.codes
+
+    def toBytes(self):
+        '''
+        Returns: The base codes of the sequence (bytes)
+        '''
+        return self.getCodes().tobytes()
+
+    def getComp(self):
+        return EncodedSeq(self.codes, not self.isComp)
+
+    def getRev(self):
+        return EncodedSeq(self.codes[::-1], self.isComp)
+
+    def getRevComp(self):
+        return EncodedSeq(self.codes[::-1], not self.isComp)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        if (isinstance(key, slice)):
+            return EncodedSeq(self.codes[key], self.isComp)
+        code = int(self.codes[key])
+        return codeToBase[3 - code if self.isComp else code]
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __eq__(self, other):
+        if (isinstance(other, str)):
+            return str(self) == other
+        if (isinstance(other, EncodedSeq)):
+            return len(self) == len(other) and bool(np.array_equal(self.getCodes(), other.getCodes()))
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __str__(self):
+        return self.toBytes().translate(decodeTable).decode("ascii")
+
+    def __repr__(self):
+        return f"EncodedSeq('{self}')"
+
+def toEncodedSeq(seq):
+    '''
+    Converts a sequence to an EncodedSeq at an API boundary
+
+    seq: A DNA sequence (str, EncodedSeq or a region view from twobit)
+    Returns: The encoded sequence, or seq itself if it is already encoded (EncodedSeq)
+    '''
+    if (isinstance(seq, EncodedSeq)):
+        return seq
+    if (hasattr(seq, "toEncodedSeq")):
+        return seq.toEncodedSeq()
+    return EncodedSeq.fromStr(seq)
+
+def toCodeBytes(seq):
+    '''
+    Converts a sequence to its base codes, which can be indexed from Python much faster than a NumPy array
+
+    seq: A DNA sequence (str or EncodedSeq)
+    Returns: The base codes of the sequence (bytes)
+    '''
+    return toEncodedSeq(seq).toBytes()
+
+def encodeBatch(seqs):
+    '''
+    Encodes a batch of sequences as the rows of a matrix padded with padCode
+
+    seqs: A list of DNA sequences (list of str or EncodedSeq)
+    Returns: The lengths of the sequences and their padded base codes (tuple of np.ndarray)
+    '''
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    codes = np.full((len(seqs), max(lengths, default=0)), padCode, dtype=np.uint8)
+    if (all(isinstance(seq, str) for seq in seqs)):
+        # Encode all the strings in one call and scatter the codes into their rows
+        rows = np.repeat(np.arange(len(seqs)), lengths)
+        cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        codes[rows, cols] = EncodedSeq.fromStr("".join(seqs)).codes
     else:
-        return "G"
-    
+        for i, seq in enumerate(seqs):
+            codes[i, :lengths[i]] = toEncodedSeq(seq).getCodes()
+    return lengths, codes
+
+def packCodes(codes):
+    '''
+    Packs base codes four to a byte, with the first base in the lowest two bits
+
+    codes: A NumPy uint8 array of base codes
+    Returns: The packed codes (bytes)
+    '''
+    padded = np.zeros((len(codes) + 3) // 4 * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    quads = padded.reshape(-1, 4)
+    return (quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)).tobytes()
+
+def unpackCodes(packed, length):
+    '''
+    Unpacks base codes packed by packCodes
+
+    packed: The packed codes (bytes-like)
+    length: The number of bases (int)
+    Returns: A NumPy uint8 array of base codes
+    '''
+    packed = np.frombuffer(packed, dtype=np.uint8)
+    quads = np.stack([packed & 3, (packed >> 2) & 3, (packed >> 4) & 3, packed >> 6], axis=1)
+    return quads.reshape(-1)[:length]
+
+def getCompBase(base):
+    if (base not in compBases):
+        raise ValueError(f"Cannot complement {base!r}, which is not an uppercase IUPAC base")
+    return compBases[base]
+
 def getCompSeq(seq):
-    compSeq = ""
-    for i in range(len(seq)):
-        if seq[i] == "A":
-            compSeq += "T"
-        elif seq[i] == "T":
-            compSeq += "A"
-        elif seq[i] == "G":
-            compSeq += "C"
-        else:
-            compSeq += "G"
-    return compSeq
+    if (isinstance(seq, EncodedSeq)):
+        return seq.getComp()
+    return seq.translate(compTable)
 
 def getRevSeq(seq):
     return seq[::-1]
-    
+
 def checkPalindromicSeq(seq):
     return(getCompSeq(seq) == getRevSeq(seq))
-
-
-            
\ No newline at end of file
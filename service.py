@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+import os
+import sys
+import time
+import dimer as dm
+import hairpin as hp
+import kmerindex as ki
+import linguisticcomplexity as lc
+import meltingtemp as mt
+import metriccache as mc
+import primer as pr
+import seqtools as st
+
+# Metrics cheap enough to calculate on the event loop, none of which depend on the parameters in nndata
+fastMetrics = {"meltTemp": pr.Primer.calcMeltTemp, "gcContent": pr.Primer.calcGCContent, "gcInClamp": pr.Primer.calcGCInClamp}
+# Metrics calculated for a whole batch at once in the worker pool, and whether each depends on the parameters in nndata
+heavyMetrics = {"nnMeltTemp": True, "hairpinGibbs": True, "selfDimerGibbs": True, "linComp": False}
+defaultMetrics = ["meltTemp", "gcContent", "gcInClamp", "nnMeltTemp", "hairpinGibbs", "selfDimerGibbs"]
+minSeqLen = 5
+maxBodyLen = 10 * 2 ** 20
+
+class RequestError(Exception):
+    '''
+    Raised for a request the service cannot serve, answered with the given HTTP status
+    '''
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def calcHeavyMetrics(seqsByMetric):
+    '''
+    Calculates the heavy metrics of batches of sequences, each with one vectorized call where there is one. Runs in a worker
+    process, so it only takes and returns plain data.
+
+    seqsByMetric: The sequences to calculate each metric for (dict mapping str to list of str)
+    Returns: The value of the metric for each sequence, in the same order (dict mapping str to list)
+    '''
+    results = {}
+    for metric, seqs in seqsByMetric.items():
+        if (not seqs):
+            results[metric] = []
+        elif (metric == "nnMeltTemp"):
+            # NaN is not valid JSON
+            results[metric] = [None if math.isnan(value) else value for value in mt.calcNNMeltTemps(seqs).tolist()]
+        elif (metric == "selfDimerGibbs"):
+            results[metric] = dm.calcPairedDimerGibbs(seqs, seqs)[0].tolist()
+        elif (metric == "hairpinGibbs"):
+            hairpins = [hp.bestHairpin(seq) for seq in seqs]
+            results[metric] = [None if hairpin is None else hairpin.totalGibbs for hairpin in hairpins]
+        elif (metric == "linComp"):
+            results[metric] = [lc.calcLinComp(seq) for seq in seqs]
+    return results
+
+def warmWorker():
+    # Run each metric once so that every table and lazily built structure is ready before the first request
+    calcHeavyMetrics({metric: ["ACGTACGTACGTACGTACGT"] for metric in heavyMetrics})
+
+def calcPercentile(sortedValues, percent):
+    '''
+    Returns: The value below which percent of the sorted values fall, by the nearest-rank method (float)
+    '''
+    if (not sortedValues):
+        return None
+    return sortedValues[max(0, math.ceil(percent / 100 * len(sortedValues)) - 1)]
+
+class DesignService:
+    '''
+    Scores primer candidates for many clients. Requests that arrive within window seconds of each other are merged into one
+    batch, so the vectorized scoring and the worker pool see few large calls instead of many small ones. The metric cache, the
+    NN tables and the k-mer index stay loaded between requests.
+
+    workers: The number of worker processes for the heavy metrics, or 0 to calculate them in a thread (int)
+    window: The number of seconds to wait for more requests after the first one of a batch (float)
+    maxBatch: The maximum number of sequences in a batch (int)
+    cachePath: The path of an SQLite metric cache that survives restarts, or None to only cache in memory (str)
+    kmerIndexDir: The directory of a k-mer index for the endHits metric, or None (str)
+    '''
+    def __init__(self, workers=1, window=0.005, maxBatch=4096, cachePath=None, kmerIndexDir=None):
+        self.window = window
+        self.maxBatch = maxBatch
+        self.cache = mc.MetricCache(path=cachePath)
+        self.kmerIndex = None if kmerIndexDir is None else ki.openKmerIndex(kmerIndexDir)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=warmWorker) if workers > 0 else None
+        self.maxInFlight = max(1, workers)
+        self.queue = None
+        self.slots = None
+        self.numInBatches = 0
+        self.batchTasks = set()
+        self.latencies = deque(maxlen=10000)
+        self.numRequests = 0
+        self.numErrors = 0
+        self.numBatches = 0
+        self.numBatchedSeqs = 0
+        self.maxQueueDepth = 0
+
+    def getQueueDepth(self):
+        # Requests waiting for a batch plus requests in batches being scored
+        return (self.queue.qsize() if self.queue is not None else 0) + self.numInBatches
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.maxInFlight)
+        if (self.executor is not None):
+            # Start the workers now rather than on the first request
+            await asyncio.get_running_loop().run_in_executor(self.executor, warmWorker)
+        self.batcher = asyncio.create_task(self.runBatcher())
+
+    async def stop(self):
+        self.batcher.cancel()
+        if (self.executor is not None):
+            self.executor.shutdown()
+        self.cache.close()
+
+    async def score(self, seqs, metrics):
+        '''
+        Queues sequences to be scored in the next batch
+
+        seqs: The sequences to score (list of str)
+        metrics: The names of the metrics to calculate (list of str)
+        Returns: A dictionary of the metrics of each sequence (list of dict)
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((seqs, metrics, future))
+        self.maxQueueDepth = max(self.maxQueueDepth, self.getQueueDepth())
+        return await future
+
+    async def runBatcher(self):
+        loop = asyncio.get_running_loop()
+        while (True):
+            # Collect requests while every batch slot is busy, then for up to window seconds after the first one
+            await self.slots.acquire()
+            items = [await self.queue.get()]
+            numSeqs = len(items[0][0])
+            deadline = loop.time() + self.window
+            while (numSeqs < self.maxBatch):
+                timeout = deadline - loop.time()
+                try:
+                    # Past the deadline, still take requests that are already waiting
+                    item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                items.append(item)
+                numSeqs += len(item[0])
+            self.numInBatches += len(items)
+            # Keep a reference so the task is not garbage collected while it runs
+            task = asyncio.create_task(self.runBatch(items))
+            self.batchTasks.add(task)
+            task.add_done_callback(self.batchTasks.discard)
+
+    async def runBatch(self, items):
+        try:
+            seqs = [seq for item in items for seq in item[0]]
+            metrics = sorted(set(metric for item in items for metric in item[1]))
+            values = await self.scoreBatch(seqs, metrics)
+            for itemSeqs, itemMetrics, future in items:
+                if (not future.done()):
+                    future.set_result([{metric: values[metric][seq] for metric in itemMetrics} for seq in itemSeqs])
+            self.numBatches += 1
+            self.numBatchedSeqs += len(seqs)
+        except Exception as error:
+            for itemSeqs, itemMetrics, future in items:
+                if (not future.done()):
+                    future.set_exception(error)
+        finally:
+            self.numInBatches -= len(items)
+            self.slots.release()
+
+    async def scoreBatch(self, seqs, metrics):
+        '''
+        Scores a batch of sequences, using cached values where there are any and calculating the rest with one call per metric
+
+        seqs: The sequences to score, which may repeat (list of str)
+        metrics: The names of the metrics to calculate (list of str)
+        Returns: The value of each metric for each distinct sequence (dict mapping str to dict)
+        '''
+        uniqueSeqs = list(dict.fromkeys(seqs))
+        values = {metric: {} for metric in metrics}
+        misses = {}
+        for metric in metrics:
+            if (metric == "endHits"):
+                values[metric] = dict(zip(uniqueSeqs, self.kmerIndex.countHits(uniqueSeqs).tolist()))
+                continue
+            usesParams = heavyMetrics.get(metric, False)
+            for seq in uniqueSeqs:
+                found, value = self.cache.get(metric, seq, usesParams)
+                if (found):
+                    values[metric][seq] = value
+                elif (metric in fastMetrics):
+                    value = fastMetrics[metric](seq)
+                    self.cache.put(metric, seq, value, usesParams)
+                    values[metric][seq] = value
+                else:
+                    misses.setdefault(metric, []).append(seq)
+        if (misses):
+            if (self.executor is not None):
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, calcHeavyMetrics, misses)
+            else:
+                results = await asyncio.to_thread(calcHeavyMetrics, misses)
+            for metric, metricSeqs in misses.items():
+                for seq, value in zip(metricSeqs, results[metric]):
+                    self.cache.put(metric, seq, value, heavyMetrics[metric])
+                    values[metric][seq] = value
+        return values
+
+    def getStats(self):
+        '''
+        Returns: The request counts, latency percentiles in milliseconds, queue depths, batch sizes and cache statistics (dict)
+        '''
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.numRequests,
+            "errors": self.numErrors,
+            "latencyMs": {f"p{percent}": None if not latencies else calcPercentile(latencies, percent) * 1000
+                          for percent in (50, 90, 99)},
+            "queueDepth": self.getQueueDepth(),
+            "maxQueueDepth": self.maxQueueDepth,
+            "batches": self.numBatches,
+            "meanBatchSize": self.numBatchedSeqs / self.numBatches if self.numBatches else 0,
+            "cache": self.cache.getStats(),
+        }
+
+    def parseScoreRequest(self, body):
+        '''
+        Helper method for handleRequest. Checks the body of a /score request.
+
+        body: The decoded JSON body (dict)
+        Returns: The uppercase sequences and the metrics to calculate (tuple)
+        '''
+        if (not isinstance(body, dict) or not isinstance(body.get("seqs"), list)):
+            raise RequestError('Expected a JSON object with a "seqs" list')
+        metrics = body.get("metrics", defaultMetrics)
+        available = set(fastMetrics) | set(heavyMetrics) | ({"endHits"} if self.kmerIndex is not None else set())
+        if (not isinstance(metrics, list) or any(metric not in available for metric in metrics)):
+            raise RequestError(f"metrics must be a list of: {', '.join(sorted(available))}")
+        seqs = []
+        for seq in body["seqs"]:
+            if (not isinstance(seq, str) or len(seq) < minSeqLen):
+                raise RequestError(f"Every sequence must be a string of at least {minSeqLen} bases")
+            try:
+                st.EncodedSeq.fromStr(seq)
+            except ValueError as error:
+                raise RequestError(str(error))
+            if (self.kmerIndex is not None and "endHits" in metrics and len(seq) < self.kmerIndex.k):
+                raise RequestError(f"endHits needs sequences of at least {self.kmerIndex.k} bases")
+            seqs.append(seq.upper())
+        return seqs, metrics
+
+    async def handleRequest(self, method, path, body):
+        '''
+        Routes a request
+
+        method: The HTTP method (str)
+        path: The request path (str)
+        body: The request body (bytes)
+        Returns: The HTTP status and the JSON response (tuple)
+        '''
+        if (method == "GET" and path == "/health"):
+            return 200, {"status": "ok"}
+        if (method == "GET" and path == "/stats"):
+            return 200, self.getStats()
+        if (method == "POST" and path == "/score"):
+            try:
+                request = json.loads(body)
+            except ValueError:
+                raise RequestError("The body is not valid JSON")
+            seqs, metrics = self.parseScoreRequest(request)
+            return 200, {"results": await self.score(seqs, metrics)}
+        raise RequestError(f"No route for {method} {path}", 404)
+
+    async def handleConnection(self, reader, writer):
+        '''
+        Serves HTTP/1.1 requests on one connection until the client closes it
+        '''
+        try:
+            while (True):
+                try:
+                    header = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                start = time.perf_counter()
+                lines = header.decode("latin-1").split("\r\n")
+                requestLine = lines[0].split()
+                headers = {}
+                for line in lines[1:]:
+                    if (":" in line):
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                keepAlive = headers.get("connection", "").lower() != "close" and requestLine[-1:] == ["HTTP/1.1"]
+                try:
+                    if (len(requestLine) != 3):
+                        raise RequestError("Malformed request line")
+                    bodyLen = int(headers.get("content-length", "0"))
+                    if (bodyLen > maxBodyLen):
+                        raise RequestError("Request body too large", 413)
+                    body = await reader.readexactly(bodyLen)
+                    status, response = await self.handleRequest(requestLine[0], requestLine[1].split("?")[0], body)
+                except RequestError as error:
+                    status, response = error.status, {"error": str(error)}
+                    keepAlive = keepAlive and status != 413
+                except (asyncio.IncompleteReadError, ValueError):
+                    status, response, keepAlive = 400, {"error": "Malformed request"}, False
+                except Exception as error:
+                    status, response = 500, {"error": repr(error)}
+                self.numRequests += 1
+                if (status >= 400):
+                    self.numErrors += 1
+                data = json.dumps(response).encode("utf-8")
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large"}.get(status, "Error")
+                writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keepAlive else 'close'}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                self.latencies.append(time.perf_counter() - start)
+                if (not keepAlive):
+                    break
+        finally:
+            writer.close()
+
+async def serve(service, host="127.0.0.1", port=8765):
+    '''
+    Runs the service until cancelled
+
+    service: The service to run (DesignService)
+    host: The address to listen on (str)
+    port: The port to listen on (int)
+    '''
+    await service.start()
+    server = await asyncio.start_server(service.handleConnection, host, port)
+    print(f"Serving on http://{host}:{port}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serves primer scoring over HTTP/JSON on localhost")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for hairpin, dimer and NN scoring, 0 to use a thread")
+    parser.add_argument("--window-ms", type=float, default=5.0, help="milliseconds to wait for more requests to batch")
+    parser.add_argument("--max-batch", type=int, default=4096, help="maximum sequences per batch")
+    parser.add_argument("--cache", help="SQLite file to keep the metric cache in between restarts")
+    parser.add_argument("--kmer-index", help="k-mer index from kmerindex.py, enabling the endHits metric")
+    args = parser.parse_args(argv)
+    service = DesignService(args.workers, args.window_ms / 1000, args.max_batch, args.cache, args.kmer_index)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+import argparse
+from dataclasses import dataclass
+import sys
+import numpy as np
+import fasta
+import kmerindex as ki
+import nndata as nn
+import scanner
+import seqtools as st
+
+@dataclass
+class InvertedRepeats:
+    '''
+    Describes the inverted repeats of a template, which can fold into a stem closed by a loop. All fields are NumPy arrays of
+    equal length where index i describes the stem pairing seq[start1[i] + t] with seq[start2[i] + stemLen[i] - 1 - t].
+
+    start1: An integer array of the location of the first base of the 5' arm
+    start2: An integer array of the location of the first base of the 3' arm
+    stemLen: An integer array of the number of base pairs in the stem
+    loopLen: An integer array of the number of bases between the arms
+    gibbs: A float array of the Gibbs free energy of the stem and loop in kcal/mol
+    '''
+    start1: np.ndarray
+    start2: np.ndarray
+    stemLen: np.ndarray
+    loopLen: np.ndarray
+    gibbs: np.ndarray
+
+    def __len__(self):
+        return len(self.start1)
+
+def calcLoopInitGibbs(loopLens):
+    '''
+    Returns: The initiation free energy in kcal/mol of hairpin loops of the given lengths from nndata.hairpinLoopToG
+    (np.ndarray)
+    '''
+    loopLens = np.asarray(loopLens, dtype=np.float64)
+    loopInitLens = np.array(sorted(nn.hairpinLoopToG), dtype=np.float64)
+    loopInitG = np.array([nn.hairpinLoopToG[loopLen] for loopLen in sorted(nn.hairpinLoopToG)])
+    return np.where(loopLens <= loopInitLens[-1], np.interp(loopLens, loopInitLens, loopInitG),
+                    loopInitG[-1] + nn.hairpinLoopExtrapolationG * np.log(np.maximum(loopLens, 1) / loopInitLens[-1]))
+
+def findSeeds(values, rcValues, isValid, k, minLoop, maxLoop, blockSize):
+    '''
+    Helper function for findInvertedRepeats. Finds every pair of k-mers where the second is the reverse complement of the first
+    and lies minLoop to maxLoop bases after it. The k-mers are sorted once by value and location, so the partners of each k-mer
+    are one range of the sorted keys.
+
+    values: The packed k-mer starting at each location (np.ndarray)
+    rcValues: The packed reverse complement of each k-mer (np.ndarray)
+    isValid: Whether each k-mer only contains A, C, G and T (np.ndarray)
+    Returns: The location of the first and of the second k-mer of each seed (tuple of np.ndarray)
+    '''
+    numKmers = np.uint64(len(values))
+    locations = np.flatnonzero(isValid).astype(np.uint64)
+    keys = np.sort(values[locations] * numKmers + locations)
+    firsts = []
+    seconds = []
+    for blockStart in range(0, len(locations), blockSize):
+        block = locations[blockStart:blockStart + blockSize]
+        base = rcValues[block] * numKmers
+        # Clamp the range to the last k-mer so it never spills into the keys of the next value
+        lastKmer = numKmers - np.uint64(1)
+        low = np.searchsorted(keys, base + np.minimum(block + np.uint64(k + minLoop), lastKmer), "left")
+        high = np.searchsorted(keys, base + np.minimum(block + np.uint64(k + maxLoop), lastKmer), "right")
+        counts = np.where(block + np.uint64(k + minLoop) <= lastKmer, high - low, 0)
+        # Expand each range of partners into one seed per partner
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        firsts.append(np.repeat(block, counts).astype(np.int64))
+        seconds.append((keys[np.repeat(low, counts) + offsets] % numKmers).astype(np.int64))
+    if (not firsts):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+def findInvertedRepeats(seq, k=8, minLoop=3, maxLoop=300, maxGibbs=-4.0, blockSize=8192):
+    '''
+    Finds the inverted repeats of a template with a stem of at least k exactly paired bases and a loop of minLoop to maxLoop
+    bases. Every k-mer is packed into an integer along with its reverse complement in one vectorized pass, and seeds are
+    k-mers whose reverse complement occurs downstream within the loop range. Each stem is reported once, from its innermost
+    seed, after extending it outwards while the bases keep pairing. Stems are scored with the NN stacking energies of nndata,
+    the terminal correction of the closing pair and the initiation energy of the loop.
+
+    seq: A DNA sequence (str, bytes-like or a region view from twobit)
+    k: The seed length, between 4 and 16 (int)
+    minLoop: The minimum loop length (int)
+    maxLoop: The maximum loop length (int)
+    maxGibbs: Only stems with a Gibbs free energy in kcal/mol at or below this are reported (float)
+    blockSize: The number of k-mers whose partners are looked up at a time, which bounds memory use (int)
+    Returns: The inverted repeats, ordered by the location of their 5' arm (InvertedRepeats)
+    '''
+    if (not 4 <= k <= 16):
+        raise ValueError("k must be between 4 and 16")
+    codes = scanner.encodeBaseCodes(seq)
+    numBases = len(codes)
+    values, isValid = ki.calcKmerValues(codes, k)
+    rcValues = ki.calcRevCompValues(values, k)
+    firsts, seconds = findSeeds(values, rcValues, isValid, k, minLoop, maxLoop, blockSize)
+    codes = codes.astype(np.int64)
+    padded = np.concatenate([codes, [st.padCode]])
+
+    def isPair(left, right):
+        # Locations out of the template read the pad code at index -1, which never pairs
+        inside = (left >= 0) & (right < numBases)
+        return inside & (padded[np.where(inside, left, -1)] + padded[np.where(inside, right, -1)] == 3)
+
+    # A seed is innermost unless the next pair inwards also pairs and still leaves a loop of minLoop bases
+    loopLens = seconds - firsts - k
+    isInnermost = ~(isPair(firsts + k, seconds - 1) & (loopLens - 2 >= minLoop))
+    firsts = firsts[isInnermost]
+    seconds = seconds[isInnermost]
+    loopLens = loopLens[isInnermost]
+    # Extend outwards one pair at a time while every stem that is still growing pairs
+    extension = np.zeros(len(firsts), dtype=np.int64)
+    active = np.ones(len(firsts), dtype=bool)
+    while (active.any()):
+        index = np.flatnonzero(active)
+        pairs = isPair(firsts[index] - extension[index] - 1, seconds[index] + k + extension[index])
+        extension[index[pairs]] += 1
+        active[index[~pairs]] = False
+    start1 = firsts - extension
+    stemLen = k + extension
+    # Stacking energies of the 5' arm read 5' to 3', summed with prefix sums
+    stackPrefixG = np.zeros(numBases)
+    safeCodes = np.minimum(codes, 3)
+    np.cumsum(nn.duplexPairGTable[safeCodes[:-1], safeCodes[1:]], out=stackPrefixG[1:])
+    closingCodes = codes[start1 + stemLen - 1]
+    isGC = (closingCodes == st.baseToCode["G"]) | (closingCodes == st.baseToCode["C"])
+    gibbs = (stackPrefixG[start1 + stemLen - 1] - stackPrefixG[start1] + np.where(isGC, nn.stemTermgcAmtG, nn.stemTermatAmtG) +
+             calcLoopInitGibbs(loopLens))
+    keep = gibbs <= maxGibbs
+    order = np.argsort(start1[keep], kind="stable")
+    return InvertedRepeats(start1[keep][order], seconds[keep][order], stemLen[keep][order], loopLens[keep][order],
+                           gibbs[keep][order])
+
+class RiskTrack:
+    '''
+    Describes the structure risk of every base of a template: the stability, as -Gibbs free energy in kcal/mol, of the most
+    stable inverted repeat with an arm covering the base, 0 if there is none. Hot bases are the ones covered by an arm of a
+    repeat that counts as a risk, and cumulative counts of hot bases let any window be checked in O(1).
+
+    risk: A float array of the risk of each base
+    isHot: A boolean array of whether each base is hot
+    '''
+    def __init__(self, risk, isHot):
+        self.risk = risk
+        self.isHot = isHot
+        self.hotCounts = np.zeros(len(risk) + 1, dtype=np.int64)
+        np.cumsum(isHot, out=self.hotCounts[1:])
+
+    def __len__(self):
+        return len(self.risk)
+
+    def countHotBases(self, starts, ends):
+        '''
+        Counts the hot bases of windows
+
+        starts: The location of the first base of each window (int or np.ndarray)
+        ends: The location of the last base of each window, inclusive (int or np.ndarray)
+        Returns: The number of hot bases in each window (int or np.ndarray)
+        '''
+        return self.hotCounts[np.asarray(ends) + 1] - self.hotCounts[starts]
+
+def createRiskTrack(seq, repeats, minRisk=None):
+    '''
+    Builds the per-base risk track of a template from its inverted repeats
+
+    seq: The DNA sequence the repeats were found in (str, bytes-like or a region view from twobit)
+    repeats: The inverted repeats (InvertedRepeats)
+    minRisk: The stability above which a repeat makes the bases of its arms hot, or None for every repeat (float)
+    Returns: The risk track (RiskTrack)
+    '''
+    risk = np.full(len(seq), -np.inf)
+    isHot = np.zeros(len(seq), dtype=bool)
+    if (len(repeats) > 0):
+        # Every base of both arms of each stem, with the stability of the stem
+        offsets = np.arange(repeats.stemLen.sum()) - np.repeat(np.cumsum(repeats.stemLen) - repeats.stemLen, repeats.stemLen)
+        stability = np.repeat(-repeats.gibbs, repeats.stemLen)
+        isRisk = np.ones(len(stability), dtype=bool) if minRisk is None else stability > minRisk
+        for starts in (repeats.start1, repeats.start2):
+            locations = np.repeat(starts, repeats.stemLen) + offsets
+            np.maximum.at(risk, locations, stability)
+            isHot[locations[isRisk]] = True
+    # Stems can be reported with a positive energy, so a covered base may have a risk of 0 or below
+    risk[np.isneginf(risk)] = 0.0
+    return RiskTrack(risk, isHot)
+
+def scanStructureRisk(seq, k=8, minLoop=3, maxLoop=300, maxGibbs=-4.0):
+    '''
+    Finds the inverted repeats of a template and builds its risk track, where every base of a stem with a Gibbs free energy
+    at or below maxGibbs is hot
+
+    seq: A DNA sequence (str, bytes-like or a region view from twobit)
+    k, minLoop, maxLoop, maxGibbs: See findInvertedRepeats
+    Returns: The risk track (RiskTrack)
+    '''
+    return createRiskTrack(seq, findInvertedRepeats(seq, k, minLoop, maxLoop, maxGibbs))
+
+class ChunkRiskTracks:
+    '''
+    Builds the risk track of each record once from all of its chunks and hands each chunk the hot bases it covers, so the
+    structure risk of a window does not depend on where the record was cut into chunks. The chunks of a record are held
+    until its last chunk arrives, and only one record's track is kept at a time.
+
+    maxGibbs: Inverted repeats with a Gibbs free energy in kcal/mol at or below this make their bases hot (float)
+    k, minLoop, maxLoop: See findInvertedRepeats
+    '''
+    def __init__(self, maxGibbs=-4.0, k=8, minLoop=3, maxLoop=300):
+        self.maxGibbs = maxGibbs
+        self.k = k
+        self.minLoop = minLoop
+        self.maxLoop = maxLoop
+        # Hot masks of the chunks passed through and not yet consumed, keyed by record name and chunk start
+        self.hotMasks = {}
+
+    def iterChunks(self, chunks):
+        '''
+        Passes chunks through once the risk track of their record is built, for wrapping the chunks given to a scan
+
+        chunks: The chunks of a file, with the chunks of each record in order (iterable of FastaChunk)
+        Returns: The same chunks (generator of FastaChunk)
+        '''
+        recordChunks = []
+        for chunk in chunks:
+            recordChunks.append(chunk)
+            if (not chunk.isLast):
+                continue
+            # The bases owned by each chunk make up the record
+            seq = "".join(str(part.seq[:part.numOwned]) for part in recordChunks)
+            track = scanStructureRisk(seq, self.k, self.minLoop, self.maxLoop, self.maxGibbs)
+            del seq
+            for part in recordChunks:
+                key = (part.name, part.start)
+                self.hotMasks[key] = track.isHot[part.start:part.start + len(part.seq)]
+                yield part
+                self.hotMasks.pop(key, None)
+            recordChunks = []
+
+    def getHotMask(self, chunk):
+        '''
+        Returns: Whether each base of a chunk that was just passed through is hot (np.ndarray)
+        '''
+        return self.hotMasks[(chunk.name, chunk.start)]
+
+def writeBedGraph(name, track, handle, offset=0):
+    '''
+    Writes the runs of hot bases of a risk track as bedGraph lines
+
+    name: The name of the record (str)
+    track: The risk track (RiskTrack)
+    handle: A text file object to write to
+    offset: The location of the first base of the track on the record (int)
+    Returns: The number of lines written (int)
+    '''
+    risk = track.risk
+    # A run ends wherever the risk or whether the base is hot changes
+    isEdge = np.ones(len(risk) + 1, dtype=bool)
+    isEdge[1:-1] = (risk[1:] != risk[:-1]) | (track.isHot[1:] != track.isHot[:-1])
+    edges = np.flatnonzero(isEdge)
+    numLines = 0
+    for start, end in zip(edges[:-1].tolist(), edges[1:].tolist()):
+        if (track.isHot[start]):
+            handle.write(f"{name}\t{start + offset}\t{end + offset}\t{risk[start]:.2f}\n")
+            numLines += 1
+    return numLines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes a per-base secondary structure risk track of a template as bedGraph")
+    parser.add_argument("fasta", help="FASTA file, optionally gzipped, or - for standard input")
+    parser.add_argument("-o", "--output", default="-", help="bedGraph file to write, or - for standard output")
+    parser.add_argument("-k", type=int, default=8, help="minimum stem length")
+    parser.add_argument("--min-loop", type=int, default=3, help="minimum loop length")
+    parser.add_argument("--max-loop", type=int, default=300, help="maximum loop length")
+    parser.add_argument("--max-gibbs", type=float, default=-4.0, help="only report stems at or below this energy in kcal/mol")
+    args = parser.parse_args(argv)
+    inHandle = fasta.openFasta(args.fasta)
+    outHandle = sys.stdout if args.output == "-" else open(args.output, "w")
+    numLines = 0
+    try:
+        # Read whole records so that stems are not cut at chunk edges
+        for chunk in fasta.iterFastaChunks(inHandle, sys.maxsize):
+            track = scanStructureRisk(chunk.seq, args.k, args.min_loop, args.max_loop, args.max_gibbs)
+            numLines += writeBedGraph(chunk.name, track, outHandle, chunk.start)
+    finally:
+        if (inHandle is not sys.stdin):
+            inHandle.close()
+        if (outHandle is not sys.stdout):
+            outHandle.close()
+    print(f"Wrote {numLines} risk intervals", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
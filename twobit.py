@@ -0,0 +1,249 @@
+import argparse
+import json
+import struct
+import sys
+import numpy as np
+import fasta
+import seqtools as st
+
+# File layout: a header of magic, version, index offset and index length, then for each record its bases packed four to a
+# byte by seqtools.packCodes followed by the starts and lengths of its runs of bases other than A, C, G and T as int64
+# arrays, then a JSON index of the records.
+magic = b"PD2B"
+formatVersion = 1
+headerFormat = "<4sIQQ"
+headerSize = struct.calcsize(headerFormat)
+# Translates codes from RegionView.getCodes to ASCII
+asciiTable = bytes.maketrans(bytes([0, 1, 2, 3, st.padCode]), b"ACGTN")
+
+def isTwoBitFile(path):
+    '''
+    Returns: Whether the file at path starts like a file written by convertFasta (bool)
+    '''
+    if (path == "-"):
+        return False
+    with open(path, "rb") as handle:
+        return handle.read(len(magic)) == magic
+
+def findOtherRuns(codes):
+    '''
+    Helper function for convertFasta. Finds the runs of bases other than A, C, G and T, such as N.
+
+    codes: A NumPy uint8 array of base codes, where codes above 3 are other bases
+    Returns: The start and length of each run (tuple of np.ndarray)
+    '''
+    isOther = np.concatenate([[False], codes > 3, [False]])
+    edges = np.flatnonzero(isOther[1:] != isOther[:-1])
+    starts = edges[0::2]
+    return starts.astype(np.int64), (edges[1::2] - starts).astype(np.int64)
+
+def convertFasta(fastaPath, outPath, chunkSize=1 << 20):
+    '''
+    Converts a FASTA file into the 2-bit packed format read by TwoBitFile. The FASTA file is streamed, so memory use depends
+    on the chunk size and the number of runs of other bases rather than on the size of the genome. Bases other than A, C, G and
+    T are stored as A in the packed bases and restored as N from the run table.
+
+    fastaPath: The path of the FASTA file, optionally gzipped, or "-" for standard input (str)
+    outPath: The path of the packed file to write (str)
+    chunkSize: The number of bases read at a time, rounded down to a multiple of four (int)
+    Returns: The number of records written (int)
+    '''
+    chunkSize = max(4, chunkSize // 4 * 4)
+    records = []
+    inHandle = fasta.openFasta(fastaPath)
+    try:
+        with open(outPath, "wb") as outHandle:
+            outHandle.write(struct.pack(headerFormat, magic, formatVersion, 0, 0))
+
+            def finishRecord():
+                # Write the run table of the record, aligned to 8 bytes
+                record = records[-1]
+                outHandle.write(b"\0" * (-outHandle.tell() % 8))
+                record["runOffset"] = outHandle.tell()
+                starts = np.array(record.pop("runStarts"), dtype=np.int64)
+                lengths = np.array(record.pop("runLengths"), dtype=np.int64)
+                record["numRuns"] = len(starts)
+                outHandle.write(starts.tobytes())
+                outHandle.write(lengths.tobytes())
+
+            for chunk in fasta.iterFastaChunks(inHandle, chunkSize):
+                if (chunk.start == 0):
+                    if (records):
+                        finishRecord()
+                    records.append({"name": chunk.name, "length": 0, "dataOffset": outHandle.tell(), "runStarts": [],
+                                    "runLengths": []})
+                record = records[-1]
+                codes = np.frombuffer(chunk.seq.encode("ascii").translate(st.encodeTable), dtype=np.uint8).copy()
+                starts, lengths = findOtherRuns(codes)
+                for start, length in zip((starts + chunk.start).tolist(), lengths.tolist()):
+                    # Join a run that continues from the previous chunk
+                    if (record["runStarts"] and record["runStarts"][-1] + record["runLengths"][-1] == start):
+                        record["runLengths"][-1] += length
+                    else:
+                        record["runStarts"].append(start)
+                        record["runLengths"].append(length)
+                codes[codes > 3] = 0
+                # Every chunk but the last of a record is a multiple of four bases, so the packed bytes line up
+                outHandle.write(st.packCodes(codes))
+                record["length"] = chunk.start + len(codes)
+            if (records):
+                finishRecord()
+            indexOffset = outHandle.tell()
+            index = json.dumps({"records": records}).encode("utf-8")
+            outHandle.write(index)
+            outHandle.seek(0)
+            outHandle.write(struct.pack(headerFormat, magic, formatVersion, indexOffset, len(index)))
+    finally:
+        if (inHandle is not sys.stdin):
+            inHandle.close()
+    return len(records)
+
+class RegionView:
+    '''
+    Describes a region of a record in a TwoBitFile. The packed bytes are a view of the memory-mapped file, and the bases are
+    only unpacked, at one byte per base, when the region is first used as a sequence.
+
+    packed: A NumPy uint8 array of the packed bytes covering the region, a view of the file
+    shift: The number of bases before the region in the first packed byte (int)
+    length: The number of bases in the region (int)
+    runStarts: The starts of the runs of other bases that overlap the region, relative to the region (np.ndarray)
+    runLengths: The lengths of those runs, clipped to the region (np.ndarray)
+    '''
+    def __init__(self, packed, shift, length, runStarts, runLengths):
+        self.packed = packed
+        self.shift = shift
+        self.length = length
+        self.runStarts = runStarts
+        self.runLengths = runLengths
+        self.codes = None
+
+    def __len__(self):
+        return self.length
+
+    def hasOtherBases(self):
+        return len(self.runStarts) > 0
+
+    def getCodes(self):
+        '''
+        Returns: The base codes of the region, where bases other than A, C, G and T are st.padCode (np.ndarray)
+        '''
+        if (self.codes is None):
+            codes = st.unpackCodes(self.packed, self.shift + self.length)[self.shift:].copy()
+            for start, length in zip(self.runStarts.tolist(), self.runLengths.tolist()):
+                codes[start:start + length] = st.padCode
+            self.codes = codes
+        return self.codes
+
+    def toEncodedSeq(self):
+        '''
+        Returns: The bases of the region (EncodedSeq)
+        '''
+        if (self.hasOtherBases()):
+            raise ValueError("Cannot encode bases other than A, C, G and T: N")
+        return st.EncodedSeq(self.getCodes())
+
+    def toAscii(self):
+        '''
+        Returns: The bases of the region as ASCII, with N for bases other than A, C, G and T (bytes)
+        '''
+        return self.getCodes().tobytes().translate(asciiTable)
+
+    def __getitem__(self, key):
+        return self.toEncodedSeq()[key]
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __str__(self):
+        return self.toAscii().decode("ascii")
+
+    def __repr__(self):
+        return f"RegionView('{self}')" if self.length <= 50 else f"RegionView(<{self.length} bases>)"
+
+class TwoBitFile:
+    '''
+    Reads a file written by convertFasta. The file is memory-mapped, so opening it only reads the header and the record index
+    and the bases are paged in as regions are used.
+
+    path: The path of the file (str)
+    '''
+    def __init__(self, path):
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        fileMagic, version, indexOffset, indexLen = struct.unpack(headerFormat, self.data[:headerSize].tobytes())
+        if (fileMagic != magic):
+            raise ValueError(f"{path} is not a 2-bit packed sequence file")
+        if (version != formatVersion):
+            raise ValueError(f"Unsupported 2-bit packed sequence file version {version}")
+        self.records = json.loads(self.data[indexOffset:indexOffset + indexLen].tobytes())["records"]
+        self.recordIndexes = {record["name"]: i for i, record in enumerate(self.records)}
+
+    def getNames(self):
+        return [record["name"] for record in self.records]
+
+    def getLength(self, name):
+        return self.records[self.recordIndexes[name]]["length"]
+
+    def getRuns(self, name):
+        '''
+        Returns: The start and length of each run of bases other than A, C, G and T in a record, as views of the file (tuple
+        of np.ndarray)
+        '''
+        record = self.records[self.recordIndexes[name]]
+        runs = self.data[record["runOffset"]:record["runOffset"] + 16 * record["numRuns"]].view(np.int64)
+        return runs[:record["numRuns"]], runs[record["numRuns"]:]
+
+    def getRegion(self, name, start=0, end=None):
+        '''
+        Gets a view of the bases of a record from start up to but not including end
+
+        name: The name of the record (str)
+        start: The location of the first base of the region (int)
+        end: The location after the last base of the region, or None for the end of the record (int)
+        Returns: The region (RegionView)
+        '''
+        record = self.records[self.recordIndexes[name]]
+        if (end is None):
+            end = record["length"]
+        if (not 0 <= start <= end <= record["length"]):
+            raise ValueError(f"Region {start}-{end} is outside {name}, which has {record['length']} bases")
+        runStarts, runLengths = self.getRuns(name)
+        # Runs overlapping the region, clipped to it
+        first = np.searchsorted(runStarts + runLengths, start, "right")
+        last = np.searchsorted(runStarts, end, "left")
+        clippedStarts = np.maximum(runStarts[first:last], start)
+        clippedEnds = np.minimum(runStarts[first:last] + runLengths[first:last], end)
+        packed = self.data[record["dataOffset"] + start // 4:record["dataOffset"] + (end + 3) // 4]
+        return RegionView(packed, start % 4, end - start, clippedStarts - start, clippedEnds - clippedStarts)
+
+def iterTwoBitChunks(path, chunkSize=1000000, overlap=0):
+    '''
+    Streams the records of a 2-bit packed file as overlapping chunks, like fasta.iterFastaChunks
+
+    path: The path of the file (str)
+    chunkSize: The number of bases each chunk owns (int)
+    overlap: The number of bases each chunk shares with the next chunk of the record (int)
+    Returns: A generator of chunks in file order (generator of FastaChunk)
+    '''
+    twoBit = TwoBitFile(path)
+    for name in twoBit.getNames():
+        length = twoBit.getLength(name)
+        start = 0
+        while (True):
+            end = min(start + chunkSize + overlap, length)
+            isLast = end == length
+            seq = str(twoBit.getRegion(name, start, end))
+            yield fasta.FastaChunk(name, start, seq, len(seq) if isLast else chunkSize, isLast)
+            if (isLast):
+                break
+            start += chunkSize
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converts a FASTA file to a memory-mappable 2-bit packed file")
+    parser.add_argument("fasta", help="FASTA file, optionally gzipped, or - for standard input")
+    parser.add_argument("output", help="packed file to write")
+    args = parser.parse_args(argv)
+    numRecords = convertFasta(args.fasta, args.output)
+    print(f"Wrote {numRecords} records", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()